@@ -15,7 +15,6 @@ try:
 except:
     # no they aren't
     from baseclient import BaseClient as _BaseClient  # @Reimport
-import time
 
 
 class AssemblyUtil(object):
@@ -60,16 +59,8 @@ class AssemblyUtil(object):
            parameter "path" of String, parameter "assembly_name" of String
         """
         job_id = self._get_assembly_as_fasta_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'AssemblyUtil.get_assembly_as_fasta', job_id).get()
 
     def _export_assembly_as_fasta_submit(self, params, context=None):
         return self._client._submit_job(
@@ -87,16 +78,8 @@ class AssemblyUtil(object):
            "shock_id" of String
         """
         job_id = self._export_assembly_as_fasta_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'AssemblyUtil.export_assembly_as_fasta', job_id).get()
 
     def _save_assembly_from_fasta_submit(self, params, context=None):
         return self._client._submit_job(
@@ -142,27 +125,11 @@ class AssemblyUtil(object):
         :returns: instance of String
         """
         job_id = self._save_assembly_from_fasta_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'AssemblyUtil.save_assembly_from_fasta', job_id).get()
 
     def status(self, context=None):
         job_id = self._client._submit_job('AssemblyUtil.status', 
             [], self._service_ver, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'AssemblyUtil.status', job_id).get()
@@ -15,7 +15,6 @@ try:
 except:
     # no they aren't
     from baseclient import BaseClient as _BaseClient  # @Reimport
-import time
 
 
 class DataFileUtil(object):
@@ -85,16 +84,8 @@ class DataFileUtil(object):
            parameter "attributes" of mapping from String to unspecified object
         """
         job_id = self._shock_to_file_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.shock_to_file', job_id).get()
 
     def _shock_to_file_mass_submit(self, params, context=None):
         return self._client._submit_job(
@@ -138,16 +129,8 @@ class DataFileUtil(object):
            parameter "attributes" of mapping from String to unspecified object
         """
         job_id = self._shock_to_file_mass_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.shock_to_file_mass', job_id).get()
 
     def _file_to_shock_submit(self, params, context=None):
         return self._client._submit_job(
@@ -197,16 +180,8 @@ class DataFileUtil(object):
            parameter "node_file_name" of String, parameter "size" of String
         """
         job_id = self._file_to_shock_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.file_to_shock', job_id).get()
 
     def _unpack_file_submit(self, params, context=None):
         return self._client._submit_job(
@@ -226,16 +201,8 @@ class DataFileUtil(object):
            "file_path" of String
         """
         job_id = self._unpack_file_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.unpack_file', job_id).get()
 
     def _pack_file_submit(self, params, context=None):
         return self._client._submit_job(
@@ -267,16 +234,8 @@ class DataFileUtil(object):
            structure: parameter "file_path" of String
         """
         job_id = self._pack_file_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.pack_file', job_id).get()
 
     def _package_for_download_submit(self, params, context=None):
         return self._client._submit_job(
@@ -311,16 +270,8 @@ class DataFileUtil(object):
            parameter "size" of String
         """
         job_id = self._package_for_download_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.package_for_download', job_id).get()
 
     def _file_to_shock_mass_submit(self, params, context=None):
         return self._client._submit_job(
@@ -370,16 +321,8 @@ class DataFileUtil(object):
            parameter "node_file_name" of String, parameter "size" of String
         """
         job_id = self._file_to_shock_mass_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.file_to_shock_mass', job_id).get()
 
     def _copy_shock_node_submit(self, params, context=None):
         return self._client._submit_job(
@@ -411,16 +354,8 @@ class DataFileUtil(object):
            String
         """
         job_id = self._copy_shock_node_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.copy_shock_node', job_id).get()
 
     def _own_shock_node_submit(self, params, context=None):
         return self._client._submit_job(
@@ -460,16 +395,8 @@ class DataFileUtil(object):
            String
         """
         job_id = self._own_shock_node_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.own_shock_node', job_id).get()
 
     def _ws_name_to_id_submit(self, name, context=None):
         return self._client._submit_job(
@@ -483,16 +410,8 @@ class DataFileUtil(object):
         :returns: instance of Long
         """
         job_id = self._ws_name_to_id_submit(name, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.ws_name_to_id', job_id).get()
 
     def _save_objects_submit(self, params, context=None):
         return self._client._submit_job(
@@ -543,16 +462,8 @@ class DataFileUtil(object):
            "meta" of mapping from String to String
         """
         job_id = self._save_objects_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.save_objects', job_id).get()
 
     def _get_objects_submit(self, params, context=None):
         return self._client._submit_job(
@@ -597,16 +508,8 @@ class DataFileUtil(object):
            "meta" of mapping from String to String
         """
         job_id = self._get_objects_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.get_objects', job_id).get()
 
     def _versions_submit(self, context=None):
         return self._client._submit_job(
@@ -620,16 +523,8 @@ class DataFileUtil(object):
            parameter "shockver" of String
         """
         job_id = self._versions_submit(context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result']
+        return self._client.job_tracker().track(
+            'DataFileUtil.versions', job_id).get()
 
     def _download_staging_file_submit(self, params, context=None):
         return self._client._submit_job(
@@ -653,16 +548,8 @@ class DataFileUtil(object):
            String
         """
         job_id = self._download_staging_file_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.download_staging_file', job_id).get()
 
     def _download_web_file_submit(self, params, context=None):
         return self._client._submit_job(
@@ -682,27 +569,11 @@ class DataFileUtil(object):
            area path) -> structure: parameter "copy_file_path" of String
         """
         job_id = self._download_web_file_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.download_web_file', job_id).get()
 
     def status(self, context=None):
         job_id = self._client._submit_job('DataFileUtil.status', 
             [], self._service_ver, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'DataFileUtil.status', job_id).get()
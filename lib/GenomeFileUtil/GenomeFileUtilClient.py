@@ -15,7 +15,6 @@ try:
 except:
     # no they aren't
     from baseclient import BaseClient as _BaseClient  # @Reimport
-import time
 
 
 class GenomeFileUtil(object):
@@ -76,16 +75,8 @@ class GenomeFileUtil(object):
            "genome_ref" of String
         """
         job_id = self._genbank_to_genome_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'GenomeFileUtil.genbank_to_genome', job_id).get()
 
     def _genome_to_gff_submit(self, params, context=None):
         return self._client._submit_job(
@@ -111,16 +102,8 @@ class GenomeFileUtil(object):
            true. @range (0, 1))
         """
         job_id = self._genome_to_gff_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'GenomeFileUtil.genome_to_gff', job_id).get()
 
     def _genome_to_genbank_submit(self, params, context=None):
         return self._client._submit_job(
@@ -141,16 +124,8 @@ class GenomeFileUtil(object):
            for false, 1 for true. @range (0, 1))
         """
         job_id = self._genome_to_genbank_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'GenomeFileUtil.genome_to_genbank', job_id).get()
 
     def _export_genome_as_genbank_submit(self, params, context=None):
         return self._client._submit_job(
@@ -166,16 +141,8 @@ class GenomeFileUtil(object):
            "shock_id" of String
         """
         job_id = self._export_genome_as_genbank_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'GenomeFileUtil.export_genome_as_genbank', job_id).get()
 
     def _fasta_gff_to_genome_submit(self, params, context=None):
         return self._client._submit_job(
@@ -210,27 +177,11 @@ class GenomeFileUtil(object):
            "genome_ref" of String
         """
         job_id = self._fasta_gff_to_genome_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'GenomeFileUtil.fasta_gff_to_genome', job_id).get()
 
     def status(self, context=None):
         job_id = self._client._submit_job('GenomeFileUtil.status', 
             [], self._service_ver, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'GenomeFileUtil.status', job_id).get()
@@ -8,9 +8,13 @@
 from __future__ import print_function
 
 import json as _json
+import math as _math
 import requests as _requests
 import random as _random
 import os as _os
+import threading as _threading
+from multiprocessing import TimeoutError as _TimeoutError
+from multiprocessing.pool import ThreadPool as _ThreadPool
 
 try:
     from configparser import ConfigParser as _ConfigParser  # py 3
@@ -21,11 +25,45 @@ try:
     from urllib.parse import urlparse as _urlparse  # py3
 except ImportError:
     from urlparse import urlparse as _urlparse  # py2
+
+try:
+    from http.cookiejar import DefaultCookiePolicy as _CookiePolicy  # py3
+except ImportError:
+    from cookielib import DefaultCookiePolicy as _CookiePolicy  # py2
 import time
 
 _CT = 'content-type'
 _AJ = 'application/json'
 _URL_SCHEME = frozenset(['http', 'https'])
+# the most connections kept open to any one host by the shared session
+_POOL_MAXSIZE = 20
+# the JSON-RPC parse error and invalid request codes, which a server that
+# doesn't take batches answers one with
+_BATCH_REJECTED_CODES = frozenset([-32700, -32600])
+
+_session = None
+_session_pid = None
+_session_lock = _threading.Lock()
+
+
+def _get_session():
+    # Returns the requests session shared by every client in this process, so
+    # connections are kept alive and reused between calls instead of opening a
+    # new one for each. A new session is made after a fork, so a child process
+    # never shares sockets with its parent. Cookies are never stored, as the
+    # session is shared between users.
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != _os.getpid():
+            session = _requests.Session()
+            session.cookies.set_policy(_CookiePolicy(allowed_domains=[]))
+            adapter = _requests.adapters.HTTPAdapter(
+                pool_connections=_POOL_MAXSIZE, pool_maxsize=_POOL_MAXSIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+            _session_pid = _os.getpid()
+        return _session
 
 
 def _get_token(user_id, password, auth_svc):
@@ -83,6 +121,38 @@ class ServerError(Exception):
             '\n' + self.data
 
 
+def _unwrap_result(result):
+    # a method's result list holds its return values. One is returned by
+    # itself, and none as None.
+    if not result:
+        return
+    if len(result) == 1:
+        return result[0]
+    return result
+
+
+def _server_error(error):
+    return ServerError(error.get('name', 'Unknown'), error.get('code', 0),
+                       error.get('message'), error.get('data'),
+                       error.get('error'))
+
+
+class BatchResult(object):
+    '''
+    The outcome of one call made with BaseClient.call_batch. get() returns
+    the call's result, or raises its error.
+    '''
+    def __init__(self, service_method, result=None, error=None):
+        self.service_method = service_method
+        self.result = result
+        self.error = error
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
 class _JSONObjectEncoder(_json.JSONEncoder):
 
     def default(self, obj):
@@ -116,6 +186,14 @@ class BaseClient(object):
     lookup_url - set to true when contacting KBase dynamic services.
     async_job_check_time_ms - the wait time between checking job state for
         asynchronous jobs run with the run_job method.
+    session - the requests.Session to make calls with. By default, all clients
+        in a process share one session, which keeps connections open between
+        calls.
+    max_async_calls - the most calls made by call_method_async and
+        run_job_async that run at once. Default 10.
+    max_job_checks - the fewest jobs checked in each round of polling by the
+        client's job tracker, if that many are running (see JobTracker).
+        Default 5.
     '''
     def __init__(
             self, url=None, timeout=30 * 60, user_id=None,
@@ -125,7 +203,10 @@ class BaseClient(object):
             lookup_url=False,
             async_job_check_time_ms=100,
             async_job_check_time_scale_percent=150,
-            async_job_check_max_time_ms=300000):
+            async_job_check_max_time_ms=300000,
+            session=None,
+            max_async_calls=10,
+            max_job_checks=5):
         if url is None:
             raise ValueError('A url is required')
         scheme, _, _, _, _, _ = _urlparse(url)
@@ -140,6 +221,16 @@ class BaseClient(object):
         self.async_job_check_time_scale_percent = (
             async_job_check_time_scale_percent)
         self.async_job_check_max_time = async_job_check_max_time_ms / 1000.0
+        self._session = session
+        self._batch_unsupported = set()
+        if max_async_calls < 1:
+            raise ValueError('max_async_calls must be at least 1')
+        self.max_async_calls = max_async_calls
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = _threading.Lock()
+        self.max_job_checks = max_job_checks
+        self._job_tracker = None
         # token overrides user_id and password
         if token is not None:
             self._headers['AUTHORIZATION'] = token
@@ -172,9 +263,10 @@ class BaseClient(object):
             arg_hash['context'] = context
 
         body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(url, data=body, headers=self._headers,
-                             timeout=self.timeout,
-                             verify=not self.trust_all_ssl_certificates)
+        session = self._session or _get_session()
+        ret = session.post(url, data=body, headers=self._headers,
+                           timeout=self.timeout,
+                           verify=not self.trust_all_ssl_certificates)
         ret.encoding = 'utf-8'
         if ret.status_code == 500:
             if ret.headers.get(_CT) == _AJ:
@@ -190,11 +282,107 @@ class BaseClient(object):
         resp = ret.json()
         if 'result' not in resp:
             raise ServerError('Unknown', 0, 'An unknown server error occurred')
-        if not resp['result']:
-            return
-        if len(resp['result']) == 1:
-            return resp['result'][0]
-        return resp['result']
+        return _unwrap_result(resp['result'])
+
+    def _call_batch(self, url, calls):
+        # Makes the (method, params, context) calls in one JSON-RPC batch
+        # request to url, and returns a (result, error) pair for each. If the
+        # server doesn't answer with a list of responses, the calls are made
+        # one at a time. If it rejected the batch as a parse or invalid
+        # request error, it doesn't take batches, so any later calls to that
+        # url are made one at a time too.
+        if url in self._batch_unsupported:
+            return self._call_each(url, calls)
+        batch_id = str(_random.random())[2:]
+        arg_hashes = list()
+        for i, (method, params, context) in enumerate(calls):
+            if context and type(context) is not dict:
+                raise ValueError('context is not type dict as required.')
+            arg_hash = {'method': method,
+                        'params': params,
+                        'version': '1.1',
+                        'id': '{}.{}'.format(batch_id, i)
+                        }
+            if context:
+                arg_hash['context'] = context
+            arg_hashes.append(arg_hash)
+
+        body = _json.dumps(arg_hashes, cls=_JSONObjectEncoder)
+        session = self._session or _get_session()
+        ret = session.post(url, data=body, headers=self._headers,
+                           timeout=self.timeout,
+                           verify=not self.trust_all_ssl_certificates)
+        ret.encoding = 'utf-8'
+        try:
+            resp = ret.json()
+        except ValueError:
+            resp = None
+        if not isinstance(resp, list):
+            # other errors, like an auth failure, may only be about this
+            # request, so batches are tried again next time
+            error = resp.get('error') if isinstance(resp, dict) else None
+            if (isinstance(error, dict) and
+                    error.get('code') in _BATCH_REJECTED_CODES):
+                self._batch_unsupported.add(url)
+            return self._call_each(url, calls)
+        responses = dict((r.get('id'), r) for r in resp if isinstance(r, dict))
+        results = list()
+        for arg_hash in arg_hashes:
+            r = responses.get(arg_hash['id'])
+            if r is None:
+                results.append((None, ServerError(
+                    'Unknown', 0, 'No response to batched call of ' +
+                    arg_hash['method'])))
+            elif r.get('error'):
+                results.append((None, _server_error(r['error'])))
+            elif 'result' in r:
+                results.append((_unwrap_result(r['result']), None))
+            else:
+                results.append((None, ServerError(
+                    'Unknown', 0, 'An unknown server error occurred')))
+        return results
+
+    def _call_each(self, url, calls):
+        results = list()
+        for method, params, context in calls:
+            try:
+                results.append((self._call(url, method, params, context), None))
+            except (ServerError, _requests.exceptions.HTTPError) as e:
+                results.append((None, e))
+        return results
+
+    def call_batch(self, calls, context=None, max_batch_size=100):
+        '''
+        Call several standard or dynamic service methods in as few requests
+        as possible, with JSON-RPC batch requests of up to max_batch_size
+        calls. Calls to servers that don't take batches are made one at a
+        time instead.
+        Required arguments:
+        calls - a list of (service_method, args) or
+            (service_method, args, service_ver) tuples, as for call_method.
+        Optional arguments:
+        context - the rpc context dict, used for every call.
+        max_batch_size - the most calls sent in one request.
+        Returns a BatchResult for each call, in the same order.
+        '''
+        by_url = dict()
+        for i, call in enumerate(calls):
+            service_method, args = call[0], call[1]
+            service_ver = call[2] if len(call) > 2 else None
+            url = self._get_service_url(service_method, service_ver)
+            call_context = self._set_up_context(
+                service_ver, dict(context) if context else None)
+            by_url.setdefault(url, list()).append(
+                (i, (service_method, args, call_context)))
+        results = [None] * len(calls)
+        for url, url_calls in by_url.items():
+            for start in range(0, len(url_calls), max_batch_size):
+                chunk = url_calls[start:start + max_batch_size]
+                outcomes = self._call_batch(url, [c for _, c in chunk])
+                for (i, (service_method, _, _)), (result, error) in zip(
+                        chunk, outcomes):
+                    results[i] = BatchResult(service_method, result, error)
+        return results
 
     def _get_service_url(self, service_method, service_version):
         if not self.lookup_url:
@@ -222,9 +410,22 @@ class BaseClient(object):
         return self._call(self.url, mod + '._' + meth + '_submit',
                           args, context)
 
+    def job_tracker(self):
+        '''
+        Get this client's JobTracker, which polls all of the jobs it runs.
+        '''
+        with self._pool_lock:
+            if self._job_tracker is None:
+                self._job_tracker = JobTracker(
+                    self, max_checks_per_round=self.max_job_checks)
+            return self._job_tracker
+
     def run_job(self, service_method, args, service_ver=None, context=None):
         '''
         Run a SDK method asynchronously.
+        The job is polled by the client's JobTracker, along with every other
+        job the client is running, so running many at once (from different
+        threads) doesn't make more check calls.
         Required arguments:
         service_method - the service and method to run, e.g. myserv.mymeth.
         args - a list of arguments to the method.
@@ -233,23 +434,8 @@ class BaseClient(object):
             or dev/beta/release.
         context - the rpc context dict.
         '''
-        mod, _ = service_method.split('.')
-        job_id = self._submit_job(service_method, args, service_ver, context)
-        async_job_check_time = self.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                                    self.async_job_check_time_scale_percent /
-                                    100.0)
-            if async_job_check_time > self.async_job_check_max_time:
-                async_job_check_time = self.async_job_check_max_time
-            job_state = self._check_job(mod, job_id)
-            if job_state['finished']:
-                if not job_state['result']:
-                    return
-                if len(job_state['result']) == 1:
-                    return job_state['result'][0]
-                return job_state['result']
+        return self.job_tracker().submit(
+            service_method, args, service_ver, context).get()
 
     def call_method(self, service_method, args, service_ver=None,
                     context=None):
@@ -266,3 +452,256 @@ class BaseClient(object):
         url = self._get_service_url(service_method, service_ver)
         context = self._set_up_context(service_ver, context)
         return self._call(url, service_method, args, context)
+
+    def _get_pool(self):
+        # the thread pool for asynchronous calls, made on first use (and again
+        # after a fork, as the threads don't survive one).
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != _os.getpid():
+                self._pool = _ThreadPool(processes=self.max_async_calls)
+                self._pool_pid = _os.getpid()
+            return self._pool
+
+    def call_method_async(self, service_method, args, service_ver=None,
+                          context=None):
+        '''
+        Start a call_method call, and return without waiting for it.
+        Returns a multiprocessing.pool.AsyncResult for the call - its get()
+        method waits for the call and returns its result, or raises its error,
+        and ready() tells whether it's finished. At most max_async_calls calls
+        run at once, the rest wait their turn. Arguments are as for
+        call_method.
+        '''
+        return self._get_pool().apply_async(
+            self.call_method, (service_method, args, service_ver, context))
+
+    def run_job_async(self, service_method, args, service_ver=None,
+                      context=None):
+        '''
+        Start a run_job call, and return without waiting for it.
+        Returns a multiprocessing.pool.AsyncResult for the job, as for
+        call_method_async. Arguments are as for run_job.
+        '''
+        return self._get_pool().apply_async(
+            self.run_job, (service_method, args, service_ver, context))
+
+    def close(self):
+        '''
+        Stop the threads used for asynchronous calls and job polling. Any
+        calls that haven't started yet are dropped.
+        '''
+        with self._pool_lock:
+            if self._job_tracker is not None:
+                self._job_tracker.close()
+                self._job_tracker = None
+            if self._pool is not None and self._pool_pid == _os.getpid():
+                self._pool.terminate()
+                self._pool.join()
+            self._pool = None
+
+
+class TrackedJob(object):
+    '''
+    A job submitted through a JobTracker. get() waits for the job and
+    returns its result, or raises its error, and ready() tells whether it's
+    finished.
+    '''
+    def __init__(self, service_method, job_id):
+        self.service_method = service_method
+        self.job_id = job_id
+        self.last_check = 0
+        self._event = _threading.Event()
+        self._result = None
+        self._error = None
+
+    def ready(self):
+        return self._event.is_set()
+
+    def get(self, timeout=None):
+        '''
+        Wait up to timeout seconds (forever if None) for the job, and return
+        its result. Raises multiprocessing.TimeoutError if it isn't done in
+        time.
+        '''
+        if not self._event.wait(timeout):
+            raise _TimeoutError('Job {} is not finished'.format(self.job_id))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._event.set()
+
+
+class JobTracker(object):
+    '''
+    Runs SDK jobs through a client, and polls all of them from one thread.
+    Each round of polling checks some of the unfinished jobs, the ones
+    checked longest ago first, in one batch request (if the server takes
+    them), and then waits. The wait starts at the client's
+    async_job_check_time and grows by its async_job_check_time_scale_percent
+    each round, up to its async_job_check_max_time. It starts over when a job
+    is submitted.
+    Each round checks at least max_checks_per_round jobs, and more when there
+    are enough jobs that some would otherwise go longer than
+    async_job_check_max_time between checks. So while the wait is short, few
+    jobs are checked at a time, and once it reaches the maximum, every job is
+    checked each round, in one request.
+    '''
+    def __init__(self, client, max_checks_per_round=5):
+        if max_checks_per_round < 1:
+            raise ValueError('max_checks_per_round must be at least 1')
+        self.client = client
+        self.max_checks_per_round = max_checks_per_round
+        self.checks = 0
+        self._jobs = list()
+        self._wait = client.async_job_check_time
+        self._restart_wait = False
+        self._closed = False
+        self._thread = None
+        self._thread_pid = None
+        self._cond = _threading.Condition()
+        self._finished = _threading.Condition()
+
+    def submit(self, service_method, args, service_ver=None, context=None):
+        '''
+        Submit a job, and return a TrackedJob for it. Arguments are as for
+        BaseClient.run_job.
+        '''
+        job_id = self.client._submit_job(service_method, args, service_ver,
+                                         context)
+        return self.track(service_method, job_id)
+
+    def track(self, service_method, job_id):
+        '''
+        Poll a job that was already submitted, and return a TrackedJob for
+        it. service_method is the method the job runs, e.g. myserv.mymeth.
+        '''
+        job = TrackedJob(service_method, job_id)
+        with self._cond:
+            if self._closed:
+                raise ValueError('This job tracker is closed')
+            if self._thread is None or self._thread_pid != _os.getpid():
+                # a new poller, after a fork. The parent's jobs are its own.
+                self._jobs = list()
+                self._thread = _threading.Thread(target=self._poll)
+                self._thread.daemon = True
+                self._thread_pid = _os.getpid()
+                self._thread.start()
+            self._jobs.append(job)
+            self._wait = self.client.async_job_check_time
+            self._restart_wait = True
+            self._cond.notify()
+        return job
+
+    def as_completed(self, jobs, timeout=None):
+        '''
+        Yield each of the given TrackedJobs as it finishes. Raises
+        multiprocessing.TimeoutError if they aren't all done within timeout
+        seconds (if given).
+        '''
+        remaining = list(jobs)
+        deadline = None if timeout is None else time.time() + timeout
+        while remaining:
+            with self._finished:
+                done = [j for j in remaining if j.ready()]
+                if not done:
+                    wait = None
+                    if deadline is not None:
+                        wait = deadline - time.time()
+                        if wait <= 0:
+                            raise _TimeoutError(
+                                '{} jobs are not finished'.format(
+                                    len(remaining)))
+                    self._finished.wait(wait)
+                    continue
+            for job in done:
+                remaining.remove(job)
+                yield job
+
+    def close(self):
+        '''
+        Stop polling. Jobs that haven't finished never will.
+        '''
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _next_jobs(self):
+        # waits out the current wait time, and returns the jobs to check
+        # next, or None once closed.
+        with self._cond:
+            while True:
+                while not self._jobs and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return None
+                self._restart_wait = False
+                self._cond.wait(self._wait)
+                if self._closed:
+                    return None
+                if not self._restart_wait:
+                    break
+            self._wait = min(self._wait *
+                             self.client.async_job_check_time_scale_percent /
+                             100.0,
+                             self.client.async_job_check_max_time)
+            # enough checks that each job is checked at least once in every
+            # async_job_check_max_time, with rounds this far apart
+            count = int(_math.ceil(len(self._jobs) * self._wait /
+                                   self.client.async_job_check_max_time))
+            jobs = sorted(self._jobs, key=lambda j: j.last_check)
+            return jobs[:max(self.max_checks_per_round, count)]
+
+    def _poll(self):
+        try:
+            while True:
+                jobs = self._next_jobs()
+                if jobs is None:
+                    return
+                self._check(jobs)
+        except Exception as e:
+            # this is the only thread polling, so rather than leave every job
+            # waiting forever, fail them all. The next job tracked starts a
+            # new poller.
+            with self._cond:
+                jobs = self._jobs
+                self._jobs = list()
+                self._thread = None
+            with self._finished:
+                for job in jobs:
+                    job._finish(None, e)
+                self._finished.notify_all()
+
+    def _check(self, jobs):
+        now = time.time()
+        for job in jobs:
+            job.last_check = now
+        self.checks += len(jobs)
+        calls = [(job.service_method.split('.')[0] + '._check_job',
+                  [job.job_id], None) for job in jobs]
+        try:
+            outcomes = self.client._call_batch(self.client.url, calls)
+        except Exception as e:
+            outcomes = [(None, e)] * len(jobs)
+        for job, outcome in zip(jobs, outcomes):
+            result = None
+            try:
+                job_state, error = outcome
+                if error is None:
+                    if not job_state['finished']:
+                        continue
+                    result = _unwrap_result(job_state['result'])
+            except Exception as e:
+                # a malformed job state fails that job
+                error = e
+            self._finish(job, result=result, error=error)
+
+    def _finish(self, job, result=None, error=None):
+        with self._cond:
+            self._jobs.remove(job)
+        with self._finished:
+            job._finish(result, error)
+            self._finished.notify_all()
@@ -15,7 +15,6 @@ try:
 except:
     # no they aren't
     from baseclient import BaseClient as _BaseClient  # @Reimport
-import time
 
 
 class ReadsAlignmentUtils(object):
@@ -61,16 +60,8 @@ class ReadsAlignmentUtils(object):
            "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1))
         """
         job_id = self._validate_alignment_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'ReadsAlignmentUtils.validate_alignment', job_id).get()
 
     def _upload_alignment_submit(self, params, context=None):
         return self._client._submit_job(
@@ -110,16 +101,8 @@ class ReadsAlignmentUtils(object):
            of String
         """
         job_id = self._upload_alignment_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'ReadsAlignmentUtils.upload_alignment', job_id).get()
 
     def _download_alignment_submit(self, params, context=None):
         return self._client._submit_job(
@@ -150,16 +133,8 @@ class ReadsAlignmentUtils(object):
            Long, parameter "total_reads" of Long
         """
         job_id = self._download_alignment_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'ReadsAlignmentUtils.download_alignment', job_id).get()
 
     def _export_alignment_submit(self, params, context=None):
         return self._client._submit_job(
@@ -184,27 +159,11 @@ class ReadsAlignmentUtils(object):
            "shock_id" of String
         """
         job_id = self._export_alignment_submit(params, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'ReadsAlignmentUtils.export_alignment', job_id).get()
 
     def status(self, context=None):
         job_id = self._client._submit_job('ReadsAlignmentUtils.status', 
             [], self._service_ver, context)
-        async_job_check_time = self._client.async_job_check_time
-        while True:
-            time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                self._client.async_job_check_time_scale_percent / 100.0)
-            if async_job_check_time > self._client.async_job_check_max_time:
-                async_job_check_time = self._client.async_job_check_max_time
-            job_state = self._check_job(job_id)
-            if job_state['finished']:
-                return job_state['result'][0]
+        return self._client.job_tracker().track(
+            'ReadsAlignmentUtils.status', job_id).get()
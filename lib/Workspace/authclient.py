@@ -9,72 +9,146 @@ import time as _time
 import requests as _requests
 import threading as _threading
 import hashlib
+from collections import OrderedDict as _OrderedDict
 
 
 class TokenCache(object):
-    ''' A basic cache for tokens. '''
+    '''
+    A least recently used cache for tokens. Valid tokens are kept for ttl
+    seconds, and tokens the auth service rejected for invalid_ttl seconds.
+    Keeps hit, miss, and eviction counts.
+    '''
 
     _MAX_TIME_SEC = 5 * 60  # 5 min
+    _INVALID_TIME_SEC = 30
 
-    _lock = _threading.RLock()
-
-    def __init__(self, maxsize=2000):
-        self._cache = {}
+    def __init__(self, maxsize=2000, ttl=None, invalid_ttl=None):
+        self._cache = _OrderedDict()
         self._maxsize = maxsize
-        self._halfmax = maxsize / 2  # int division to round down
-
-    def get_user(self, token):
+        self._ttl = self._MAX_TIME_SEC if ttl is None else ttl
+        self._invalid_ttl = (self._INVALID_TIME_SEC if invalid_ttl is None
+                             else invalid_ttl)
+        self._lock = _threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        '''
+        Returns (user, None) for a cached valid token, (None, error message)
+        for a cached invalid token, or None if the token isn't cached.
+        '''
         token = hashlib.sha256(token).hexdigest()
         with self._lock:
-            usertime = self._cache.get(token)
-        if not usertime:
-            return None
+            entry = self._cache.pop(token, None)
+            if entry is None or entry[2] < _time.time():
+                self.misses += 1
+                return None
+            # put it back at the most recently used end
+            self._cache[token] = entry
+            self.hits += 1
+        return entry[0], entry[1]
 
-        user, intime = usertime
-        if _time.time() - intime > self._MAX_TIME_SEC:
+    def get_user(self, token):
+        entry = self.get(token)
+        if entry is None:
             return None
-        return user
+        return entry[0]
 
     def add_valid_token(self, token, user):
         if not token:
             raise ValueError('Must supply token')
         if not user:
             raise ValueError('Must supply user')
+        self._add(token, (user, None, _time.time() + self._ttl))
+
+    def add_invalid_token(self, token, error):
+        '''
+        Caches the error message for a token the auth service rejected.
+        '''
+        if not token:
+            raise ValueError('Must supply token')
+        self._add(token, (None, error, _time.time() + self._invalid_ttl))
+
+    def _add(self, token, entry):
         token = hashlib.sha256(token).hexdigest()
         with self._lock:
-            self._cache[token] = [user, _time.time()]
-            if len(self._cache) > self._maxsize:
-                for i, (t, _) in enumerate(sorted(self._cache.items(),
-                                                  key=lambda (_, v): v[1])):
-                    if i <= self._halfmax:
-                        del self._cache[t]
-                    else:
-                        break
+            self._cache.pop(token, None)
+            self._cache[token] = entry
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._cache), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+class _Lookup(object):
+    # a token lookup in progress, which other threads can wait for
+
+    def __init__(self):
+        self.done = _threading.Event()
+        self.user = None
+        self.error = None
 
 
 class KBaseAuth(object):
     '''
     A very basic KBase auth client for the Python server.
+    Concurrent lookups of the same token share one call to the auth service.
     '''
 
     _LOGIN_URL = 'https://kbase.us/services/authorization/Sessions/Login'
 
-    def __init__(self, auth_url=None):
+    def __init__(self, auth_url=None, cache=None):
         '''
         Constructor
+        cache - the token cache to use. Defaults to a new TokenCache.
         '''
         self._authurl = auth_url
         if not self._authurl:
             self._authurl = self._LOGIN_URL
-        self._cache = TokenCache()
+        self._cache = TokenCache() if cache is None else cache
+        self._lookups = dict()
+        self._lookups_lock = _threading.Lock()
+        self.shared_lookups = 0
 
     def get_user(self, token):
         if not token:
             raise ValueError('Must supply token')
-        user = self._cache.get_user(token)
-        if user:
+        cached = self._cache.get(token)
+        if cached is not None:
+            user, error = cached
+            if error is not None:
+                raise ValueError(error)
             return user
 
+        with self._lookups_lock:
+            lookup = self._lookups.get(token)
+            owner = lookup is None
+            if owner:
+                lookup = _Lookup()
+                self._lookups[token] = lookup
+            else:
+                self.shared_lookups += 1
+        if not owner:
+            lookup.done.wait()
+        else:
+            try:
+                lookup.user = self._fetch_user(token)
+            except Exception as e:
+                lookup.error = e
+            finally:
+                with self._lookups_lock:
+                    del self._lookups[token]
+                lookup.done.set()
+        if lookup.error is not None:
+            raise lookup.error
+        return lookup.user
+
+    def _fetch_user(self, token):
         d = {'token': token, 'fields': 'user_id'}
         ret = _requests.post(self._authurl, data=d)
         if not ret.ok:
@@ -82,10 +156,22 @@ class KBaseAuth(object):
                 err = ret.json()
             except:
                 ret.raise_for_status()
-            raise ValueError('Error connecting to auth service: {} {}\n{}'
-                             .format(ret.status_code, ret.reason,
-                                     err['error_msg']))
+            error = ('Error connecting to auth service: {} {}\n{}'
+                     .format(ret.status_code, ret.reason, err['error_msg']))
+            # the service rejected the token, rather than failing
+            if 400 <= ret.status_code < 500:
+                self._cache.add_invalid_token(token, error)
+            raise ValueError(error)
 
         user = ret.json()['user_id']
         self._cache.add_valid_token(token, user)
         return user
+
+    def cache_stats(self):
+        '''
+        Returns the token cache's counts, and how many lookups shared another
+        thread's call to the auth service.
+        '''
+        stats = self._cache.stats()
+        stats['shared_lookups'] = self.shared_lookups
+        return stats
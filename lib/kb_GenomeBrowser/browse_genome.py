@@ -2,184 +2,448 @@ import os
 from GenomeFileUtil.GenomeFileUtilClient import GenomeFileUtil
 from AssemblyUtil.AssemblyUtilClient import AssemblyUtil
 from ReadsAlignmentUtils.ReadsAlignmentUtilsClient import ReadsAlignmentUtils
-from Workspace.WorkspaceClient import Workspace
-from util import (
-    check_reference,
-    check_reference_type,
-    get_object_name
+from DataFileUtil.DataFileUtilClient import DataFileUtil
+from object_resolver import ObjectResolver
+from ws_cache import object_info_cache
+from refseq_writer import write_refseqs, REFSEQ_WRITER_VERSION
+from feature_track import write_feature_track, FEATURE_TRACK_BUILDER_VERSION
+from disk_cache import DiskCache
+from file_staging import stage_file
+from track_list import add_tracks, read_track_list, TRACK_LIST_FILE
+from stages import StageScheduler
+from telemetry import BuildTelemetry
+from metrics import registry as metrics_registry
+from jbrowse_shell import (
+    prepare_shell,
+    materialize_shell,
+    shell_lock,
+    mode_dir,
+    format_size_report,
+    DEFAULT_SHELL_DIR,
+    FILES_DIR
 )
+from shared_viewer import (
+    ViewerRegistry,
+    make_index_page,
+    viewer_key,
+    INDEX_FILE
+)
+from util import package_directory, get_workspace_client
+from multiprocessing.pool import ThreadPool
 import subprocess
 import shutil
+import tempfile
+import threading
+import time
+
+
+REFSEQ_BUILDERS = ('perl', 'python')
+FEATURE_TRACK_BUILDERS = ('perl', 'python')
+FEATURE_TRACK_LABEL = 'FeatureAnnotations'
+JBROWSE_PACKAGE_MODES = ['full', 'trimmed']
+JBROWSE_VERSION = '1.12.3'
+BUILDER_VERSIONS = {
+    'refseq': {'perl': JBROWSE_VERSION, 'python': REFSEQ_WRITER_VERSION},
+    'features': {'perl': JBROWSE_VERSION, 'python': FEATURE_TRACK_BUILDER_VERSION}
+}
+# the order to start fetches in: BAM files are usually the biggest, then the assembly FASTA
+FETCH_ORDER = ('alignment', 'assembly', 'gff')
 
 
 class GenomeBrowserMaker:
-    def __init__(self, callback_url, workspace_url, scratch_dir):
+    def __init__(self, callback_url, workspace_url, scratch_dir, config=None):
+        """
+        config is the (optional) dict of deploy.cfg settings. Used keys:
+            refseq-builder - "perl" (default) to build the reference sequence track with
+                JBrowse's prepare-refseqs.pl, or "python" to use the native streaming writer.
+            feature-track-builder - "perl" (default) to build the feature track with JBrowse's
+                flatfile-to-json.pl, or "python" to use the native streaming GFF3 builder.
+            build-workers - the number of track building stages to run at once (default 1).
+            fetch-workers - the number of input files to download at once (default 1).
+            artifact-cache-dir - a directory for caching built tracks and BAM indexes across
+                builds. No caching is done if this isn't set.
+            artifact-cache-max-gb - the size limit of the artifact cache (default 50).
+            download-cache-dir - a directory for caching downloaded FASTA, GFF, and BAM files
+                across builds. No caching is done if this isn't set.
+            download-cache-max-gb - the size limit of the download cache (default 100).
+            jbrowse-shell-dir - where the prebuilt JBrowse shells live (default
+                /kb/module/jbrowse_shell), one for each package mode. A shell is made on
+                first use if it isn't there, or was made from a different JBrowse.
+            jbrowse-package-mode - "full" (default) to package all of the usual JBrowse
+                files, or "trimmed" to package only what the viewer loads.
+            jbrowse-release-dir - a compiled JBrowse release to package from, instead of the
+                JBrowse install. Only its browser files are used, not its scripts.
+            shared-viewer-registry - a file for recording uploaded JBrowse viewers, so each is
+                uploaded once and shared by reports. If this isn't set, every report gets its
+                own copy of the viewer.
+        """
+        if config is None:
+            config = dict()
         self.callback_url = callback_url
         self.scratch_dir = scratch_dir
         self.workspace_url = workspace_url
-        self.ws = Workspace(self.workspace_url)
+        self.ws = get_workspace_client(self.workspace_url)
+        self._clients = dict()
+        self._clients_lock = threading.Lock()
+        self.resolver = ObjectResolver(ws_client=self.ws)
         self.jbrowse_dir = os.path.abspath(os.path.join(os.sep, 'kb', 'module', 'jbrowse'))
         self.jbrowse_bin = os.path.join(self.jbrowse_dir, 'bin')
-        self.out_dir = os.path.join(self.scratch_dir, 'browser_data')
-
-    def _get_assembly_ref(self, genome_ref):
-        # test if genome references an assembly type
-        # do get_objects2 without data. get list of refs
-        genome_obj_info = self.ws.get_objects2({
-            'objects': [{'ref': genome_ref}],
-            'no_data': 1
-        })
-        # get the list of genome refs from the returned info.
-        # if there are no refs (or something funky with the return), this will be an empty list.
-        # this WILL fail if data is an empty list. But it shouldn't be, and we know because
-        # we have a real genome reference, or get_objects2 would fail.
-        genome_obj_refs = genome_obj_info.get('data', [{}])[0].get('refs', [])
-
-        # see which of those are of an appropriate type (ContigSet or Assembly), if any.
-        assembly_ref = list()
-        ref_params = [{'ref': x} for x in genome_obj_refs]
-        ref_info = self.ws.get_object_info3({'objects': ref_params})
-        for idx, info in enumerate(ref_info.get('infos')):
-            if "KBaseGenomeAnnotations.Assembly" in info[2] or "KBaseGenomes.ContigSet" in info[2]:
-                assembly_ref.append(";".join(ref_info.get('paths')[idx]))
-
-        return assembly_ref
-
-    def create_browser_data_from_files(self, fasta_file, gff_file, alignment_files):
+        self.jbrowse_shell_dir = config.get('jbrowse-shell-dir') or DEFAULT_SHELL_DIR
+        self.jbrowse_release_dir = config.get('jbrowse-release-dir') or self.jbrowse_dir
+        self.jbrowse_package_mode = config.get('jbrowse-package-mode', 'full')
+        self.viewer_registry = None
+        if config.get('shared-viewer-registry'):
+            self.viewer_registry = ViewerRegistry(config['shared-viewer-registry'])
+        if self.jbrowse_package_mode not in JBROWSE_PACKAGE_MODES:
+            raise ValueError('jbrowse-package-mode must be one of {}, not {}'.format(
+                ', '.join(JBROWSE_PACKAGE_MODES), self.jbrowse_package_mode))
+        self.build_workers = int(config.get('build-workers', 1))
+        self.fetch_workers = int(config.get('fetch-workers', 1))
+        self.artifact_cache = None
+        if config.get('artifact-cache-dir'):
+            self.artifact_cache = DiskCache(
+                config['artifact-cache-dir'],
+                float(config.get('artifact-cache-max-gb', 50)) * 1024 ** 3)
+        self.download_cache = None
+        if config.get('download-cache-dir'):
+            self.download_cache = DiskCache(
+                config['download-cache-dir'],
+                float(config.get('download-cache-max-gb', 100)) * 1024 ** 3)
+        self.refseq_builder = config.get('refseq-builder', 'perl')
+        if self.refseq_builder not in REFSEQ_BUILDERS:
+            raise ValueError('refseq-builder must be one of {}, not {}'.format(
+                ', '.join(REFSEQ_BUILDERS), self.refseq_builder))
+        self.feature_track_builder = config.get('feature-track-builder', 'perl')
+        if self.feature_track_builder not in FEATURE_TRACK_BUILDERS:
+            raise ValueError('feature-track-builder must be one of {}, not {}'.format(
+                ', '.join(FEATURE_TRACK_BUILDERS), self.feature_track_builder))
+        # everything for this build goes in its own working directory, so several builds
+        # can share the scratch space.
+        self.work_dir = tempfile.mkdtemp(dir=self.scratch_dir, prefix='genome_browser_')
+        self.out_dir = os.path.join(self.work_dir, 'browser_data')
+        self.stage_dir = os.path.join(self.work_dir, 'browser_data_stages')
+        self._fetched_files = list()
+        self.telemetry = BuildTelemetry()
+        self.telemetry_file = self.work_dir + '_telemetry.json'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        Removes this build's working directory, and any files that were downloaded for it.
+        Anything that needs to outlive the build (like a packaged browser) should be put
+        somewhere else first. The build's telemetry is written to telemetry_file, next to
+        the working directory, and its stage timings are added to the server's metrics.
+        """
+        # stops the clients' job polling threads
+        with self._clients_lock:
+            for client in self._clients.values():
+                client._client.close()
+            self._clients = dict()
+        self.telemetry.write(self.telemetry_file)
+        metrics_registry.observe_build(self.telemetry)
+        print('Build telemetry written to {}:\n{}'.format(self.telemetry_file,
+                                                          self.telemetry.summary()))
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        for path in self._fetched_files:
+            if os.path.exists(path):
+                os.remove(path)
+            # alignments are downloaded into their own directory
+            fetch_dir = os.path.dirname(os.path.abspath(path))
+            if (fetch_dir != os.path.abspath(self.scratch_dir) and os.path.isdir(fetch_dir) and
+                    not os.listdir(fetch_dir)):
+                os.rmdir(fetch_dir)
+        self._fetched_files = list()
+
+    def _artifact_keys(self, upas, alignment_files):
+        """
+        Makes the artifact cache keys for whatever can be cached, given the resolved UPAs of
+        the objects the input files came from (see get_browser_data_files). The track keys
+        include the builder and its version, so a new builder never reuses old output.
+        """
+        keys = {'refseq': None, 'features': None, 'alignments': dict()}
+        if self.artifact_cache is None or not upas:
+            return keys
+        if upas.get('assembly'):
+            keys['refseq'] = 'refseq/{}/{}/{}'.format(
+                self.refseq_builder, BUILDER_VERSIONS['refseq'][self.refseq_builder],
+                upas['assembly'])
+        if upas.get('genome'):
+            keys['features'] = 'features/{}/{}/{}'.format(
+                self.feature_track_builder,
+                BUILDER_VERSIONS['features'][self.feature_track_builder],
+                upas['genome'])
+        for name, upa in upas.get('alignments', dict()).items():
+            if name in alignment_files:
+                keys['alignments'][name] = 'bai/{}'.format(upa)
+        return keys
+
+    def create_browser_data_from_files(self, fasta_file, gff_file, alignment_files, upas=None,
+                                       move_alignment_files=False):
         """
         fasta_file = string, path to file
         gff_file = string, path to file
         alignment_files = dict,
             keys = alignment "name" (not necessarily file name),
             values = path to file
+        upas = optional dict of the resolved references the files came from, used to reuse
+            tracks and BAM indexes from the artifact cache,
+            keys = "assembly", "genome", "alignments" (a dict with the same keys as
+                alignment_files)
+        move_alignment_files = if True, the alignment files may be moved into the data
+            directory, when they can't be linked. Only use this for files that were fetched
+            just for this build.
+
+        The refseq, feature, and alignment tracks don't depend on each other, so they're built
+        as separate stages on up to build-workers processes. The refseq and feature stages
+        each work in their own staging directory, and everything is merged into the data
+        directory (and its trackList.json) in order once all stages are done.
         """
         print('Starting create_browser_data_from_files')
-        # STEP 1: run the refseq creation
-        print('Converting FASTA to JBrowse refseq track...')
-        refseq_cmd = [os.path.join(self.jbrowse_bin, 'prepare-refseqs.pl'),
-                      '--fasta',
-                      fasta_file,
-                      '--out',
-                      self.out_dir]
-        print('refseq command:')
-        print(refseq_cmd)
-        p = subprocess.Popen(refseq_cmd, shell=False)
-        retcode = p.wait()
-        if retcode != 0:
-            raise RuntimeError('Failed to build reference sequence track from FASTA file! Return code: {}'.format(retcode))
-        print('Done creating refseq track!')
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        if os.path.exists(self.stage_dir):
+            shutil.rmtree(self.stage_dir)
+        refseq_dir = os.path.join(self.stage_dir, 'refseq')
+        feature_dir = os.path.join(self.stage_dir, 'features')
+        keys = self._artifact_keys(upas, alignment_files)
+        cached = dict()
 
+        scheduler = StageScheduler(self.build_workers)
+        # STEP 1: run the refseq creation
+        cached['refseq'] = self._get_cached_artifact(keys['refseq'], refseq_dir)
+        if cached['refseq'] is None:
+            scheduler.add_stage('refseq', build_refseq_track,
+                                (self.refseq_builder, self.jbrowse_bin, fasta_file, refseq_dir))
         # STEP 2: run the feature track creation
-        print('Converting GFF to annotation track...')
-        track_cmd = [os.path.join(self.jbrowse_bin, 'flatfile-to-json.pl'),
-                     '--gff',
-                     gff_file,
-                     '--trackLabel',
-                     'FeatureAnnotations',
-                     '--trackType',
-                     'CanvasFeatures',
-                     '--out',
-                     self.out_dir]
-        print('track command:')
-        print(track_cmd)
-        p = subprocess.Popen(track_cmd, shell=False)
-        retcode = p.wait()
-        if retcode != 0:
-            raise RuntimeError('Failed to build feature annotation track from GFF file! Return code: {}'.format(retcode))
-        print('Done creating annotation track!')
-
+        cached['features'] = self._get_cached_artifact(keys['features'], feature_dir)
+        if cached['features'] is None:
+            scheduler.add_stage('features', build_feature_track,
+                                (self.feature_track_builder, self.jbrowse_bin, gff_file,
+                                 feature_dir))
         # STEP 3: run the BAM track creation
-        print('Converting BAM files to alignment tracks...')
-        for alignment_name in alignment_files:
-            print('Converting BAM file {}'.format(alignment_name))
-            # 1. get the actual file name for the bam file
-            align_file_fullpath = alignment_files[alignment_name]
-            align_filename = os.path.basename(align_file_fullpath)
-            # 2. move it (copy?) to the right location
-            shutil.copy2(align_file_fullpath, os.path.join(self.out_dir, align_filename))
-
-            # 2.a. TODO: check the header inside the file that it's the correct chromosome...
-            # 3. make a BAI file with samtools
-            align_file_fullpath = os.path.join(self.out_dir, align_filename)
-            sam_bai_cmd = ['samtools',
-                           'index',
-                           align_file_fullpath,
-                           "{}.bai".format(align_file_fullpath)]
-            print("Building BAM index with command: {}".format(" ".join(sam_bai_cmd)))
-            p = subprocess.Popen(sam_bai_cmd, shell=False)
-            retcode = p.wait()
-            if retcode != 0:
-                raise RuntimeError('Failed to make index file from BAM file! Return code: {}'.format(retcode))
-            # 4. add the filename to the trackList with add-bam-track.pl
-            track_cmd = [os.path.join(self.jbrowse_bin, 'add-bam-track.pl'),
-                         '--label',
-                         alignment_name,
-                         '--bam_url',
-                         align_filename,
-                         '--in',
-                         os.path.join(self.out_dir, 'trackList.json')]
-            p = subprocess.Popen(track_cmd, shell=False)
-            retcode = p.wait()
-            if retcode != 0:
-                raise RuntimeError('Failed to build alignment track from BAM file! Return code: {}'.format(retcode))
-            print('Done creating alignment track {}'.format(alignment_name))
-        print('Done creating all alignment tracks!')
+        alignment_stages = list()
+        for idx, alignment_name in enumerate(alignment_files):
+            stage_name = 'alignment_{}'.format(idx)
+            bai_dir = os.path.join(self.stage_dir, stage_name)
+            cached_bai = None
+            if self._get_cached_artifact(keys['alignments'].get(alignment_name), bai_dir) is not None:
+                cached_bai = os.path.join(bai_dir, os.listdir(bai_dir)[0])
+            scheduler.add_stage(stage_name, build_alignment_track,
+                                (alignment_name, alignment_files[alignment_name], self.out_dir,
+                                 cached_bai, move_alignment_files))
+            alignment_stages.append((stage_name, alignment_name, cached_bai is None))
+        try:
+            results = scheduler.run()
+        finally:
+            for name, record in sorted(scheduler.metrics.items()):
+                self.telemetry.add(name, record)
+        for name, info in cached.items():
+            if info is not None:
+                self.telemetry.add(name, {'cached': True})
+
+        # Save anything new to the artifact cache
+        if 'refseq' in results and keys['refseq'] is not None:
+            self.artifact_cache.put(keys['refseq'], refseq_dir, info=results['refseq'])
+        if 'features' in results and keys['features'] is not None:
+            self.artifact_cache.put(keys['features'], feature_dir, info=results['features'])
+        for stage_name, alignment_name, new_bai in alignment_stages:
+            bai_key = keys['alignments'].get(alignment_name)
+            if bai_key is not None and new_bai:
+                bam_file = os.path.join(self.out_dir, os.path.basename(alignment_files[alignment_name]))
+                self.artifact_cache.put(bai_key, bam_file + '.bai')
+        results.update(dict((k, v) for k, v in cached.items() if v is not None))
+
+        # Final step: merge everything into the data directory
+        with self.telemetry.stage('merge'):
+            _merge_stage_dir(refseq_dir, self.out_dir)
+            _merge_stage_dir(feature_dir, self.out_dir)
+            shutil.rmtree(self.stage_dir)
+            track_confs = results['refseq'] + results['features']
+            staging = list()
+            for stage_name, _, _ in alignment_stages:
+                track_confs += results[stage_name]['tracks']
+                staging.append(results[stage_name]['staging'])
+            add_tracks(self.out_dir, track_confs)
+        bytes_avoided = sum(s['bytes_avoided'] for s in staging)
+        print('Staged {} BAM files, avoided copying {} bytes'.format(len(staging), bytes_avoided))
         print('Done running create_browser_data_from_files')
-        # Final step: return the directory where the JBrowse data lives.
+        # return the directory where the JBrowse data lives.
         return {
             'gff_file': gff_file,
             'fasta_file': fasta_file,
-            'data_dir': self.out_dir
+            'data_dir': self.out_dir,
+            'bam_staging': {
+                'files': staging,
+                'bytes_avoided': bytes_avoided
+            }
         }
 
-    def get_genome_data_files(self, genome_ref):
-        genome_files = {
-            "assembly": None,
-            "gff": None
-        }
-        print('Fetching assembly or contig information from genome...')
-        assembly_ref = self._get_assembly_ref(genome_ref)
-        if len(assembly_ref) > 1:
-            raise ValueError('This genome, {}, appears to reference {} Assemblies or ContigSets, with these object references: {}'.format(genome_ref, len(assembly_ref), assembly_ref))
-        elif len(assembly_ref) == 0:
-            raise ValueError('There was no Assembly or ContigSet found as a reference to this genome. Unable to build browser data.')
-        print('Done! Found valid assembly data.')
+    def client(self, client_class, **kwargs):
+        """
+        Returns this build's client of client_class (one of the SDK clients, like
+        AssemblyUtil) for the callback server, making it with kwargs on first use. All of
+        the build's calls to that service share it, and its connections.
+        """
+        with self._clients_lock:
+            if client_class not in self._clients:
+                self._clients[client_class] = client_class(self.callback_url, **kwargs)
+            return self._clients[client_class]
+
+    def _get_cached_artifact(self, key, dest_dir):
+        """
+        Puts the cached artifact for key into dest_dir, and returns its stored info (the
+        track configurations). Returns None if there's no key or nothing cached for it.
+        """
+        if key is None:
+            return None
+        info = self.artifact_cache.get(key, dest_dir)
+        if info is not None:
+            print('Reusing cached artifact {}'.format(key))
+        return info
 
+    def _fetch_assembly(self, assembly_ref):
         print('Converting sequence data to FASTA file...')
-        au = AssemblyUtil(self.callback_url)
-        fasta_file = au.get_assembly_as_fasta({'ref': assembly_ref[0]})
+        au = self.client(AssemblyUtil)
+        fasta_file = au.get_assembly_as_fasta({'ref': assembly_ref})
         print('Done! FASTA file created: {}'.format(fasta_file))
-
         if "path" not in fasta_file:
             raise IOError('FASTA file was not apparently generated from the given genome fasta_file. fasta_file object missing key "path": {}'.format(fasta_file))
-        genome_files["assembly"] = fasta_file.get('path', None)
+        return fasta_file.get('path', None)
 
+    def _fetch_gff(self, genome_ref):
         print('Converting genome annotation data to gff file...')
-        gfu = GenomeFileUtil(self.callback_url)
+        gfu = self.client(GenomeFileUtil)
         gff_file = gfu.genome_to_gff({'genome_ref': genome_ref})
         print('Done! GFF file created: {}'.format(gff_file))
         if "file_path" not in gff_file:
             raise IOError('GFF file was not apparently generated from the given genome. gff_file object missing key "file_path": {}'.format(gff_file))
-        genome_files["gff"] = gff_file.get('file_path', None)
+        return gff_file.get('file_path', None)
+
+    def _fetch_alignment(self, alignment_ref):
+        ru = self.client(ReadsAlignmentUtils, service_ver='dev')
+        align_file = ru.download_alignment({
+            "source_ref": alignment_ref,
+            "downloadBAI": 0
+        })
+        for f in os.listdir(align_file["destination_dir"]):
+            if f.endswith("bam"):
+                return os.path.join(align_file["destination_dir"], f)
+        raise IOError('No BAM file was downloaded for alignment {}'.format(alignment_ref))
+
+    def _fetch_tasks(self, resolved):
+        """
+        Makes the list of downloads needed for the resolved genome and alignments (see
+        ObjectResolver.resolve). Each is a dict with the key for its result, the object ref
+        and name, and the function to fetch it.
+        """
+        tasks = list()
+        if resolved['genome'] is not None:
+            tasks.append(dict(resolved['assembly'], key=('assembly', None),
+                              fetch=self._fetch_assembly))
+            tasks.append(dict(resolved['genome'], key=('gff', None),
+                              fetch=self._fetch_gff))
+        for alignment in resolved['alignments']:
+            tasks.append(dict(alignment, key=('alignment', alignment['ref']),
+                              fetch=self._fetch_alignment))
+        return tasks
+
+    def _cached_fetch(self, task, cancelled=None):
+        """
+        Fetches the file for a task, going through the download cache if there is one. The
+        objects are immutable once resolved to a UPA, so that's the cache key, and cached
+        files are checked against the sizes and times stored with them before they're used.
+        A file isn't cached if the cancelled Event is set by the time it's downloaded, as the
+        build has failed.
+        Returns the file path, and whether it came from the cache.
+        """
+        if self.download_cache is not None:
+            cache_key = '{}/{}'.format(task['key'][0], task['upa'])
+            dest_dir = tempfile.mkdtemp(dir=self.work_dir, prefix='cached_download_')
+            if self.download_cache.get(cache_key, dest_dir, verify=True) is not None:
+                return os.path.join(dest_dir, os.listdir(dest_dir)[0]), True
+            os.rmdir(dest_dir)
+        path = task['fetch'](task['ref'])
+        self._fetched_files.append(path)
+        if self.download_cache is not None and not (cancelled and cancelled.is_set()):
+            self.download_cache.put(cache_key, path)
+        return path, False
+
+    def _fetch_all(self, tasks):
+        """
+        Runs all the fetch tasks on a pool of up to fetch-workers threads, likely biggest
+        files first (see FETCH_ORDER), so the longest downloads aren't left waiting at the end.
+        Returns a dict of key -> fetched file path, and a list of per-object timings. The
+        timings are also added to the build telemetry, with the fetched file's size as the
+        bytes written.
+        If a fetch fails, the ones that haven't started are skipped. Downloads can't be
+        stopped once they're running, so those are waited for before the error is raised, so
+        that their files are known to cleanup() rather than landing in scratch afterwards.
+        """
+        cancelled = threading.Event()
 
-        return genome_files
+        def timed_fetch(task):
+            if cancelled.is_set():
+                return None
+            start = time.time()
+            path, cached = self._cached_fetch(task, cancelled)
+            return path, cached, time.time() - start
+
+        # the workspace objects are small records pointing at their files, so their sizes
+        # don't say how big the downloads are
+        tasks = sorted(tasks, key=lambda t: FETCH_ORDER.index(t['key'][0]))
+        pool = ThreadPool(processes=max(1, min(self.fetch_workers, len(tasks))))
+        try:
+            pending = [(task, pool.apply_async(timed_fetch, (task,))) for task in tasks]
+            fetched = dict()
+            timings = list()
+            for task, result in pending:
+                path, cached, elapsed = result.get()
+                fetched[task['key']] = path
+                # the file as downloaded, or staged from the download cache
+                size = os.path.getsize(path)
+                timings.append({
+                    'type': task['key'][0],
+                    'ref': task['ref'],
+                    'name': task['name'],
+                    'size': size,
+                    'cached': cached,
+                    'seconds': elapsed
+                })
+                # fetches run together on threads, so only their time and size can be
+                # told apart
+                self.telemetry.add('fetch {} {}'.format(task['key'][0], task['name']), {
+                    'ref': task['ref'],
+                    'cached': cached,
+                    'wall_seconds': elapsed,
+                    'bytes_written': size
+                })
+        finally:
+            cancelled.set()
+            pool.close()
+            pool.join()
+        for t in timings:
+            print('Fetched {} {} ({}, {} bytes) in {:.2f}s{}'.format(
+                t['type'], t['name'], t['ref'], t['size'], t['seconds'],
+                ' from the download cache' if t['cached'] else ''))
+        return fetched, timings
+
+    def get_genome_data_files(self, genome_ref):
+        files = self.get_browser_data_files(genome_ref=genome_ref)
+        return {
+            "assembly": files["assembly"],
+            "gff": files["gff"]
+        }
 
     def get_alignment_data_files(self, alignment_refs):
         """
         Returns a dictionary of data files. Key = object name, value = path to the file.
         """
-        alignment_files = dict()
-        ru = ReadsAlignmentUtils(self.callback_url, service_ver='dev')
-        for ref in alignment_refs:
-            ref_name = get_object_name(ref, self.workspace_url)
-            align_file = ru.download_alignment({
-                "source_ref": ref,
-                "downloadBAI": 0
-            })
-            for f in os.listdir(align_file["destination_dir"]):
-                if f.endswith("bam"):
-                    alignment_files[ref_name] = os.path.join(align_file["destination_dir"], f)
-        return alignment_files
+        return self.get_browser_data_files(alignment_refs=alignment_refs)["alignment_refs"]
 
     def get_browser_data_files(self, genome_ref=None, alignment_refs=None):
         """
@@ -189,6 +453,8 @@ class GenomeBrowserMaker:
         if the alignment_refs list is not None, it fetches the BAM files from each alignment in
         the list.
 
+        All of these are fetched at the same time, on up to fetch-workers threads.
+
         Returns a dictionary of the following:
         {
             assembly: string (file path) or None,
@@ -197,39 +463,62 @@ class GenomeBrowserMaker:
                 name1 (from alignment obj ref): path1,
                 name2: path2,
                 ...etc
+            },
+            fetch_timings: [{
+                type: "assembly", "gff", or "alignment",
+                ref: the fetched object reference,
+                name: the fetched object name,
+                size: the fetched file's size in bytes,
+                cached: true if it came from the download cache,
+                seconds: how long the fetch took
+            }],
+            upas: {
+                assembly: resolved assembly reference or None,
+                genome: resolved genome reference or None,
+                alignments: {name1: resolved reference, ...}
             }
         }
 
         if genome_ref and alignment_refs are both none, this doesn't do much, and returns a boring
         empty dict.
         """
+        with self.telemetry.stage('validate'):
+            resolved = self.resolver.resolve(genome_ref=genome_ref, alignment_refs=alignment_refs)
+        print('Workspace cache stats: {}'.format(object_info_cache.stats()))
+        tasks = self._fetch_tasks(resolved)
+        with self.telemetry.stage('fetch'):
+            fetched, timings = self._fetch_all(tasks)
         files = dict()
         if genome_ref is not None:
-            files.update(self.get_genome_data_files(genome_ref))
+            files["assembly"] = fetched[('assembly', None)]
+            files["gff"] = fetched[('gff', None)]
 
         files["alignment_refs"] = dict()
-        if alignment_refs is not None:
-            files["alignment_refs"] = self.get_alignment_data_files(alignment_refs)
+        upas = {
+            'assembly': resolved['assembly']['upa'] if resolved['assembly'] else None,
+            'genome': resolved['genome']['upa'] if resolved['genome'] else None,
+            'alignments': dict()
+        }
+        for task in tasks:
+            if task['key'][0] == 'alignment':
+                files["alignment_refs"][task['name']] = fetched[task['key']]
+                upas['alignments'][task['name']] = task['upa']
+        files["fetch_timings"] = timings
+        files["upas"] = upas
         return files
 
     def create_browser_data(self, genome_ref, alignment_refs=None):
         # parameter checking
         # make sure that genome_ref is an object reference, and its a genome, and we have
         # permission to it.
+        # the rest of the reference checking happens while resolving them for the download.
         if not genome_ref:
             raise ValueError('genome_ref parameter is required')
-        if not check_reference(genome_ref):
-            raise ValueError('genome_ref must be a reference of the format ws/oid or ws/oid/ver')
-        if not check_reference_type(genome_ref, ['.Genome'], self.workspace_url):
-            raise ValueError('genome_ref must reference a KBaseGenomes.Genome object')
-        if alignment_refs is not None:
-            for ref in alignment_refs:
-                if not check_reference(ref):
-                    raise ValueError('all alignment_refs must be a reference of the format ws/oid or ws/oid/ver')
 
         files = self.get_browser_data_files(genome_ref=genome_ref, alignment_refs=alignment_refs)
         return self.create_browser_data_from_files(
-            files.get("assembly", None), files.get("gff", None), files.get("alignment_refs", dict())
+            files.get("assembly", None), files.get("gff", None), files.get("alignment_refs", dict()),
+            upas=files.get("upas"), move_alignment_files=True
         )
 
     def package_jbrowse_data(self, data_dir, output_dir):
@@ -238,40 +527,204 @@ class GenomeBrowserMaker:
         /kb/module/jbrowse) along with the data_dir into output_dir.
         output_dir should be an ABSOLUTE path. (e.g. /kb/module/work/tmp/minimal_jbrowse)
 
-        NOTE: this is the big piece necessary for JBrowse compatibility with specific
-        versions. It's currently made for JBrowse 1.12.3.
+        The JBrowse parts come from a prebuilt shell (see jbrowse_shell), so this takes
+        about the same time no matter how big the JBrowse tree is. In the "trimmed" package
+        mode, only the files the viewer loads are included.
+
+        Returns the size report of the packaged JBrowse files (see jbrowse_shell).
+        """
+        with self.telemetry.stage('package'):
+            # put the prebuilt JBrowse shell in output_dir, preparing it first if needed
+            start = time.time()
+            manifest = self._prepare_shell()
+            method = materialize_shell(self.jbrowse_shell_dir, output_dir, manifest=manifest)
+            print('Materialized JBrowse shell ({} files) by {} in {:.2f}s'.format(
+                len(manifest['files']), method, time.time() - start))
+            print(format_size_report(manifest))
+
+            # mv data_dir -> output_dir/data
+            shutil.move(data_dir, os.path.join(output_dir, 'data'))
+        return manifest['size_report']
+
+    def _prepare_shell(self):
+        return prepare_shell(self.jbrowse_release_dir, self.jbrowse_shell_dir,
+                             trim=self.jbrowse_package_mode == 'trimmed')
+
+    def package_report_links(self, data_dir, output_dir, owner):
+        """
+        Packages and uploads the browser for data_dir, and returns the list of html_links
+        for its report, with the browser's index page first.
+        output_dir should be an ABSOLUTE path, and is used as in package_jbrowse_data.
+
+        If there's a shared viewer registry, the JBrowse viewer is uploaded once for each
+        owner (the user running this) and recorded there. After that, only the index page and
+        data directory get uploaded, and the viewer is added as the second link. Otherwise,
+        the whole browser is uploaded as one link.
         """
-        # mkdir output_dir
-        os.makedirs(output_dir)
-
-        # cp pieces of the JBrowse dir into output_dir
-        dirs_from_jbrowse = [
-            'browser',
-            'css',
-            'img',
-            'plugins',
-            'src'
-        ]
-        files_from_jbrowse = [
-            'bower.json',
-            'compat_121.html',
-            'index.html',
-            'jbrowse_conf.json',
-            'jbrowse.conf',
-            'LICENSE',
-            'MYMETA.json',
-            'MYMETA.yml',
-            'package.json'
-        ]
-        for d in dirs_from_jbrowse:
-            jb_path = os.path.join(self.jbrowse_dir, d)
-            shutil.copytree(jb_path, os.path.join(output_dir, d))
-        for f in files_from_jbrowse:
-            jb_path = os.path.join(self.jbrowse_dir, f)
-            shutil.copy2(jb_path, os.path.join(output_dir, f))
-
-        # get rid of the src/util tree
-        shutil.rmtree(os.path.join(output_dir, 'src', 'util'))
-
-        # mv data_dir -> output_dir/data
-        shutil.move(data_dir, os.path.join(output_dir, 'data'))
+        if self.viewer_registry is not None:
+            manifest = self._prepare_shell()
+            key = viewer_key(manifest, owner)
+            index_file = os.path.join(mode_dir(self.jbrowse_shell_dir, manifest['trimmed']),
+                                      FILES_DIR, INDEX_FILE)
+            try:
+                with self.telemetry.stage('package', shared_viewer=True):
+                    os.makedirs(output_dir)
+                    with shell_lock(self.jbrowse_shell_dir, trim=manifest['trimmed']):
+                        make_index_page(index_file, os.path.join(output_dir, INDEX_FILE))
+            except ValueError as e:
+                print('Unable to use a shared viewer, packaging the whole browser: {}'.format(e))
+                shutil.rmtree(output_dir)
+            else:
+                viewer_link = self.viewer_registry.get(key)
+                if viewer_link is None:
+                    viewer_dir = os.path.join(self.work_dir, 'shared_jbrowse_viewer')
+                    if os.path.exists(viewer_dir):
+                        shutil.rmtree(viewer_dir)
+                    with self.telemetry.stage('package viewer'):
+                        materialize_shell(self.jbrowse_shell_dir, viewer_dir, manifest=manifest)
+                    viewer_link = self._upload(viewer_dir, 'JBrowse viewer')
+                    self.viewer_registry.put(key, viewer_link)
+                    shutil.rmtree(viewer_dir)
+                else:
+                    print('Using shared JBrowse viewer {} ({} bytes not uploaded)'.format(
+                        viewer_link['shock_id'], manifest['size']))
+                shutil.move(data_dir, os.path.join(output_dir, 'data'))
+                return [self._upload(output_dir, 'Packaged genome browser'), viewer_link]
+
+        self.package_jbrowse_data(data_dir, output_dir)
+        return [self._upload(output_dir, 'Packaged genome browser')]
+
+    def _upload(self, dir_path, description):
+        size = _dir_size(dir_path)
+        with self.telemetry.stage('upload ' + description, bytes_uploaded=size) as record:
+            link = package_directory(self.callback_url, dir_path, INDEX_FILE, description,
+                                     dfu=self.client(DataFileUtil))
+        print('Uploaded {} ({} bytes) in {:.2f}s'.format(
+            description, size, record['wall_seconds']))
+        return link
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+def _run_jbrowse_cmd(cmd, error_msg):
+    print('running command:')
+    print(cmd)
+    p = subprocess.Popen(cmd, shell=False)
+    retcode = p.wait()
+    if retcode != 0:
+        raise RuntimeError('{} Return code: {}'.format(error_msg, retcode))
+
+
+def build_refseq_track(builder, jbrowse_bin, fasta_file, out_dir):
+    """
+    Build stage - makes the reference sequence track in out_dir, and returns its track
+    configurations.
+    """
+    print('Converting FASTA to JBrowse refseq track...')
+    if builder == 'python':
+        refseqs = write_refseqs(fasta_file, out_dir)
+        print('Wrote {} reference sequences'.format(len(refseqs)))
+    else:
+        _run_jbrowse_cmd([os.path.join(jbrowse_bin, 'prepare-refseqs.pl'),
+                          '--fasta',
+                          fasta_file,
+                          '--out',
+                          out_dir],
+                         'Failed to build reference sequence track from FASTA file!')
+    print('Done creating refseq track!')
+    return read_track_list(out_dir)['tracks']
+
+
+def build_feature_track(builder, jbrowse_bin, gff_file, out_dir):
+    """
+    Build stage - makes the feature annotation track in out_dir, and returns its track
+    configurations.
+    """
+    print('Converting GFF to annotation track...')
+    if builder == 'python':
+        feature_counts = write_feature_track(gff_file, out_dir, FEATURE_TRACK_LABEL)
+        print('Wrote {} top level features on {} reference sequences'.format(
+            sum(feature_counts.values()), len(feature_counts)))
+    else:
+        _run_jbrowse_cmd([os.path.join(jbrowse_bin, 'flatfile-to-json.pl'),
+                          '--gff',
+                          gff_file,
+                          '--trackLabel',
+                          FEATURE_TRACK_LABEL,
+                          '--trackType',
+                          'CanvasFeatures',
+                          '--out',
+                          out_dir],
+                         'Failed to build feature annotation track from GFF file!')
+    print('Done creating annotation track!')
+    return read_track_list(out_dir)['tracks']
+
+
+def build_alignment_track(alignment_name, align_file_fullpath, out_dir, cached_bai=None,
+                          allow_move=False):
+    """
+    Build stage - puts a BAM file and its index in out_dir, and returns a dict with the
+    alignment track configuration (as "tracks") and how the BAM file was staged (as
+    "staging", see file_staging.stage_file). This is the same track that add-bam-track.pl
+    would add to trackList.json.
+    If cached_bai is given, that index file is used instead of making a new one. If
+    allow_move is True, the BAM file may be moved instead of linked or copied.
+    """
+    print('Converting BAM file {}'.format(alignment_name))
+    # 1. get the actual file name for the bam file
+    align_filename = os.path.basename(align_file_fullpath)
+    # 2. link (or move, or copy) it to the right location
+    staging = stage_file(align_file_fullpath, os.path.join(out_dir, align_filename),
+                         allow_move=allow_move)
+    print('Staged BAM file {} by {}, avoided copying {} bytes'.format(
+        align_filename, staging['method'], staging['bytes_avoided']))
+
+    # 2.a. TODO: check the header inside the file that it's the correct chromosome...
+    # 3. make a BAI file with samtools, unless there's already one cached
+    align_file_fullpath = os.path.join(out_dir, align_filename)
+    if cached_bai is not None:
+        shutil.move(cached_bai, "{}.bai".format(align_file_fullpath))
+    else:
+        _index_bam(align_file_fullpath)
+    print('Done creating alignment track {}'.format(alignment_name))
+    # 4. the track config gets added to the trackList once all stages are done
+    return {
+        'tracks': [{
+            'label': alignment_name,
+            'key': alignment_name,
+            'type': 'JBrowse/View/Track/Alignments2',
+            'storeClass': 'JBrowse/Store/SeqFeature/BAM',
+            'urlTemplate': align_filename
+        }],
+        'staging': staging
+    }
+
+
+def _index_bam(align_file_fullpath):
+    sam_bai_cmd = ['samtools',
+                   'index',
+                   align_file_fullpath,
+                   "{}.bai".format(align_file_fullpath)]
+    print("Building BAM index with command: {}".format(" ".join(sam_bai_cmd)))
+    p = subprocess.Popen(sam_bai_cmd, shell=False)
+    retcode = p.wait()
+    if retcode != 0:
+        raise RuntimeError('Failed to make index file from BAM file! Return code: {}'.format(retcode))
+
+
+def _merge_stage_dir(stage_dir, out_dir):
+    """
+    Moves everything a build stage made, except its trackList.json, into out_dir.
+    """
+    for name in os.listdir(stage_dir):
+        if name == TRACK_LIST_FILE:
+            continue
+        source = os.path.join(stage_dir, name)
+        target = os.path.join(out_dir, name)
+        if os.path.isdir(source) and os.path.isdir(target):
+            _merge_stage_dir(source, target)
+        else:
+            shutil.move(source, target)
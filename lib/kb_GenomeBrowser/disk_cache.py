@@ -0,0 +1,194 @@
+"""
+A persistent, size-bounded on-disk cache that can be shared by several processes (and jobs)
+on the same node.
+
+Each entry is a directory of files stored under the hash of its key, with a small metadata
+file. Entries are only ever added or removed whole, under an exclusive lock on the cache
+directory, and are read under a shared lock, so a reader never sees a partial entry. When
+the cache grows past its size limit, the least recently used entries are removed.
+
+Files are hard-linked in and out of the cache when possible (see file_staging), so
+cached files must never be modified in place. Each file's size and modification time are
+stored when its entry is added, and can be checked on the way out, so a truncated, replaced
+or rewritten file is dropped instead of being used. Only those are checked, not the file
+contents - that would mean reading every cached file, which can take longer than the
+download it saves.
+"""
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from file_staging import stage_file
+
+META_FILE = 'meta.json'
+DATA_DIR = 'data'
+LOCK_FILE = '.lock'
+TMP_PREFIX = '.tmp_'
+STALE_TMP_SEC = 24 * 60 * 60  # 1 day
+
+
+def _link_tree(src_dir, dest_dir):
+    """
+    Puts everything under src_dir into dest_dir, creating directories as needed.
+    """
+    if not os.path.exists(dest_dir):
+        os.makedirs(dest_dir)
+    for name in os.listdir(src_dir):
+        src = os.path.join(src_dir, name)
+        dest = os.path.join(dest_dir, name)
+        if os.path.isdir(src):
+            _link_tree(src, dest)
+        else:
+            stage_file(src, dest)
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total
+
+
+def _tree_stats(path):
+    """
+    Returns a dict of each file's path relative to path -> [size, modification time].
+    """
+    stats = dict()
+    for root, _, files in os.walk(path):
+        for f in files:
+            st = os.stat(os.path.join(root, f))
+            stats[os.path.relpath(os.path.join(root, f), path)] = [st.st_size, st.st_mtime]
+    return stats
+
+
+class DiskCache(object):
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as e:
+                # another process may have just made it
+                if e.errno != errno.EEXIST:
+                    raise
+        self._lock_path = os.path.join(self.cache_dir, LOCK_FILE)
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha256(key).hexdigest())
+
+    def get(self, key, dest_dir, verify=False):
+        """
+        If key is cached, puts its files into dest_dir and returns the info stored with it
+        (or an empty dict if there wasn't any). Returns None if key isn't cached.
+        If verify is True, the cached files' sizes and modification times are checked against
+        the ones stored when they were added first (their contents aren't read), and if any
+        don't match, the entry is removed and None is returned.
+        """
+        entry_dir = self._entry_dir(key)
+        meta_file = os.path.join(entry_dir, META_FILE)
+        data_dir = os.path.join(entry_dir, DATA_DIR)
+        with self._locked(fcntl.LOCK_SH):
+            if not os.path.exists(meta_file):
+                return None
+            with open(meta_file) as f:
+                meta = json.load(f)
+            valid = not verify or _tree_stats(data_dir) == meta['stats']
+            if valid:
+                _link_tree(data_dir, dest_dir)
+                # the metadata file's mtime is the last used time, for eviction
+                os.utime(meta_file, None)
+        if not valid:
+            print('Cached files for {} failed verification, removing them'.format(key))
+            self.remove(key)
+            return None
+        # None means not cached, so an entry stored without info gets an empty dict
+        info = meta.get('info')
+        return dict() if info is None else info
+
+    def remove(self, key):
+        """
+        Removes key from the cache, if it's there.
+        """
+        with self._locked(fcntl.LOCK_EX):
+            entry_dir = self._entry_dir(key)
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def put(self, key, src, info=None):
+        """
+        Caches a copy of src (a file or a directory's contents) under key, along with an
+        optional JSON-serializable info structure and the sizes and modification times of its
+        files. If key is already cached, this does nothing. Returns the number of bytes
+        stored.
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=TMP_PREFIX)
+        try:
+            data_dir = os.path.join(tmp_dir, DATA_DIR)
+            if os.path.isdir(src):
+                _link_tree(src, data_dir)
+            else:
+                os.makedirs(data_dir)
+                stage_file(src, os.path.join(data_dir, os.path.basename(src)))
+            size = _tree_size(data_dir)
+            meta = {
+                'key': key,
+                'size': size,
+                'info': info,
+                'stats': _tree_stats(data_dir)
+            }
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+                json.dump(meta, f)
+            with self._locked(fcntl.LOCK_EX):
+                entry_dir = self._entry_dir(key)
+                if not os.path.exists(entry_dir):
+                    os.rename(tmp_dir, entry_dir)
+                    tmp_dir = None
+                self._evict()
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return size
+
+    def _evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes. Also cleans
+        up any temporary entries abandoned by crashed processes. Must be called with the
+        exclusive lock held.
+        """
+        entries = list()
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(TMP_PREFIX):
+                if now - os.path.getmtime(path) > STALE_TMP_SEC:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            meta_file = os.path.join(path, META_FILE)
+            if not os.path.isfile(meta_file):
+                continue
+            with open(meta_file) as f:
+                size = json.load(f).get('size', 0)
+            entries.append((os.path.getmtime(meta_file), size, path))
+            total += size
+        entries.sort()
+        while entries and total > self.max_bytes:
+            _, size, path = entries.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
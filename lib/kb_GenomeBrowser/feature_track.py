@@ -0,0 +1,474 @@
+"""
+A native replacement for JBrowse's flatfile-to-json.pl for GFF3 input.
+
+The GFF3 file is read in a single pass. Features are kept in compact, array-backed columns
+(start, end, strand, phase, score, and interned type and source ids) rather than as a dict
+per feature, and only the features of one reference sequence are held at a time. The raw
+attribute strings, which are most of a GFF3 file, are spilled to a temporary file and read
+back when each feature is written, and the ID/Parent hierarchy is kept as arrays of ID
+hashes and sibling links rather than dicts of strings. When the sequence id changes, that
+sequence's features are nested into an NCList and written out as a JBrowse 1.12
+trackData.json, lazily-loaded lf-*.json chunks, and feature density histograms.
+
+Memory still grows with the number of features on the largest reference sequence, at about
+160 bytes per feature at the peak, but not with the size of their attributes.
+
+Files are written with json.dumps, which uses the C encoder, rather than json.dump, which
+doesn't.
+
+This relies on the GFF3 features being grouped by sequence id, which is what
+GenomeFileUtil.genome_to_gff produces.
+"""
+import array
+import json
+import math
+import mmap
+import os
+import tempfile
+import urllib
+from bisect import bisect_left
+from track_list import add_tracks
+
+# bump this whenever the output changes, so cached tracks aren't reused
+FEATURE_TRACK_BUILDER_VERSION = '1'
+TRACKS_DIR = 'tracks'
+DEFAULT_CHUNK_BYTES = 200000
+HIST_CHUNK_SIZE = 10000
+HIST_MULTIPLES = (1, 10, 100, 1000)
+LAZY_URL_TEMPLATE = 'lf-{Chunk}.json'
+_STRANDS = {'+': 1, '-': -1}
+# These GFF3 attributes describe the feature hierarchy, which ends up in Subfeatures.
+_STRUCTURE_ATTRIBUTES = ('parent', 'derives_from')
+
+
+def feature_track_conf(track_label):
+    """
+    Returns the trackList.json entry for a CanvasFeatures track built by this module.
+    """
+    return {
+        'label': track_label,
+        'key': track_label,
+        'type': 'CanvasFeatures',
+        'trackType': 'CanvasFeatures',
+        'storeClass': 'JBrowse/Store/SeqFeature/NCList',
+        'urlTemplate': TRACKS_DIR + '/' + track_label + '/{refseq}/trackData.json',
+        'compress': 0,
+        'style': {'className': 'feature'}
+    }
+
+
+def _parse_attributes(attr_str):
+    """
+    Parses a GFF3 column 9 string into a list of (key, value) tuples, keeping the file order.
+    Values with multiple comma-separated entries become lists.
+    """
+    attributes = list()
+    if attr_str == '.':
+        return attributes
+    for pair in attr_str.split(';'):
+        pair = pair.strip()
+        if not pair or '=' not in pair:
+            continue
+        key, value = pair.split('=', 1)
+        values = value.split(',')
+        if '%' in pair:
+            key = urllib.unquote(key)
+            values = [urllib.unquote(v) for v in values]
+        attributes.append((key, values[0] if len(values) == 1 else values))
+    return attributes
+
+
+class _StringTable(object):
+    """
+    Interns repeated strings (feature types and sources) so each feature only stores an id.
+    """
+    def __init__(self):
+        self.strings = list()
+        self._ids = dict()
+
+    def id_of(self, s):
+        if s not in self._ids:
+            self._ids[s] = len(self.strings)
+            self.strings.append(s)
+        return self._ids[s]
+
+
+class _FeatureColumns(object):
+    """
+    Column store for all the features of a single reference sequence. The attribute strings
+    are appended to attr_file, which is truncated first, so one file can be reused for each
+    sequence in turn.
+    """
+    def __init__(self, seq_id, attr_file):
+        self.seq_id = seq_id
+        self.starts = array.array('l')
+        self.ends = array.array('l')
+        self.strands = array.array('b')
+        self.phases = array.array('b')
+        self.scores = array.array('d')
+        self.type_ids = array.array('i')
+        self.source_ids = array.array('i')
+        self.attr_offsets = array.array('l')
+        self.attr_lengths = array.array('i')
+        # hash of each ID, with the index of the feature it belongs to
+        self.id_hashes = array.array('l')
+        self.id_idxs = array.array('l')
+        # hash of the first Parent of each feature, if has_parent is set. Any other parents
+        # (rare) are in extra_parents, as idx -> list of hashes.
+        self.parent_hashes = array.array('l')
+        self.has_parent = array.array('b')
+        self.extra_parents = dict()
+        self._attr_file = attr_file
+        self._attr_file.seek(0)
+        self._attr_file.truncate()
+        self._attr_size = 0
+        self._attr_map = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end, strand, phase, score, type_id, source_id, attr_str):
+        idx = len(self.starts)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.strands.append(strand)
+        self.phases.append(phase)
+        self.scores.append(score)
+        self.type_ids.append(type_id)
+        self.source_ids.append(source_id)
+        self.attr_offsets.append(self._attr_size)
+        self.attr_lengths.append(len(attr_str))
+        self._attr_file.write(attr_str)
+        self._attr_size += len(attr_str)
+        parent_hash, has_parent = 0, 0
+        if 'ID=' in attr_str or 'Parent=' in attr_str:
+            for key, value in _parse_attributes(attr_str):
+                if key == 'ID':
+                    feature_id = value if isinstance(value, basestring) else value[0]
+                    self.id_hashes.append(hash(feature_id))
+                    self.id_idxs.append(idx)
+                elif key == 'Parent':
+                    values = value if isinstance(value, list) else [value]
+                    parent_hash, has_parent = hash(values[0]), 1
+                    if len(values) > 1:
+                        self.extra_parents[idx] = [hash(v) for v in values[1:]]
+                    else:
+                        self.extra_parents.pop(idx, None)
+        self.parent_hashes.append(parent_hash)
+        self.has_parent.append(has_parent)
+
+    def finish(self):
+        """
+        Makes the attribute strings readable. Call once all the features have been added.
+        """
+        self._attr_file.flush()
+        if self._attr_size:
+            self._attr_map = mmap.mmap(self._attr_file.fileno(), self._attr_size,
+                                       access=mmap.ACCESS_READ)
+
+    def attributes(self, idx):
+        offset = self.attr_offsets[idx]
+        return self._attr_map[offset:offset + self.attr_lengths[idx]]
+
+    def close(self):
+        if self._attr_map is not None:
+            self._attr_map.close()
+            self._attr_map = None
+
+
+class _ClassTable(object):
+    """
+    Collects the distinct ArrayRepr classes (attribute name lists) used by one trackData.json.
+    """
+    def __init__(self):
+        self.classes = list()
+        self._ids = dict()
+
+    def id_of(self, attr_names, array_attrs=()):
+        key = (attr_names, array_attrs)
+        if key not in self._ids:
+            self._ids[key] = len(self.classes)
+            self.classes.append({
+                'attributes': list(attr_names),
+                'isArrayAttr': dict((a, 1) for a in array_attrs)
+            })
+        return self._ids[key]
+
+
+class _RefSeqTrackWriter(object):
+    """
+    Turns the column store of one reference sequence into NCList and histogram files.
+    """
+    def __init__(self, columns, types, sources, out_dir, chunk_bytes):
+        self.cols = columns
+        self.types = types
+        self.sources = sources
+        self.out_dir = out_dir
+        self.chunk_bytes = chunk_bytes
+        self.classes = _ClassTable()
+        # children are linked lists through these arrays, in reverse file order, as each
+        # feature only has one next sibling. Children of any parent after the first are in
+        # extra_children, as idx -> list of child indices.
+        self.first_child = None
+        self.next_sibling = None
+        self.extra_children = dict()
+
+    def write(self):
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        top_level = sorted(self._link_subfeatures(),
+                           key=lambda i: (self.cols.starts[i], -self.cols.ends[i]))
+        lazy_class = self.classes.id_of(('Start', 'End', 'Chunk'), ('Sublist',))
+        nclist = self._write_nclist_chunks(top_level, lazy_class)
+        min_start = min(self.cols.starts[i] for i in top_level)
+        max_end = max(self.cols.ends[i] for i in top_level)
+        track_data = {
+            'featureCount': len(top_level),
+            'formatVersion': 1,
+            'histograms': self._write_histograms(top_level, max_end),
+            'intervals': {
+                'classes': self.classes.classes,
+                'count': len(top_level),
+                'lazyClass': lazy_class,
+                'maxEnd': max_end,
+                'minStart': min_start,
+                'nclist': nclist,
+                'urlTemplate': LAZY_URL_TEMPLATE
+            }
+        }
+        with open(os.path.join(self.out_dir, 'trackData.json'), 'w') as f:
+            f.write(json.dumps(track_data))
+        return len(top_level)
+
+    def _link_subfeatures(self):
+        """
+        Resolves Parent attributes into child links, and returns the indices of the features
+        that have no parent.
+        IDs are matched by hash, through a sorted array, as a dict of all the ID strings would
+        take more memory than everything else put together. The sort is stable, so the first
+        feature with an ID wins, as before.
+        """
+        cols = self.cols
+        order = sorted(xrange(len(cols.id_hashes)), key=cols.id_hashes.__getitem__)
+        id_hashes = array.array('l', (cols.id_hashes[i] for i in order))
+        id_idxs = array.array('l', (cols.id_idxs[i] for i in order))
+        del order
+        num_ids = len(id_hashes)
+        self.first_child = array.array('l', [-1]) * len(cols)
+        self.next_sibling = array.array('l', [-1]) * len(cols)
+        top_level = array.array('l')
+        for idx in xrange(len(cols)):
+            linked = False
+            if cols.has_parent[idx]:
+                for parent_hash in [cols.parent_hashes[idx]] + cols.extra_parents.get(idx, []):
+                    pos = bisect_left(id_hashes, parent_hash)
+                    if pos == num_ids or id_hashes[pos] != parent_hash:
+                        continue
+                    parent_idx = id_idxs[pos]
+                    if parent_idx == idx:
+                        continue
+                    if linked:
+                        self.extra_children.setdefault(parent_idx, list()).append(idx)
+                    else:
+                        self.next_sibling[idx] = self.first_child[parent_idx]
+                        self.first_child[parent_idx] = idx
+                    linked = True
+            if not linked:
+                top_level.append(idx)
+        return top_level
+
+    def _children(self, idx):
+        """
+        Returns the indices of the children of a feature, sorted by start then longest first,
+        with ties in file order.
+        """
+        cols = self.cols
+        child_idxs = list()
+        child = self.first_child[idx]
+        while child >= 0:
+            child_idxs.append(child)
+            child = self.next_sibling[child]
+        child_idxs.extend(self.extra_children.get(idx, ()))
+        child_idxs.sort(key=lambda i: (cols.starts[i], -cols.ends[i], i))
+        return child_idxs
+
+    def _feature_array(self, idx):
+        """
+        Builds the ArrayRepr form of a feature (and all of its subfeatures).
+        """
+        cols = self.cols
+        names = ['Start', 'End', 'Strand']
+        values = [cols.starts[idx], cols.ends[idx], cols.strands[idx]]
+        if cols.source_ids[idx] >= 0:
+            names.append('Source')
+            values.append(self.sources.strings[cols.source_ids[idx]])
+        if cols.phases[idx] >= 0:
+            names.append('Phase')
+            values.append(cols.phases[idx])
+        names.append('Type')
+        values.append(self.types.strings[cols.type_ids[idx]])
+        if not math.isnan(cols.scores[idx]):
+            names.append('Score')
+            values.append(cols.scores[idx])
+        for key, value in _parse_attributes(cols.attributes(idx)):
+            name = key.capitalize()
+            if key.lower() in _STRUCTURE_ATTRIBUTES or name in names:
+                continue
+            names.append(name)
+            values.append(value)
+        array_attrs = ()
+        child_idxs = self._children(idx)
+        if child_idxs:
+            names.append('Subfeatures')
+            values.append([self._feature_array(c) for c in child_idxs])
+            array_attrs = ('Subfeatures',)
+        return [self.classes.id_of(tuple(names), array_attrs)] + values
+
+    def _write_nclist_chunks(self, top_level, lazy_class):
+        """
+        Nests the (sorted) top level features into an NCList, cutting it into lf-*.json chunks
+        of about chunk_bytes each. Returns the top level list of lazy chunk references.
+        """
+        lazy_list = list()
+        chunk = list()
+        chunk_size = [0]
+        chunk_bounds = [None, None]
+        stack = list()
+
+        def flush_chunk():
+            chunk_id = len(lazy_list) + 1
+            with open(os.path.join(self.out_dir, LAZY_URL_TEMPLATE.format(Chunk=chunk_id)), 'w') as f:
+                f.write(json.dumps(chunk))
+            lazy_list.append([lazy_class, chunk_bounds[0], chunk_bounds[1], chunk_id])
+            del chunk[:]
+            chunk_size[0] = 0
+            chunk_bounds[0] = chunk_bounds[1] = None
+
+        for idx in top_level:
+            start, end = self.cols.starts[idx], self.cols.ends[idx]
+            while stack and self.cols.ends[stack[-1][0]] < end:
+                stack.pop()
+            if not stack and chunk_size[0] >= self.chunk_bytes:
+                # nothing is open, so the chunk can be cut here without splitting a sublist
+                flush_chunk()
+            feature = self._feature_array(idx)
+            chunk_size[0] += len(json.dumps(feature))
+            if stack:
+                container = stack[-1][1]
+                if not isinstance(container[-1], dict):
+                    container.append({'Sublist': []})
+                container[-1]['Sublist'].append(feature)
+            else:
+                chunk.append(feature)
+                if chunk_bounds[0] is None:
+                    chunk_bounds[0] = start
+                if chunk_bounds[1] is None or end > chunk_bounds[1]:
+                    chunk_bounds[1] = end
+            stack.append((idx, feature))
+        if chunk:
+            flush_chunk()
+        return lazy_list
+
+    def _write_histograms(self, top_level, ref_len):
+        """
+        Writes feature density histograms at a few zoom levels. The smallest bin size is picked
+        so that there are a few features per bin on average, like flatfile-to-json.pl does.
+        """
+        base_bin = 10 ** int(math.ceil(math.log10(max(ref_len * 2.5 / len(top_level), 10))))
+        counts = array.array('l', [0]) * (ref_len // base_bin + 1)
+        for idx in top_level:
+            for b in xrange(self.cols.starts[idx] // base_bin,
+                            max(self.cols.ends[idx] - 1, self.cols.starts[idx]) // base_bin + 1):
+                counts[b] += 1
+
+        histograms = {'meta': [], 'stats': []}
+        for multiple in HIST_MULTIPLES:
+            bases_per_bin = base_bin * multiple
+            if multiple > 1:
+                if len(counts) == 1:
+                    break
+                counts = array.array('l', [sum(counts[i:i + 10]) for i in xrange(0, len(counts), 10)])
+            url_template = 'hist-{}-{{Chunk}}.json'.format(bases_per_bin)
+            for chunk_idx, offset in enumerate(xrange(0, len(counts), HIST_CHUNK_SIZE)):
+                with open(os.path.join(self.out_dir, url_template.format(Chunk=chunk_idx)), 'w') as f:
+                    f.write(json.dumps(counts[offset:offset + HIST_CHUNK_SIZE].tolist()))
+            histograms['meta'].append({
+                'basesPerBin': str(bases_per_bin),
+                'arrayParams': {
+                    'length': len(counts),
+                    'chunkSize': HIST_CHUNK_SIZE,
+                    'urlTemplate': url_template
+                }
+            })
+            histograms['stats'].append({
+                'basesPerBin': str(bases_per_bin),
+                'max': max(counts),
+                'mean': float(sum(counts)) / len(counts)
+            })
+        return histograms
+
+
+def write_feature_track(gff_file, out_dir, track_label='FeatureAnnotations',
+                        chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Converts gff_file into a CanvasFeatures track called track_label under out_dir, and adds
+    it to out_dir/trackList.json.
+    Returns a dict with the number of top level features written for each reference sequence.
+    """
+    if not os.path.isfile(gff_file):
+        raise IOError('GFF file {} does not exist'.format(gff_file))
+    track_dir = os.path.join(out_dir, TRACKS_DIR, track_label)
+    types = _StringTable()
+    sources = _StringTable()
+    feature_counts = dict()
+    columns = None
+
+    def flush(cols):
+        cols.finish()
+        try:
+            writer = _RefSeqTrackWriter(cols, types, sources,
+                                        os.path.join(track_dir, cols.seq_id), chunk_bytes)
+            feature_counts[cols.seq_id] = writer.write()
+        finally:
+            cols.close()
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with open(gff_file) as gff, tempfile.TemporaryFile(dir=out_dir) as attr_file:
+        for line_num, line in enumerate(gff, 1):
+            if line.startswith('##FASTA'):
+                break
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) != 9:
+                raise ValueError('Line {} of GFF file {} does not have 9 tab-separated columns'
+                                 .format(line_num, gff_file))
+            seq_id = urllib.unquote(fields[0])
+            if columns is None or columns.seq_id != seq_id:
+                if seq_id in feature_counts:
+                    raise ValueError('GFF file {} is not grouped by sequence id - features for {} '
+                                     'appear again at line {}'.format(gff_file, seq_id, line_num))
+                if columns is not None:
+                    flush(columns)
+                columns = _FeatureColumns(seq_id, attr_file)
+                feature_counts[seq_id] = 0
+            try:
+                start = int(fields[3]) - 1
+                end = int(fields[4])
+            except ValueError:
+                raise ValueError('Line {} of GFF file {} has an invalid start or end coordinate'
+                                 .format(line_num, gff_file))
+            columns.add(start,
+                        end,
+                        _STRANDS.get(fields[6], 0),
+                        int(fields[7]) if fields[7] in ('0', '1', '2') else -1,
+                        float(fields[5]) if fields[5] != '.' else float('nan'),
+                        types.id_of(fields[2]),
+                        sources.id_of(fields[1]) if fields[1] != '.' else -1,
+                        fields[8])
+        if columns is not None:
+            flush(columns)
+
+    add_tracks(out_dir, [feature_track_conf(track_label)])
+    return feature_counts
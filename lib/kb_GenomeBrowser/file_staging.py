@@ -0,0 +1,72 @@
+"""
+Puts large input files (mainly BAMs) where they need to go without copying their bytes
+when that can be avoided.
+
+In order, a file is hard-linked, reflinked (a copy-on-write clone, on filesystems that
+support it), or moved (if the caller allows it) into place. If none of those work, usually
+because the source and target are on different filesystems, it's copied in large blocks.
+Staged files share their data with the source, so they must never be modified in place.
+"""
+import errno
+import fcntl
+import os
+import shutil
+
+# from linux/fs.h - _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+# errors meaning "this method doesn't work here", so the next one should be tried
+_UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP,
+                       errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EACCES)
+
+
+def _hardlink(src, dest):
+    os.link(src, dest)
+
+
+def _reflink(src, dest):
+    with open(src, 'rb') as src_f:
+        with open(dest, 'wb') as dest_f:
+            try:
+                fcntl.ioctl(dest_f.fileno(), FICLONE, src_f.fileno())
+            except IOError as e:
+                os.remove(dest)
+                raise OSError(e.errno, e.strerror)
+            except:
+                os.remove(dest)
+                raise
+    shutil.copystat(src, dest)
+
+
+def _copy(src, dest):
+    with open(src, 'rb') as src_f:
+        with open(dest, 'wb') as dest_f:
+            shutil.copyfileobj(src_f, dest_f, COPY_BUFFER_SIZE)
+    shutil.copystat(src, dest)
+
+
+def stage_file(src, dest, allow_move=False):
+    """
+    Puts the file at src at dest, avoiding a copy if possible. If allow_move is True, src
+    may be moved (so it won't be at src anymore). An existing file at dest is replaced.
+    Returns a dict with:
+        method - how the file was staged: "hardlink", "reflink", "move", or "copy"
+        size - the file size in bytes
+        bytes_avoided - the number of bytes that didn't need to be copied
+    """
+    size = os.path.getsize(src)
+    if os.path.lexists(dest):
+        os.remove(dest)
+    methods = [('hardlink', _hardlink), ('reflink', _reflink)]
+    if allow_move:
+        # os.rename only works on the same filesystem, same as the others
+        methods.append(('move', os.rename))
+    for method, func in methods:
+        try:
+            func(src, dest)
+            return {'method': method, 'size': size, 'bytes_avoided': size}
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+    _copy(src, dest)
+    return {'method': 'copy', 'size': size, 'bytes_avoided': 0}
@@ -0,0 +1,329 @@
+"""
+A prebuilt, minimal copy of the JBrowse files that get packaged with every browser (the
+"shell"), so they don't have to be copied out of the JBrowse install one by one for each job.
+
+The shell is prepared once - at image build time, or on first use - with a manifest that
+lists every directory and file in it, and a tar archive of the same files. Each job then
+materializes it by hard-linking the listed files, which takes about the same time no matter
+how big the tree is. If the output is on a different filesystem, so files can't be linked,
+the archive is extracted instead, as one sequential read.
+
+A trimmed shell can be made instead, which leaves out everything the viewer doesn't load:
+the extra top-level files, unbuilt sources and source maps left by a Dojo build, and test,
+demo and doc directories. Pointed at a compiled JBrowse release, that's just the built
+layers and the resources they use. The manifest includes a size report of what was kept and
+what was left out.
+
+The full and trimmed shells are kept in their own directories under the shell directory,
+so switching between them doesn't rebuild either. The manifest records the JBrowse directory
+the shell was made from and its JBrowse version, and a shell made from a different one isn't
+used.
+
+A shell is only replaced under an exclusive lock (a lock file next to its directory), and
+read under a shared one, so a job never sees it half built or removed.
+
+This can also be run as a script to prepare the shell:
+    python jbrowse_shell.py [jbrowse_dir] [shell_dir] [--trim]
+"""
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+from file_staging import stage_file
+
+# bump this whenever the shell contents or layout change
+SHELL_VERSION = '1'
+MANIFEST_FILE = 'manifest.json'
+ARCHIVE_FILE = 'shell.tar'
+FILES_DIR = 'files'
+DEFAULT_JBROWSE_DIR = os.path.join(os.sep, 'kb', 'module', 'jbrowse')
+DEFAULT_SHELL_DIR = os.path.join(os.sep, 'kb', 'module', 'jbrowse_shell')
+FULL_DIR = 'full'
+TRIMMED_DIR = 'trimmed'
+
+# The parts of JBrowse needed in a packaged browser.
+# NOTE: this is the big piece necessary for JBrowse compatibility with specific versions.
+# It's currently made for JBrowse 1.12.3.
+JBROWSE_DIRS = [
+    'browser',
+    'css',
+    'img',
+    'plugins',
+    'src'
+]
+JBROWSE_FILES = [
+    'bower.json',
+    'compat_121.html',
+    'index.html',
+    'jbrowse_conf.json',
+    'jbrowse.conf',
+    'LICENSE',
+    'MYMETA.json',
+    'MYMETA.yml',
+    'package.json'
+]
+# parts of the above that aren't needed
+JBROWSE_EXCLUDED = [
+    os.path.join('src', 'util')
+]
+# parts that the viewer doesn't need, left out of a trimmed shell
+TRIMMED_FILES = [
+    'bower.json',
+    'compat_121.html',
+    'MYMETA.json',
+    'MYMETA.yml'
+]
+TRIMMED_DIR_NAMES = ['tests', 'test', 'demos', 'doc', 'docs']
+TRIMMED_SUFFIXES = ['.uncompressed.js', '.consoleStripped.js', '.js.map', '.md']
+
+
+def mode_dir(shell_dir, trim=False):
+    """
+    Returns the directory under shell_dir that the full (or trimmed, if trim is True) shell
+    is kept in.
+    """
+    return os.path.join(shell_dir, TRIMMED_DIR if trim else FULL_DIR)
+
+
+def jbrowse_version(jbrowse_dir):
+    """
+    Returns the version in the package.json of the JBrowse install in jbrowse_dir, or None
+    if it can't be read.
+    """
+    try:
+        with open(os.path.join(jbrowse_dir, 'package.json')) as f:
+            return json.load(f).get('version')
+    except (IOError, ValueError, AttributeError):
+        return None
+
+
+@contextlib.contextmanager
+def shell_lock(shell_dir, trim=False, mode=fcntl.LOCK_SH):
+    """
+    Holds the lock for the full (or trimmed) shell in shell_dir - shared (the default) for
+    reading the shell, or exclusive for replacing it.
+    """
+    lock_path = os.path.abspath(mode_dir(shell_dir, trim)) + '.lock'
+    parent_dir = os.path.dirname(lock_path)
+    if not os.path.exists(parent_dir):
+        os.makedirs(parent_dir)
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_manifest(shell_dir, trim=False, jbrowse_dir=None):
+    """
+    Returns the manifest of the full (or trimmed) shell in shell_dir, or None if it hasn't
+    been prepared, or was prepared by a different version of this module. If jbrowse_dir is
+    given, None is also returned if the shell wasn't made from that JBrowse directory, or the
+    JBrowse there has a different version now.
+    """
+    manifest_file = os.path.join(mode_dir(shell_dir, trim), MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    if manifest.get('shell_version') != SHELL_VERSION or manifest.get('trimmed') != trim:
+        return None
+    if jbrowse_dir is not None and (
+            manifest.get('source') != os.path.abspath(jbrowse_dir) or
+            manifest.get('jbrowse_version') != jbrowse_version(jbrowse_dir)):
+        return None
+    return manifest
+
+
+def _is_trimmed_file(name):
+    return any(name.endswith(suffix) for suffix in TRIMMED_SUFFIXES)
+
+
+def _walk_files(jbrowse_dir, rel_dir):
+    for root, _, filenames in os.walk(os.path.join(jbrowse_dir, rel_dir)):
+        for f in filenames:
+            yield os.path.relpath(os.path.join(root, f), jbrowse_dir)
+
+
+def _list_shell(jbrowse_dir, trim=False):
+    """
+    Returns the lists of directories and files (relative to jbrowse_dir) that go in the
+    shell, and the list of files left out by trimming.
+    """
+    dirs = list()
+    files = list()
+    trimmed = list()
+    for f in JBROWSE_FILES:
+        (trimmed if trim and f in TRIMMED_FILES else files).append(f)
+    for top in JBROWSE_DIRS:
+        for root, subdirs, filenames in os.walk(os.path.join(jbrowse_dir, top)):
+            rel_root = os.path.relpath(root, jbrowse_dir)
+            subdirs[:] = sorted(d for d in subdirs
+                                if os.path.join(rel_root, d) not in JBROWSE_EXCLUDED)
+            if trim:
+                for d in [d for d in subdirs if d in TRIMMED_DIR_NAMES]:
+                    subdirs.remove(d)
+                    trimmed.extend(_walk_files(jbrowse_dir, os.path.join(rel_root, d)))
+            dirs.append(rel_root)
+            for f in sorted(filenames):
+                (trimmed if trim and _is_trimmed_file(f) else files).append(
+                    os.path.join(rel_root, f))
+    return dirs, files, trimmed
+
+
+def _size_report(jbrowse_dir, files, trimmed):
+    """
+    Totals up the file sizes that were kept in and left out of the shell, by top level
+    directory (or file).
+    """
+    report = {'kept': dict(), 'trimmed': dict()}
+    for kind, paths in (('kept', files), ('trimmed', trimmed)):
+        for path in paths:
+            top = path.split(os.sep)[0]
+            totals = report[kind].setdefault(top, {'files': 0, 'bytes': 0})
+            totals['files'] += 1
+            totals['bytes'] += os.path.getsize(os.path.join(jbrowse_dir, path))
+    for kind in ('kept', 'trimmed'):
+        report[kind + '_bytes'] = sum(t['bytes'] for t in report[kind].values())
+    return report
+
+
+def format_size_report(manifest):
+    """
+    Returns the manifest's size report as a printable table.
+    """
+    report = manifest['size_report']
+    lines = ['{:<24}{:>10}{:>14}{:>10}{:>14}'.format(
+        'JBrowse part', 'kept', 'kept bytes', 'trimmed', 'trimmed bytes')]
+    for top in sorted(set(report['kept']) | set(report['trimmed'])):
+        kept = report['kept'].get(top, {'files': 0, 'bytes': 0})
+        trimmed = report['trimmed'].get(top, {'files': 0, 'bytes': 0})
+        lines.append('{:<24}{:>10}{:>14}{:>10}{:>14}'.format(
+            top, kept['files'], kept['bytes'], trimmed['files'], trimmed['bytes']))
+    lines.append('{:<24}{:>10}{:>14}{:>10}{:>14}'.format(
+        'total', len(manifest['files']), report['kept_bytes'],
+        sum(t['files'] for t in report['trimmed'].values()), report['trimmed_bytes']))
+    return '\n'.join(lines)
+
+
+def prepare_shell(jbrowse_dir=DEFAULT_JBROWSE_DIR, shell_dir=DEFAULT_SHELL_DIR, trim=False):
+    """
+    Makes the shell in shell_dir from the JBrowse install in jbrowse_dir, unless one made
+    from there is already prepared. If trim is True, only what the viewer needs is kept (in
+    a separate directory from the full shell). Safe to run from several processes at once -
+    the shell is built in a temporary directory, then renamed into place under the exclusive
+    lock, with any old shell renamed out of the way first. Only the first one to finish is
+    kept.
+    Returns the shell manifest, a dict with keys:
+        shell_version - the SHELL_VERSION it was made with
+        trimmed - the trim setting it was made with
+        source - the absolute path of the JBrowse directory it was made from
+        jbrowse_version - the version of that JBrowse, from its package.json (or None)
+        dirs - list of directories in the shell, in creation order
+        files - list of files in the shell
+        size - total size of the files in bytes
+        size_report - files and bytes kept and trimmed, in total and for each top level
+            part of JBrowse (see format_size_report)
+    """
+    with shell_lock(shell_dir, trim=trim):
+        manifest = read_manifest(shell_dir, trim=trim, jbrowse_dir=jbrowse_dir)
+    if manifest is not None:
+        return manifest
+    target_dir = mode_dir(shell_dir, trim)
+    if not os.path.exists(shell_dir):
+        os.makedirs(shell_dir)
+    tmp_dir = tempfile.mkdtemp(dir=shell_dir, prefix='.tmp_jbrowse_shell_')
+    old_dir = None
+    try:
+        dirs, files, trimmed = _list_shell(jbrowse_dir, trim=trim)
+        files_dir = os.path.join(tmp_dir, FILES_DIR)
+        for d in dirs:
+            os.makedirs(os.path.join(files_dir, d))
+        size = 0
+        for f in files:
+            shutil.copy2(os.path.join(jbrowse_dir, f), os.path.join(files_dir, f))
+            size += os.path.getsize(os.path.join(files_dir, f))
+        with tarfile.open(os.path.join(tmp_dir, ARCHIVE_FILE), 'w') as archive:
+            for name in JBROWSE_DIRS + [f for f in JBROWSE_FILES if f in files]:
+                archive.add(os.path.join(files_dir, name), arcname=name)
+        manifest = {
+            'shell_version': SHELL_VERSION,
+            'trimmed': trim,
+            'source': os.path.abspath(jbrowse_dir),
+            'jbrowse_version': jbrowse_version(jbrowse_dir),
+            'dirs': dirs,
+            'files': files,
+            'size': size,
+            'size_report': _size_report(jbrowse_dir, files, trimmed)
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f)
+        with shell_lock(shell_dir, trim=trim, mode=fcntl.LOCK_EX):
+            # someone else may have got there first
+            manifest = read_manifest(shell_dir, trim=trim, jbrowse_dir=jbrowse_dir)
+            if manifest is None:
+                if os.path.exists(target_dir):
+                    # an old version - move it out of the way, and remove it after
+                    old_dir = tmp_dir + '_old'
+                    os.rename(target_dir, old_dir)
+                os.rename(tmp_dir, target_dir)
+                tmp_dir = None
+                manifest = read_manifest(shell_dir, trim=trim)
+    finally:
+        for d in (tmp_dir, old_dir):
+            if d is not None:
+                shutil.rmtree(d, ignore_errors=True)
+    return manifest
+
+
+def materialize_shell(shell_dir, output_dir, manifest=None):
+    """
+    Puts the shell's files into output_dir (which must not exist yet), hard-linked when
+    possible, or extracted from the archive when not. manifest is the one returned by
+    prepare_shell, if there is one, and picks the full or trimmed shell. Without it, the full
+    shell is used if it's been prepared, or the trimmed one if not.
+    Returns "hardlink" or "archive", for how it was done.
+    """
+    if manifest is None:
+        trim = read_manifest(shell_dir) is None
+    else:
+        trim = manifest['trimmed']
+    with shell_lock(shell_dir, trim=trim):
+        # the shell may have been replaced since
+        manifest = read_manifest(shell_dir, trim=trim)
+        if manifest is None:
+            raise ValueError('No JBrowse shell has been prepared in {}'.format(shell_dir))
+        return _materialize(mode_dir(shell_dir, trim), output_dir, manifest)
+
+
+def _materialize(shell_dir, output_dir, manifest):
+    os.makedirs(output_dir)
+    files_dir = os.path.join(shell_dir, FILES_DIR)
+    files = manifest['files']
+    # try one file first, to see if links work between these filesystems
+    if files and stage_file(os.path.join(files_dir, files[0]),
+                            os.path.join(output_dir, files[0]))['method'] == 'hardlink':
+        for d in manifest['dirs']:
+            os.makedirs(os.path.join(output_dir, d))
+        for f in files[1:]:
+            os.link(os.path.join(files_dir, f), os.path.join(output_dir, f))
+        return 'hardlink'
+    with tarfile.open(os.path.join(shell_dir, ARCHIVE_FILE)) as archive:
+        archive.extractall(output_dir)
+    return 'archive'
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if a != '--trim']
+    jbrowse_dir = args[0] if len(args) > 0 else DEFAULT_JBROWSE_DIR
+    shell_dir = args[1] if len(args) > 1 else DEFAULT_SHELL_DIR
+    manifest = prepare_shell(jbrowse_dir, shell_dir, trim='--trim' in sys.argv[1:])
+    print('JBrowse {} shell ready in {}: {} files, {} bytes'.format(
+        manifest['jbrowse_version'], mode_dir(shell_dir, manifest['trimmed']),
+        len(manifest['files']), manifest['size']))
+    print(format_size_report(manifest))
@@ -7,11 +7,7 @@ import uuid
 from pprint import pprint, pformat
 from KBaseReport.KBaseReportClient import KBaseReport
 from kb_GenomeBrowser.browse_genome import GenomeBrowserMaker
-from kb_GenomeBrowser.util import (
-    package_directory,
-    check_workspace_name,
-    check_build_genome_browser_parameters
-)
+from kb_GenomeBrowser.util import check_build_genome_browser_parameters, check_workspace_name
 #END_HEADER
 
 
@@ -50,6 +46,7 @@ KBase genome object.
         self.callback_url = os.environ.get('SDK_CALLBACK_URL', None)
         self.scratch_dir = config['scratch']
         self.workspace_url = config['workspace-url']
+        self.config = config
         #END_CONSTRUCTOR
         pass
 
@@ -82,31 +79,36 @@ KBase genome object.
 
         if result_workspace_name is None:
             raise ValueError('result_workspace_name must not be None')
-        elif check_workspace_name(result_workspace_name, self.workspace_url) is False:
-            raise ValueError('result_workspace_name is not a valid workspace!')
-
-        browser = GenomeBrowserMaker(self.callback_url, self.workspace_url, self.scratch_dir)
-        browser_data = browser.create_browser_data(genome_ref, alignment_refs=alignment_refs)
-        pprint(browser_data)
-
-        browser.package_jbrowse_data(browser_data['data_dir'],
-                                     os.path.join(self.scratch_dir, 'minimal_jbrowse'))
-        html_zipped = package_directory(self.callback_url,
-                                        os.path.join(self.scratch_dir, 'minimal_jbrowse'),
-                                        'index.html',
-                                        'Packaged genome browser')
-        report_params = {
-            "message": "Genome Browser for {}".format(genome_ref),
-            "direct_html_link_index": 0,
-            "html_links": [html_zipped],
-            "report_object_name": "GenomeBrowser-" + str(uuid.uuid4()),
-            "workspace_name": result_workspace_name
-        }
 
-        pprint(report_params)
+        # the browser is built and uploaded in its own working directory, which gets removed
+        # afterward.
+        with GenomeBrowserMaker(self.callback_url, self.workspace_url, self.scratch_dir,
+                                config=self.config) as browser:
+            with browser.telemetry.stage('validate workspace'):
+                ws_ok = check_workspace_name(result_workspace_name, self.workspace_url)
+            if ws_ok is False:
+                raise ValueError('result_workspace_name is not a valid workspace!')
+
+            browser_data = browser.create_browser_data(genome_ref, alignment_refs=alignment_refs)
+            pprint(browser_data)
+
+            html_links = browser.package_report_links(browser_data['data_dir'],
+                                                      os.path.join(browser.work_dir, 'minimal_jbrowse'),
+                                                      ctx.get('user_id'))
+            report_params = {
+                "message": "Genome Browser for {}\n\nBuild stages:\n{}".format(
+                    genome_ref, browser.telemetry.summary()),
+                "direct_html_link_index": 0,
+                "html_links": html_links,
+                "report_object_name": "GenomeBrowser-" + str(uuid.uuid4()),
+                "workspace_name": result_workspace_name
+            }
+
+            pprint(report_params)
 
-        kr = KBaseReport(self.callback_url)
-        report_output = kr.create_extended_report(report_params)
+            with browser.telemetry.stage('report'):
+                kr = browser.client(KBaseReport)
+                report_output = kr.create_extended_report(report_params)
 
         # STEP 4: generate the report
         returnVal = {
@@ -159,33 +161,41 @@ KBase genome object.
         if "genome_browser_name" not in params or len(params["genome_browser_name"].trim()) == 0:
             params["genome_browser_name"] = "GenomeBrowser-" + str(uuid.uuid4())
 
-        browser = GenomeBrowserMaker(self.callback_url, self.workspace_url, self.scratch_dir)
-        # if we have a genome_ref, then build browser data from that.
-        # otherwise, assume we have both the gff_file and fasta_file, since we checked.
-        if "genome_ref" in params["genome_input"]:
-            genome_files = browser.get_genome_data_files(params["genome_input"]["genome_ref"])
-        else:
-            genome_files = {
-                "assembly": params["genome_input"]["fasta_file"],
-                "gff": params["genome_input"]["gff_file"]
-            }
-
-        # under the alignments, we either have a list of references or a list of bam file paths.
-        # the checker ensures we don't have a mix.
-        alignment_files = dict()
-        if "alignment_inputs" in params and len(params["alignment_inputs"]) > 0:
-            if "alignment_ref" in params["alignment_inputs"][0]:
-                alignment_files = browser.get_alignment_data_files(
-                    [a["alignment_ref"] for a in params["alignment_inputs"]]
-                )
+        # the browser is built in its own working directory, which gets removed afterward.
+        # only the packaged browser in output_dir is kept.
+        with GenomeBrowserMaker(self.callback_url, self.workspace_url, self.scratch_dir,
+                                config=self.config) as browser:
+            # if we have a genome_ref, then build browser data from that.
+            # otherwise, assume we have both the gff_file and fasta_file, since we checked.
+            # under the alignments, we either have a list of references or a list of bam file paths.
+            # the checker ensures we don't have a mix.
+            # any objects that need downloading get fetched together.
+            genome_ref = params["genome_input"].get("genome_ref", None)
+            alignment_refs = None
+            if "alignment_inputs" in params and len(params["alignment_inputs"]) > 0:
+                if "alignment_ref" in params["alignment_inputs"][0]:
+                    alignment_refs = [a["alignment_ref"] for a in params["alignment_inputs"]]
+            fetched_files = browser.get_browser_data_files(genome_ref=genome_ref,
+                                                           alignment_refs=alignment_refs)
+
+            if genome_ref is not None:
+                genome_files = fetched_files
             else:
+                genome_files = {
+                    "assembly": params["genome_input"]["fasta_file"],
+                    "gff": params["genome_input"]["gff_file"]
+                }
+
+            alignment_files = fetched_files["alignment_refs"]
+            if "alignment_inputs" in params and alignment_refs is None:
                 for idx, align in enumerate(params["alignment_inputs"]):
                     alignment_files["alignment_{}".format(idx)] = align["bam_file"]
 
-        browser_data = browser.create_browser_data_from_files(
-            genome_files["assembly"], genome_files["gff"], alignment_files
-        )
-        browser.package_jbrowse_data(browser_data['data_dir'], output_dir)
+            browser_data = browser.create_browser_data_from_files(
+                genome_files["assembly"], genome_files["gff"], alignment_files,
+                upas=fetched_files.get("upas"), move_alignment_files=alignment_refs is not None
+            )
+            browser.package_jbrowse_data(browser_data['data_dir'], output_dir)
         returnVal = {
             "browser_dir": output_dir
         }
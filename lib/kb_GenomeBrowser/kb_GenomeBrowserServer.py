@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from wsgiref.simple_server import make_server
 import sys
+import copy
 import json
+import threading
 import traceback
 import datetime
 from multiprocessing import Process
+from multiprocessing.pool import ThreadPool
 from getopt import getopt, GetoptError
 from jsonrpcbase import JSONRPCService, InvalidParamsError, KeywordError,\
     JSONRPCError, InvalidRequestError
@@ -17,10 +19,21 @@ import requests as _requests
 import random as _random
 import os
 from kb_GenomeBrowser.authclient import KBaseAuth as _KBaseAuth
+from kb_GenomeBrowser.token_cache import SharedTokenCache
+from kb_GenomeBrowser.metrics import (registry as metrics_registry,
+                                     CONTENT_TYPE as METRICS_CONTENT_TYPE)
+from kb_GenomeBrowser.wsgi_server import make_threaded_server, serve
 
 DEPLOY = 'KB_DEPLOYMENT_CONFIG'
 SERVICE = 'KB_SERVICE_NAME'
 AUTH = 'auth-service-url'
+AUTH_CACHE_FILE = 'auth-cache-file'
+SERVER_THREADS = 'server-threads'
+SERVER_PROCESSES = 'server-processes'
+BATCH_WORKERS = 'batch-workers'
+DEFAULT_SERVER_THREADS = 8
+DEFAULT_SERVER_PROCESSES = 1
+METRICS_PATH = '/metrics'
 
 # Note that the error fields do not match the 2.0 JSONRPC spec
 
@@ -63,6 +76,27 @@ class JSONObjectEncoder(json.JSONEncoder):
 
 class JSONRPCServiceCustom(JSONRPCService):
 
+    def __init__(self, batch_workers=1, metrics=None):
+        """
+        batch_workers - the number of calls in a batch request to run at once.
+        With 1 (the default), they're run one after another.
+        metrics - the metrics.Metrics to count each method call in, if any.
+        """
+        JSONRPCService.__init__(self)
+        if batch_workers < 1:
+            raise ValueError('batch_workers must be at least 1')
+        self.batch_workers = batch_workers
+        self.metrics = metrics
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        # made on first use, so each forked server process gets its own
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(processes=self.batch_workers)
+            return self._pool
+
     def call(self, ctx, jsondata):
         """
         Calls jsonrpc service's method and returns its return value in a JSON
@@ -79,6 +113,12 @@ class JSONRPCServiceCustom(JSONRPCService):
 
     def _call_method(self, ctx, request):
         """Calls given method with given params and returns it value."""
+        if self.metrics is None:
+            return self._call_method_untracked(ctx, request)
+        with self.metrics.track_call(request['method']):
+            return self._call_method_untracked(ctx, request)
+
+    def _call_method_untracked(self, ctx, request):
         method = self.method_data[request['method']]['method']
         params = request['params']
         result = None
@@ -148,21 +188,17 @@ class JSONRPCServiceCustom(JSONRPCService):
 
             return respond
         elif isinstance(rdata, list) and rdata:
-            # It's a batch.
-            requests = []
-            responds = []
-
-            for rdata_ in rdata:
-                # set some default values for error handling
-                request_ = self._get_default_vals()
-                self._fill_request(request_, rdata_)
-                requests.append(request_)
-
-            for request_ in requests:
-                respond = self._handle_request(ctx, request_)
-                # Don't respond to notifications
-                if respond is not None:
-                    responds.append(respond)
+            # It's a batch. Each call gets its own response, or its own error,
+            # in the same order as the calls.
+            if self.batch_workers > 1 and len(rdata) > 1:
+                responds = self._get_pool().map(
+                    lambda rdata_: self._handle_batch_request(ctx, rdata_),
+                    rdata)
+            else:
+                responds = [self._handle_batch_request(ctx, rdata_)
+                            for rdata_ in rdata]
+            # Don't respond to notifications
+            responds = [r for r in responds if r is not None]
 
             if responds:
                 return responds
@@ -173,6 +209,40 @@ class JSONRPCServiceCustom(JSONRPCService):
             # empty dict, list or wrong type
             raise InvalidRequestError
 
+    def _handle_batch_request(self, ctx, rdata):
+        """
+        Handles one call from a batch with its own copy of ctx, and returns its
+        response, or an error response if it fails.
+        """
+        # set some default values for error handling
+        request = self._get_default_vals()
+        try:
+            self._fill_request(request, rdata)
+            call_ctx = copy.copy(ctx)
+            call_ctx['module'], call_ctx['method'] = \
+                request['method'].split('.')
+            call_ctx['call_id'] = request['id']
+            call_ctx['provenance'] = [{'service': call_ctx['module'],
+                                       'method': call_ctx['method'],
+                                       'method_params': request['params']
+                                       }]
+            return self._handle_request(call_ctx, request)
+        except JSONRPCError as jre:
+            error = {'code': jre.code,
+                     'name': jre.message,
+                     'message': jre.data,
+                     'error': getattr(jre, 'trace', None)
+                     }
+        except Exception:
+            error = {'code': 0,
+                     'name': 'Unexpected Server Error',
+                     'message': 'An unexpected server error occurred',
+                     'error': traceback.format_exc()
+                     }
+        respond = {'id': request['id'], 'error': error}
+        self._fill_ver(request['jsonrpc'], respond)
+        return respond
+
     def _handle_request(self, ctx, request):
         """Handles given request and returns its response."""
         if self.method_data[request['method']].has_key('types'):  # noqa @IgnorePep8
@@ -331,7 +401,9 @@ class Application(object):
             submod, ip_address=True, authuser=True, module=True, method=True,
             call_id=True, logfile=self.userlog.get_log_file())
         self.serverlog.set_log_level(6)
-        self.rpc_service = JSONRPCServiceCustom()
+        self.rpc_service = JSONRPCServiceCustom(
+            batch_workers=int((config or {}).get(BATCH_WORKERS) or 1),
+            metrics=metrics_registry)
         self.method_authentication = dict()
         self.rpc_service.add(impl_kb_GenomeBrowser.browse_genome_app,
                              name='kb_GenomeBrowser.browse_genome_app',
@@ -345,7 +417,11 @@ class Application(object):
                              name='kb_GenomeBrowser.status',
                              types=[dict])
         authurl = config.get(AUTH) if config else None
-        self.auth_client = _KBaseAuth(authurl)
+        # share checked tokens between the server processes on this node
+        token_cache = None
+        if config and config.get(AUTH_CACHE_FILE):
+            token_cache = SharedTokenCache(config[AUTH_CACHE_FILE])
+        self.auth_client = _KBaseAuth(authurl, cache=token_cache)
 
     def __call__(self, environ, start_response):
         # Context object, equivalent to the perl impl CallContext
@@ -353,6 +429,15 @@ class Application(object):
         ctx['client_ip'] = getIPAddress(environ)
         status = '500 Internal Server Error'
 
+        if (environ.get('PATH_INFO') == METRICS_PATH and
+                environ['REQUEST_METHOD'] == 'GET'):
+            response_body = metrics_registry.render(
+                self.auth_client.cache_stats()).encode('utf-8')
+            start_response('200 OK', [
+                ('content-type', METRICS_CONTENT_TYPE),
+                ('content-length', str(len(response_body)))])
+            return [response_body]
+
         try:
             body_size = int(environ.get('CONTENT_LENGTH', 0))
         except (ValueError):
@@ -373,25 +458,36 @@ class Application(object):
                        }
                 rpc_result = self.process_error(err, ctx, {'version': '1.1'})
             else:
-                ctx['module'], ctx['method'] = req['method'].split('.')
-                ctx['call_id'] = req['id']
+                # a batch of calls is logged as its first call, and needs a
+                # token if any of its calls do. Each call gets its own copy
+                # of ctx in JSONRPCServiceCustom.call_py.
+                calls = [c for c in (req if isinstance(req, list) else [req])
+                         if isinstance(c, dict)]
+                first = calls[0] if calls else {}
+                ctx['module'], ctx['method'] = \
+                    (first.get('method') or '.').split('.')
+                ctx['call_id'] = first.get('id')
                 ctx['rpc_context'] = {
                     'call_stack': [{'time': self.now_in_utc(),
-                                    'method': req['method']}
+                                    'method': first.get('method')}
                                    ]
                 }
                 prov_action = {'service': ctx['module'],
                                'method': ctx['method'],
-                               'method_params': req['params']
+                               'method_params': first.get('params')
                                }
                 ctx['provenance'] = [prov_action]
                 try:
                     token = environ.get('HTTP_AUTHORIZATION')
                     # parse out the method being requested and check if it
                     # has an authentication requirement
-                    method_name = req['method']
-                    auth_req = self.method_authentication.get(
-                        method_name, 'none')
+                    auth_reqs = set(self.method_authentication.get(
+                        c.get('method'), 'none') for c in calls)
+                    auth_req = 'none'
+                    if 'required' in auth_reqs:
+                        auth_req = 'required'
+                    elif 'optional' in auth_reqs:
+                        auth_req = 'optional'
                     if auth_req != 'none':
                         if token is None and auth_req == 'required':
                             err = JSONServerError()
@@ -498,8 +594,8 @@ application = Application()
 #
 # To run this server in uwsgi with 4 workers listening on port 9999 use:
 # uwsgi -M -p 4 --http :9999 --wsgi-file _this_file_
-# To run a using the single threaded python BaseHTTP service
-# listening on port 9999 by default execute this file
+# To run without uwsgi, on a pool of threads (and optionally processes)
+# listening on port 9999 by default, execute this file. See start_server.
 #
 try:
     import uwsgi
@@ -520,32 +616,47 @@ except ImportError:
 _proc = None
 
 
-def start_server(host='localhost', port=0, newprocess=False):
+def start_server(host='localhost', port=0, newprocess=False, threads=None,
+                 processes=None):
     '''
     By default, will start the server on localhost on a system assigned port
     in the main thread. Excecution of the main thread will stay in the server
     main loop until interrupted. To run the server in a separate process, and
     thus allow the stop_server method to be called, set newprocess = True. This
-    will also allow returning of the port number.'''
+    will also allow returning of the port number.
+    Requests are handled on a pool of threads in each of a number of
+    processes, so a long build doesn't hold up other calls. threads and
+    processes default to the server-threads and server-processes config
+    settings, or 8 threads in 1 process.'''
 
     global _proc
     if _proc:
         raise RuntimeError('server is already running')
-    httpd = make_server(host, port, application)
+    if threads is None:
+        threads = int((config or {}).get(SERVER_THREADS) or
+                      DEFAULT_SERVER_THREADS)
+    if processes is None:
+        processes = int((config or {}).get(SERVER_PROCESSES) or
+                        DEFAULT_SERVER_PROCESSES)
+    httpd = make_threaded_server(host, port, application, threads)
     port = httpd.server_address[1]
-    print "Listening on port %s" % port
+    print "Listening on port %s with %s threads in %s processes" % (
+        port, threads, processes)
     if newprocess:
-        _proc = Process(target=httpd.serve_forever)
-        _proc.daemon = True
+        _proc = Process(target=serve, args=(httpd, processes))
+        # the server's copies are its child processes, which a daemon can't
+        # have, so then stop_server must be called
+        _proc.daemon = processes == 1
         _proc.start()
     else:
-        httpd.serve_forever()
+        serve(httpd, processes)
     return port
 
 
 def stop_server():
     global _proc
     _proc.terminate()
+    _proc.join()
     _proc = None
 
 
@@ -609,23 +720,30 @@ if __name__ == "__main__":
                 token = sys.argv[3]
         sys.exit(process_async_cli(sys.argv[1], sys.argv[2], token))
     try:
-        opts, args = getopt(sys.argv[1:], "", ["port=", "host="])
+        opts, args = getopt(sys.argv[1:], "", ["port=", "host=", "threads=",
+                                               "processes="])
     except GetoptError as err:
         # print help information and exit:
         print str(err)  # will print something like "option -a not recognized"
         sys.exit(2)
     port = 9999
     host = 'localhost'
+    threads = None
+    processes = None
     for o, a in opts:
         if o == '--port':
             port = int(a)
         elif o == '--host':
             host = a
             print "Host set to %s" % host
+        elif o == '--threads':
+            threads = int(a)
+        elif o == '--processes':
+            processes = int(a)
         else:
             assert False, "unhandled option"
 
-    start_server(host=host, port=port)
+    start_server(host=host, port=port, threads=threads, processes=processes)
 #    print "Listening on port %s" % port
 #    httpd = make_server( host, port, application)
 #
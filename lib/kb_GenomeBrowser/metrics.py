@@ -0,0 +1,182 @@
+"""
+Server metrics, served in the Prometheus text format.
+
+For each RPC method, this counts the calls and the calls that failed, and keeps how many are
+running now and a histogram of how long they took. Each call in a batch request counts on
+its own. It also keeps a histogram of how long each kind of build stage took (see
+telemetry.BuildTelemetry), and reports the auth token cache's counts when it's rendered.
+
+The counts are kept by each server process, so with several processes (or uwsgi workers)
+each scrape only sees the process that answered it.
+"""
+import bisect
+import contextlib
+import re
+import threading
+import time
+
+PREFIX = 'kb_genomebrowser_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# upper bounds in seconds, from quick status calls up to long builds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+                    300, 600, 1800, 3600)
+
+# numbered stages (alignment_0, alignment_1, ...) and per object fetches
+# (fetch assembly <name>) are counted together
+_STAGE_NUMBER = re.compile(r'_\d+$')
+
+
+def stage_kind(name):
+    """
+    Returns the kind of build stage a telemetry stage name is, for labelling.
+    """
+    words = _STAGE_NUMBER.sub('', name).split(' ')
+    if words[0] == 'fetch':
+        return ' '.join(words[:2])
+    return ' '.join(words)
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    """
+    Counts observations into buckets, Prometheus style.
+    """
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        # an observation equal to a bound goes in that bucket (le)
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        """
+        Returns the text format lines for this histogram, with the given labels text.
+        """
+        sep = ',' if labels else ''
+        lines = list()
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(name, labels, sep,
+                                                              _number(bound), total))
+        labels = '{' + labels + '}' if labels else ''
+        lines.append('{}_sum{} {}'.format(name, labels, _number(self.sum)))
+        lines.append('{}_count{} {}'.format(name, labels, self.count))
+        return lines
+
+
+class Metrics(object):
+    """
+    The metrics for a server process. Safe to use from any thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = dict()
+        self.errors = dict()
+        self.in_flight = dict()
+        self.durations = dict()
+        self.stages = dict()
+
+    @contextlib.contextmanager
+    def track_call(self, method):
+        """
+        Counts the enclosed block as a call to method, and as an error if it raises.
+        """
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            self.in_flight[method] = self.in_flight.get(method, 0) + 1
+        start = time.time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            seconds = time.time() - start
+            with self._lock:
+                self.in_flight[method] -= 1
+                if failed:
+                    self.errors[method] = self.errors.get(method, 0) + 1
+                if method not in self.durations:
+                    self.durations[method] = Histogram()
+                self.durations[method].observe(seconds)
+
+    def observe_build(self, telemetry):
+        """
+        Adds the timed stages of a finished build's BuildTelemetry. Stages that were found
+        in the cache aren't timed, so aren't counted.
+        """
+        for stage in telemetry.to_dict()['stages']:
+            if stage.get('wall_seconds') is None:
+                continue
+            kind = stage_kind(stage['stage'])
+            with self._lock:
+                if kind not in self.stages:
+                    self.stages[kind] = Histogram()
+                self.stages[kind].observe(stage['wall_seconds'])
+
+    def render(self, auth_cache_stats=None):
+        """
+        Returns the metrics in the Prometheus text format. auth_cache_stats is the dict from
+        KBaseAuth.cache_stats(), if there is one.
+        """
+        lines = list()
+
+        def family(name, kind, help_text):
+            lines.append('# HELP {}{} {}'.format(PREFIX, name, help_text))
+            lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+
+        def by_label(name, label, values):
+            for key in sorted(values):
+                lines.append('{}{}{{{}="{}"}} {}'.format(PREFIX, name, label, _escape(key),
+                                                         _number(values[key])))
+
+        with self._lock:
+            family('requests_total', 'counter', 'RPC calls received, by method.')
+            by_label('requests_total', 'method', self.requests)
+            family('request_errors_total', 'counter', 'RPC calls that failed, by method.')
+            by_label('request_errors_total', 'method',
+                     dict((m, self.errors.get(m, 0)) for m in self.requests))
+            family('requests_in_flight', 'gauge', 'RPC calls running now, by method.')
+            by_label('requests_in_flight', 'method', self.in_flight)
+            family('request_duration_seconds', 'histogram', 'RPC call durations, by method.')
+            for method in sorted(self.durations):
+                lines.extend(self.durations[method].lines(
+                    PREFIX + 'request_duration_seconds', 'method="{}"'.format(_escape(method))))
+            family('build_stage_duration_seconds', 'histogram',
+                   'Build stage durations, by kind of stage.')
+            for kind in sorted(self.stages):
+                lines.extend(self.stages[kind].lines(
+                    PREFIX + 'build_stage_duration_seconds', 'stage="{}"'.format(_escape(kind))))
+
+        if auth_cache_stats is not None:
+            for key, kind, help_text in [
+                    ('hits', 'counter', 'Auth token cache hits.'),
+                    ('misses', 'counter', 'Auth token cache misses.'),
+                    ('evictions', 'counter', 'Auth token cache evictions.'),
+                    ('shared_lookups', 'counter',
+                     "Token lookups that waited for another request's auth service call."),
+                    ('size', 'gauge', 'Tokens in the auth token cache.')]:
+                if auth_cache_stats.get(key) is None:
+                    continue
+                name = 'auth_cache_' + key + ('_total' if kind == 'counter' else '')
+                family(name, kind, help_text)
+                lines.append('{}{} {}'.format(PREFIX, name, auth_cache_stats[key]))
+        return '\n'.join(lines) + '\n'
+
+
+# the metrics of this process, kept by the server and builds
+registry = Metrics()
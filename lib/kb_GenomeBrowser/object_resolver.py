@@ -0,0 +1,120 @@
+"""
+Validates and resolves all of the Workspace objects a browser build needs, in as few
+Workspace calls as possible.
+"""
+from Workspace.WorkspaceClient import Workspace
+from util import check_reference
+from ws_cache import object_info_cache
+
+GENOME_TYPES = ['.Genome']
+ASSEMBLY_TYPES = ['KBaseGenomeAnnotations.Assembly', 'KBaseGenomes.ContigSet']
+ALIGNMENT_TYPES = ['KBaseRNASeq.RNASeqAlignment']
+
+# indices into a Workspace object_info tuple
+INFO_OBJID = 0
+INFO_NAME = 1
+INFO_TYPE = 2
+INFO_VERSION = 4
+INFO_WSID = 6
+INFO_SIZE = 9
+
+
+def _is_type(info, allowed_types):
+    return any(t in info[INFO_TYPE] for t in allowed_types)
+
+
+def _object_desc(ref, info, path=None):
+    return {
+        'ref': ';'.join(path) if path else ref,
+        'upa': '{}/{}/{}'.format(info[INFO_WSID], info[INFO_OBJID], info[INFO_VERSION]),
+        'name': info[INFO_NAME],
+        'type': info[INFO_TYPE],
+        'size': info[INFO_SIZE]
+    }
+
+
+class ObjectResolver(object):
+    """
+    Looks up the genome, its assembly, and any alignments for a browser build.
+    All problems with the given references are gathered up and reported in a single
+    ValueError, rather than stopping at the first one.
+    Lookups go through the shared ws_cache.object_info_cache.
+    """
+    def __init__(self, workspace_url=None, ws_client=None):
+        if ws_client is None:
+            ws_client = Workspace(workspace_url)
+        self.ws = ws_client
+
+    def get_object_infos(self, refs):
+        """
+        Returns the object info and reference path for each of refs, with at most one
+        get_object_info3 call. Inaccessible or missing objects get None for both, instead of
+        raising an error.
+        """
+        return object_info_cache.get_object_infos(self.ws, refs)
+
+    def find_assembly_refs(self, genome_ref):
+        """
+        Returns descriptions of all Assemblies or ContigSets referenced by the genome. Their
+        'ref' is the reference path from the genome, so they're accessible through it.
+        """
+        genome_obj_refs = object_info_cache.get_object_refs(self.ws, genome_ref)
+        infos, paths = self.get_object_infos([genome_ref + ';' + r for r in genome_obj_refs])
+        return [_object_desc(None, info, path) for info, path in zip(infos, paths)
+                if info is not None and _is_type(info, ASSEMBLY_TYPES)]
+
+    def resolve(self, genome_ref=None, alignment_refs=None):
+        """
+        Validates the genome_ref and alignment_refs, and resolves their names, types, sizes,
+        and the genome's assembly. This takes at most three Workspace calls no matter how many
+        alignments there are, and none if they're all cached.
+        Returns a dict with keys:
+            genome - None, or a dict with the ref, upa (the resolved ws/oid/ver reference),
+                name, type, and size of the genome
+            assembly - None, or the same kind of dict for the genome's assembly
+            alignments - a list of the same kind of dict for each alignment, in order
+        """
+        errors = list()
+        to_check = list()
+        if genome_ref is not None:
+            if not check_reference(genome_ref):
+                errors.append('genome_ref must be a reference of the format ws/oid or ws/oid/ver, '
+                              'not {}'.format(genome_ref))
+            else:
+                to_check.append(('genome', genome_ref))
+        for ref in alignment_refs or list():
+            if not check_reference(ref):
+                errors.append('all alignment_refs must be a reference of the format ws/oid or '
+                              'ws/oid/ver, not {}'.format(ref))
+            else:
+                to_check.append(('alignment', ref))
+
+        resolved = {'genome': None, 'assembly': None, 'alignments': list()}
+        infos, _ = self.get_object_infos([ref for _, ref in to_check])
+        for (kind, ref), info in zip(to_check, infos):
+            if info is None:
+                errors.append('Object {} does not exist or is not accessible'.format(ref))
+            elif kind == 'genome':
+                if not _is_type(info, GENOME_TYPES):
+                    errors.append('genome_ref must reference a KBaseGenomes.Genome object, but '
+                                  '{} is a {}'.format(ref, info[INFO_TYPE]))
+                else:
+                    resolved['genome'] = _object_desc(ref, info)
+            elif not _is_type(info, ALIGNMENT_TYPES):
+                errors.append('alignment_refs must reference {} objects, but {} is a {}'.format(
+                    ' or '.join(ALIGNMENT_TYPES), ref, info[INFO_TYPE]))
+            else:
+                resolved['alignments'].append(_object_desc(ref, info))
+
+        if resolved['genome'] is not None:
+            assemblies = self.find_assembly_refs(genome_ref)
+            if len(assemblies) > 1:
+                errors.append('This genome, {}, appears to reference {} Assemblies or ContigSets, with these object references: {}'.format(genome_ref, len(assemblies), [a['ref'] for a in assemblies]))
+            elif len(assemblies) == 0:
+                errors.append('There was no Assembly or ContigSet found as a reference to this genome. Unable to build browser data.')
+            else:
+                resolved['assembly'] = assemblies[0]
+
+        if errors:
+            raise ValueError('Errors found with the given object references:\n' + '\n'.join(errors))
+        return resolved
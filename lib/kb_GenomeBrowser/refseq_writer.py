@@ -0,0 +1,126 @@
+"""
+A native replacement for JBrowse's prepare-refseqs.pl.
+
+This streams a FASTA file and writes the same JBrowse 1.12 reference sequence layout that
+the Perl tool does - a seq/refSeqs.json file, chunked sequence files under a CRC32-hashed
+directory tree, and a "DNA" SequenceTrack in trackList.json. Only one chunk of sequence is
+held in memory at a time, no matter how large the contigs are.
+"""
+import json
+import os
+import zlib
+from track_list import add_tracks
+
+# bump this whenever the output changes, so cached tracks aren't reused
+REFSEQ_WRITER_VERSION = '1'
+DEFAULT_CHUNK_SIZE = 20000
+SEQ_DIR = 'seq'
+REFSEQS_FILE = 'refSeqs.json'
+
+
+def refseq_dirpath(name):
+    """
+    Returns the hashed directory path (relative to seq/) that JBrowse expects to find the
+    chunks of the named reference sequence in. This matches the {refseq_dirpath} template
+    variable used by JBrowse/Store/Sequence/StaticChunked - the zero-padded hex CRC32 of the
+    name, split into 3-character directories.
+    """
+    crc = '{:08x}'.format(zlib.crc32(name) & 0xffffffff)
+    return os.path.join(*[crc[i:i + 3] for i in range(0, len(crc), 3)])
+
+
+def refseq_track_conf(chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns the trackList.json entry for the reference sequence track.
+    """
+    return {
+        'label': 'DNA',
+        'key': 'Reference sequence',
+        'category': 'Reference sequence',
+        'type': 'SequenceTrack',
+        'storeClass': 'JBrowse/Store/Sequence/StaticChunked',
+        'urlTemplate': SEQ_DIR + '/{refseq_dirpath}/{refseq}-',
+        'chunkSize': chunk_size,
+        'seqType': 'dna'
+    }
+
+
+class _RefSeqChunker(object):
+    """
+    Writes out a single reference sequence one chunk at a time.
+    """
+    def __init__(self, seq_dir, name, chunk_size):
+        self.name = name
+        self.chunk_size = chunk_size
+        self.length = 0
+        self.chunk_idx = 0
+        self.buffer = ''
+        self.chunk_dir = os.path.join(seq_dir, refseq_dirpath(name))
+        if not os.path.exists(self.chunk_dir):
+            os.makedirs(self.chunk_dir)
+
+    def add(self, seq):
+        self.length += len(seq)
+        pos = 0
+        while pos < len(seq):
+            needed = self.chunk_size - len(self.buffer)
+            self.buffer += seq[pos:pos + needed]
+            pos += needed
+            if len(self.buffer) == self.chunk_size:
+                self._write_chunk(self.buffer)
+                self.buffer = ''
+
+    def finish(self):
+        if self.buffer:
+            self._write_chunk(self.buffer)
+            self.buffer = ''
+        return {
+            'name': self.name,
+            'start': 0,
+            'end': self.length,
+            'length': self.length,
+            'seqChunkSize': self.chunk_size
+        }
+
+    def _write_chunk(self, chunk):
+        chunk_file = os.path.join(self.chunk_dir, '{}-{}.txt'.format(self.name, self.chunk_idx))
+        with open(chunk_file, 'w') as f:
+            f.write(chunk)
+        self.chunk_idx += 1
+
+
+def write_refseqs(fasta_file, out_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Converts fasta_file into a JBrowse reference sequence track under out_dir.
+    Returns the list of reference sequence descriptions written to refSeqs.json.
+    """
+    if not os.path.isfile(fasta_file):
+        raise IOError('FASTA file {} does not exist'.format(fasta_file))
+    seq_dir = os.path.join(out_dir, SEQ_DIR)
+    if not os.path.exists(seq_dir):
+        os.makedirs(seq_dir)
+
+    refseqs = list()
+    current = None
+    with open(fasta_file) as fasta:
+        for line in fasta:
+            if line.startswith('>'):
+                if current is not None:
+                    refseqs.append(current.finish())
+                header = line[1:].split()
+                if not header:
+                    raise ValueError('Found a FASTA header with no sequence name in {}'.format(fasta_file))
+                current = _RefSeqChunker(seq_dir, header[0], chunk_size)
+            elif current is not None:
+                current.add(''.join(line.split()))
+            elif line.strip():
+                raise ValueError('FASTA file {} has sequence data before the first header'.format(fasta_file))
+    if current is not None:
+        refseqs.append(current.finish())
+    if not refseqs:
+        raise ValueError('No sequences were found in FASTA file {}'.format(fasta_file))
+
+    with open(os.path.join(seq_dir, REFSEQS_FILE), 'w') as f:
+        json.dump(refseqs, f)
+    add_tracks(out_dir, [refseq_track_conf(chunk_size)])
+    return refseqs
@@ -0,0 +1,110 @@
+"""
+Support for uploading the static JBrowse viewer once, and sharing it between reports.
+
+A report's HTML links are each served from their own numbered directory (.../$/0/,
+.../$/1/, and so on), so a report can have its data and index page as the first link and
+the shared viewer as the second. The index page gets a <base> pointing at the viewer's
+directory, so all the JBrowse code and styles load from there, and its data root pointing
+back at the data next to it.
+
+Uploaded viewers are recorded in a small JSON registry file, keyed by the shell version,
+packaging mode, JBrowse version and source directory, and the user who owns the upload. So
+upgrading JBrowse, or packaging from another release, uploads a new viewer.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+
+INDEX_FILE = 'index.html'
+# where the viewer is in the report's html_links, relative to the index page's link
+VIEWER_LINK_INDEX = 1
+VIEWER_BASE = '../{}/'.format(VIEWER_LINK_INDEX)
+DATA_ROOT = '../0/data'
+
+# JBrowse 1.12's index.html picks its data directory with: queryParams.data || 'data'
+_DATA_ROOT_DEFAULT = re.compile(r"(queryParams\.data\s*\|\|\s*)(['\"])data\2")
+_HEAD_TAG = re.compile(r'<head[^>]*>', re.IGNORECASE)
+
+
+def viewer_key(manifest, owner):
+    """
+    Returns the registry key for a viewer made from the shell with the given manifest, and
+    uploaded by owner.
+    """
+    source = hashlib.sha1(manifest['source'].encode('utf-8')).hexdigest()[:12]
+    return '{}/{}/{}/{}/{}'.format(manifest['shell_version'],
+                                   'trimmed' if manifest['trimmed'] else 'full',
+                                   manifest['jbrowse_version'],
+                                   source,
+                                   owner)
+
+
+def make_index_page(index_file, out_file, viewer_base=VIEWER_BASE, data_root=DATA_ROOT):
+    """
+    Writes a copy of the JBrowse index_file to out_file that loads JBrowse from viewer_base,
+    and its data from data_root (relative to viewer_base).
+    Raises a ValueError if index_file doesn't look like a JBrowse index page.
+    """
+    with open(index_file) as f:
+        page = f.read()
+    if not _HEAD_TAG.search(page) or not _DATA_ROOT_DEFAULT.search(page):
+        raise ValueError('Unable to find where to set the viewer and data locations in {}'.format(
+            index_file))
+    page = _HEAD_TAG.sub(lambda m: '{}\n<base href="{}">'.format(m.group(0), viewer_base),
+                         page, count=1)
+    page = _DATA_ROOT_DEFAULT.sub(lambda m: '{0}{1}{2}{1}'.format(m.group(1), m.group(2),
+                                                                 data_root),
+                                  page, count=1)
+    with open(out_file, 'w') as f:
+        f.write(page)
+
+
+class ViewerRegistry(object):
+    """
+    A JSON file of uploaded viewers. Reads and writes are locked, so several jobs on a node
+    can share it.
+    """
+    def __init__(self, registry_file):
+        self.registry_file = registry_file
+        registry_dir = os.path.dirname(os.path.abspath(registry_file))
+        if not os.path.exists(registry_dir):
+            os.makedirs(registry_dir)
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        with open(self.registry_file + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        if not os.path.exists(self.registry_file):
+            return dict()
+        with open(self.registry_file) as f:
+            return json.load(f)
+
+    def get(self, key):
+        """
+        Returns the HTML link record of the viewer registered under key, or None.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            entry = self._read().get(key)
+        return entry['link'] if entry is not None else None
+
+    def put(self, key, link):
+        """
+        Registers the HTML link record (from util.package_directory) of an uploaded viewer.
+        """
+        with self._locked(fcntl.LOCK_EX):
+            registry = self._read()
+            registry[key] = {'link': link, 'created': time.time()}
+            tmp_file = self.registry_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(registry, f, indent=1)
+            os.rename(tmp_file, self.registry_file)
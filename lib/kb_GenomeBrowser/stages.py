@@ -0,0 +1,220 @@
+"""
+A small dependency-graph scheduler for the browser build stages.
+
+Each stage is a module-level function (so it can be sent to a worker process) along with its
+arguments and the names of the stages it depends on. Stages whose dependencies are finished
+are run in worker processes, at most a set number at once. Each worker runs one stage and
+writes its outcome to a file, so a worker that dies (say it's killed for running out of
+memory) or a result that can't be sent back fails the build instead of hanging it.
+
+The workers are new Python processes running this module as a script, not forks of the
+process running the build. The server runs builds on several threads, so a fork could copy
+a lock another thread was holding (in logging, or a shared client session), and the worker
+would wait on it forever. The stage's function and arguments are pickled to a file for the
+worker, so they have to be picklable, and the function importable from the same sys.path.
+Each worker leads its own process group, so when a stage fails, the other workers are
+stopped along with anything they started (samtools, the JBrowse Perl scripts), rather than
+leaving those writing into a work directory that's being cleaned up.
+
+Each stage is measured where it runs (see telemetry.measure), and those records are kept in
+the scheduler's metrics after it runs.
+"""
+import cPickle as pickle
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from telemetry import measure
+
+# how often to check on running stages
+POLL_SEC = 0.1
+
+
+def _run_stage(func, args):
+    """
+    Runs a stage, catching any exception as a traceback string.
+    Returns whether it worked, the result or traceback, and the stage's telemetry record.
+    """
+    record = dict()
+    with measure(record):
+        try:
+            ok, value = True, func(*args)
+        except Exception:
+            ok, value = False, traceback.format_exc()
+    return ok, value, record
+
+
+def _run_stage_to_file(job_file, result_file):
+    """
+    Runs the stage pickled in job_file in a worker process, and writes its outcome to
+    result_file.
+    """
+    try:
+        with open(job_file, 'rb') as f:
+            func, args = pickle.load(f)
+    except Exception:
+        outcome = False, 'Unable to load the stage:\n' + traceback.format_exc(), dict()
+    else:
+        outcome = _run_stage(func, args)
+    try:
+        data = pickle.dumps(outcome, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        data = pickle.dumps((False, 'Unable to send back the stage result:\n' +
+                             traceback.format_exc(), outcome[2]), pickle.HIGHEST_PROTOCOL)
+    with open(result_file, 'wb') as f:
+        f.write(data)
+
+
+def _read_outcome(name, result_file, exitcode):
+    """
+    Returns the outcome a finished worker wrote to result_file, or a failed outcome if it
+    didn't write one.
+    """
+    try:
+        with open(result_file, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        message = 'The worker process for stage {} exited with code {} before finishing.'
+        if exitcode < 0:
+            message = 'The worker process for stage {} was killed by signal {} before finishing.'
+            if exitcode == -9:
+                message += ' It may have run out of memory.'
+        return False, message.format(name, abs(exitcode)), dict()
+
+
+class _Stage(object):
+    def __init__(self, name, func, args, depends_on):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.depends_on = depends_on
+
+
+class StageScheduler(object):
+    def __init__(self, workers=1):
+        """
+        workers = the maximum number of stages to run at once. With 1 worker, stages are run
+        one after another in this process.
+        """
+        self.workers = int(workers)
+        if self.workers < 1:
+            raise ValueError('The number of stage workers must be at least 1')
+        self._stages = list()
+        self.metrics = dict()
+
+    def add_stage(self, name, func, args=(), depends_on=()):
+        """
+        Adds a stage to run. func(*args) is called once every stage named in depends_on has
+        finished.
+        """
+        if name in [s.name for s in self._stages]:
+            raise ValueError('A stage named {} already exists'.format(name))
+        self._stages.append(_Stage(name, func, tuple(args), tuple(depends_on)))
+
+    def _pop_ready(self, pending, finished):
+        ready = [s for s in pending if all(d in finished for d in s.depends_on)]
+        for stage in ready:
+            pending.remove(stage)
+        return ready
+
+    def run(self):
+        """
+        Runs all stages, and returns a dict mapping each stage name to its function's return
+        value. If any stage fails, the remaining ones are cancelled and a RuntimeError is raised.
+        """
+        names = set(s.name for s in self._stages)
+        for stage in self._stages:
+            for dep in stage.depends_on:
+                if dep not in names:
+                    raise ValueError('Stage {} depends on unknown stage {}'.format(stage.name, dep))
+        if self.workers == 1 or len(self._stages) <= 1:
+            return self._run_serial()
+        return self._run_pool()
+
+    def _finish(self, results, name, outcome):
+        ok, value, record = outcome
+        self.metrics[name] = record
+        if not ok:
+            raise RuntimeError('Build stage {} failed:\n{}'.format(name, value))
+        results[name] = value
+
+    def _run_serial(self):
+        results = dict()
+        pending = list(self._stages)
+        while pending:
+            ready = self._pop_ready(pending, results)
+            if not ready:
+                raise ValueError('Circular dependency between stages: {}'.format(
+                    ', '.join(s.name for s in pending)))
+            for stage in ready:
+                self._finish(results, stage.name, _run_stage(stage.func, stage.args))
+        return results
+
+    def _run_pool(self):
+        results = dict()
+        pending = list(self._stages)
+        ready = list()
+        running = dict()
+        result_dir = tempfile.mkdtemp(prefix='stages_')
+        try:
+            while pending or ready or running:
+                ready.extend(self._pop_ready(pending, results))
+                while ready and len(running) < self.workers:
+                    stage = ready.pop(0)
+                    running[stage.name] = _start_worker(stage, result_dir,
+                                                        self._stages.index(stage))
+                if not running:
+                    raise ValueError('Circular dependency between stages: {}'.format(
+                        ', '.join(s.name for s in pending)))
+                finished = [name for name, (worker, _) in running.items()
+                            if worker.poll() is not None]
+                if not finished:
+                    time.sleep(POLL_SEC)
+                for name in finished:
+                    worker, result_file = running.pop(name)
+                    _stop_worker(worker)
+                    self._finish(results, name, _read_outcome(name, result_file,
+                                                              worker.returncode))
+        finally:
+            for worker, _ in running.values():
+                _stop_worker(worker)
+            for worker, _ in running.values():
+                worker.wait()
+            shutil.rmtree(result_dir, ignore_errors=True)
+        return results
+
+
+def _start_worker(stage, result_dir, index):
+    """
+    Starts a worker process for stage, with its job and result files in result_dir.
+    Returns the worker's Popen and result file.
+    """
+    job_file = os.path.join(result_dir, '{}.job'.format(index))
+    result_file = os.path.join(result_dir, '{}.pickle'.format(index))
+    with open(job_file, 'wb') as f:
+        pickle.dump((stage.func, stage.args), f, pickle.HIGHEST_PROTOCOL)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    worker = subprocess.Popen([sys.executable, script, job_file, result_file], env=env,
+                              close_fds=True, preexec_fn=os.setsid)
+    return worker, result_file
+
+
+def _stop_worker(worker):
+    """
+    Stops a worker and anything it started, which are all in its process group. Nothing
+    happens if they've already finished.
+    """
+    try:
+        os.killpg(worker.pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+
+if __name__ == '__main__':
+    _run_stage_to_file(sys.argv[1], sys.argv[2])
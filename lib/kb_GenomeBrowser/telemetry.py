@@ -0,0 +1,119 @@
+"""
+Per-stage build telemetry.
+
+Each stage records its wall time, CPU time, peak RSS, and bytes written. CPU time and bytes
+written come from getrusage for this process plus its finished child processes (like the
+JBrowse scripts and samtools), so they cover the work a stage hands off. Bytes written are
+counted from filesystem output blocks. Peak RSS is the largest seen so far by this process
+or any of its children, as the kernel only tracks a lifetime peak.
+
+Stages that run in a pool worker process are measured there with measure(), and their
+records added here with add().
+"""
+import contextlib
+import json
+import resource
+import threading
+import time
+
+# ru_oublock counts 512 byte blocks on Linux
+BLOCK_SIZE = 512
+# ru_maxrss is in kilobytes on Linux
+MAXRSS_UNITS = 1024
+
+
+def _usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'cpu': own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        'maxrss': max(own.ru_maxrss, children.ru_maxrss) * MAXRSS_UNITS,
+        'oublock': own.ru_oublock + children.ru_oublock
+    }
+
+
+@contextlib.contextmanager
+def measure(record):
+    """
+    Measures the enclosed block, and fills in the given record dict with:
+        wall_seconds, cpu_seconds, peak_rss_bytes, bytes_written
+    """
+    start_time = time.time()
+    start = _usage()
+    try:
+        yield record
+    finally:
+        end = _usage()
+        record['wall_seconds'] = time.time() - start_time
+        record['cpu_seconds'] = end['cpu'] - start['cpu']
+        record['peak_rss_bytes'] = end['maxrss']
+        record['bytes_written'] = (end['oublock'] - start['oublock']) * BLOCK_SIZE
+
+
+class BuildTelemetry(object):
+    """
+    Collects the stage records for one build.
+    """
+    def __init__(self):
+        self.stages = list()
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def add(self, name, record):
+        """
+        Adds a stage record (as made by measure()) under the given stage name.
+        """
+        record = dict(record, stage=name)
+        with self._lock:
+            self.stages.append(record)
+        return record
+
+    @contextlib.contextmanager
+    def stage(self, name, **details):
+        """
+        Measures the enclosed block as a stage with the given name. Any keyword details are
+        stored with it, and the yielded record can have more added to it.
+        Only use this for blocks that don't run at the same time as others, since CPU time
+        and bytes written are counted for the whole process.
+        """
+        record = dict(details)
+        with measure(record):
+            yield record
+        self.add(name, record)
+
+    def to_dict(self):
+        with self._lock:
+            stages = list(self.stages)
+        return {
+            'started': self._start,
+            'total_wall_seconds': time.time() - self._start,
+            'stages': stages
+        }
+
+    def write(self, path):
+        """
+        Writes all stage records to path as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def summary(self):
+        """
+        Returns a short text table of the stage records.
+        """
+        lines = ['{:<28}{:>10}{:>10}{:>12}{:>14}'.format(
+            'stage', 'wall (s)', 'cpu (s)', 'rss (MB)', 'written (MB)')]
+        for s in self.to_dict()['stages']:
+            lines.append('{:<28}{:>10}{:>10}{:>12}{:>14}'.format(
+                s['stage'][:27],
+                _format_number(s.get('wall_seconds')),
+                _format_number(s.get('cpu_seconds')),
+                _format_number(s.get('peak_rss_bytes'), 1024 ** 2),
+                _format_number(s.get('bytes_written'), 1024 ** 2)))
+        return '\n'.join(lines)
+
+
+def _format_number(value, scale=1):
+    if value is None:
+        return '-'
+    return '{:.2f}'.format(float(value) / scale)
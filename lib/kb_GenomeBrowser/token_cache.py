@@ -0,0 +1,143 @@
+"""
+A token cache that's shared by all the server processes on a node, so a token checked by
+one uwsgi worker (or server process) doesn't have to be checked again by the others.
+
+It has the same interface as authclient.TokenCache, and can be given to KBaseAuth in its
+place. Entries are kept in a SQLite database file, which handles the locking between
+processes. Tokens are stored as their SHA-256 hashes, as in TokenCache, and the file is
+only readable by its owner. Valid tokens expire after ttl seconds, and tokens the auth
+service rejected after invalid_ttl seconds. When there are more than maxsize entries, the
+ones that expire first are removed.
+
+The cache is only an optimization, so if the database can't be read or written (say it's
+locked for too long), that lookup is treated as a miss and the entry isn't stored.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAXSIZE = 10000
+DEFAULT_TTL = 5 * 60  # 5 min
+DEFAULT_INVALID_TTL = 30
+# how long to wait for another process's write to finish
+LOCK_TIMEOUT_SEC = 2
+
+_SCHEMA = ('CREATE TABLE IF NOT EXISTS tokens ('
+           'token TEXT PRIMARY KEY, user TEXT, error TEXT, expires REAL NOT NULL)')
+_EXPIRES_INDEX = 'CREATE INDEX IF NOT EXISTS tokens_expires ON tokens (expires)'
+
+
+class SharedTokenCache(object):
+    """
+    A token cache in a SQLite file, shared between processes. Safe to use from any thread.
+    """
+    def __init__(self, cache_file, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL,
+                 invalid_ttl=DEFAULT_INVALID_TTL):
+        self.cache_file = os.path.abspath(cache_file)
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._invalid_ttl = invalid_ttl
+        self._local = threading.local()
+        self._counts_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        cache_dir = os.path.dirname(self.cache_file)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        if not os.path.exists(self.cache_file):
+            # SQLite gives its journal files the same permissions as the database
+            os.close(os.open(self.cache_file, os.O_CREAT | os.O_WRONLY, 0o600))
+        with self._connection() as conn:
+            conn.execute(_SCHEMA)
+            conn.execute(_EXPIRES_INDEX)
+
+    def _connection(self):
+        # SQLite connections can't be shared between threads, or carried over a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.cache_file, timeout=LOCK_TIMEOUT_SEC)
+            # readers don't block the writer, or each other
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name, n=1):
+        with self._counts_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def get(self, token):
+        """
+        Returns (user, None) for a cached valid token, (None, error message) for a cached
+        invalid token, or None if the token isn't cached.
+        """
+        token = hashlib.sha256(token).hexdigest()
+        try:
+            row = self._connection().execute(
+                'SELECT user, error FROM tokens WHERE token = ? AND expires >= ?',
+                (token, time.time())).fetchone()
+        except sqlite3.Error:
+            self._count('errors')
+            row = None
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return row[0], row[1]
+
+    def get_user(self, token):
+        entry = self.get(token)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def add_valid_token(self, token, user):
+        if not token:
+            raise ValueError('Must supply token')
+        if not user:
+            raise ValueError('Must supply user')
+        self._add(token, user, None, self._ttl)
+
+    def add_invalid_token(self, token, error):
+        """
+        Caches the error message for a token the auth service rejected.
+        """
+        if not token:
+            raise ValueError('Must supply token')
+        self._add(token, None, error, self._invalid_ttl)
+
+    def _add(self, token, user, error, ttl):
+        token = hashlib.sha256(token).hexdigest()
+        now = time.time()
+        try:
+            with self._connection() as conn:
+                conn.execute('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?)',
+                             (token, user, error, now + ttl))
+                conn.execute('DELETE FROM tokens WHERE expires < ?', (now,))
+                evicted = conn.execute(
+                    'DELETE FROM tokens WHERE token IN (SELECT token FROM tokens '
+                    'ORDER BY expires LIMIT max(0, (SELECT count(*) FROM tokens) - ?))',
+                    (self._maxsize,)).rowcount
+        except sqlite3.Error:
+            self._count('errors')
+            return
+        if evicted > 0:
+            self._count('evictions', evicted)
+
+    def stats(self):
+        """
+        Returns the number of entries in the cache, and this process's hit, miss, eviction
+        and error counts.
+        """
+        try:
+            size = self._connection().execute('SELECT count(*) FROM tokens').fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        with self._counts_lock:
+            return {'size': size, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'errors': self.errors}
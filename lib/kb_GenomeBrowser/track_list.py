@@ -0,0 +1,41 @@
+"""
+Helpers for reading and updating a JBrowse trackList.json file.
+"""
+import json
+import os
+
+TRACK_LIST_FILE = 'trackList.json'
+
+
+def read_track_list(data_dir):
+    """
+    Returns the parsed trackList.json from data_dir, or an empty track list structure if
+    there isn't one there yet.
+    """
+    track_list_path = os.path.join(data_dir, TRACK_LIST_FILE)
+    if not os.path.exists(track_list_path):
+        return {'formatVersion': 1, 'tracks': []}
+    with open(track_list_path) as f:
+        return json.load(f)
+
+
+def add_tracks(data_dir, track_confs):
+    """
+    Adds each track configuration in track_confs to the trackList.json in data_dir, creating
+    the file if needed. A track with the same label as an existing one replaces it in place,
+    which is what the JBrowse Perl tools do.
+    """
+    track_list = read_track_list(data_dir)
+    tracks = track_list.setdefault('tracks', [])
+    for conf in track_confs:
+        for idx, track in enumerate(tracks):
+            if track.get('label') == conf['label']:
+                tracks[idx] = conf
+                break
+        else:
+            tracks.append(conf)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    with open(os.path.join(data_dir, TRACK_LIST_FILE), 'w') as f:
+        json.dump(track_list, f, indent=3)
+    return track_list
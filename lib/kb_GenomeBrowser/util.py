@@ -1,9 +1,38 @@
 """
 Some utility functions that deal with object reference validation.
 """
+import os
 import re
+import threading
 from Workspace.WorkspaceClient import Workspace
 from DataFileUtil.DataFileUtilClient import DataFileUtil
+from ws_cache import object_info_cache
+
+_ws_clients = dict()
+_ws_clients_lock = threading.Lock()
+
+
+def get_workspace_client(ws_url):
+    """
+    Returns a Workspace client for ws_url, reusing the one made earlier for the same URL and
+    auth token.
+    """
+    key = (ws_url, os.environ.get('KB_AUTH_TOKEN'))
+    with _ws_clients_lock:
+        if key not in _ws_clients:
+            _ws_clients[key] = Workspace(ws_url)
+        return _ws_clients[key]
+
+
+def _get_object_info(ref, ws_url):
+    """
+    Returns the (possibly cached) object info for ref. Raises a ValueError if the object
+    doesn't exist or isn't accessible.
+    """
+    infos, _ = object_info_cache.get_object_infos(get_workspace_client(ws_url), [ref])
+    if infos[0] is None:
+        raise ValueError("Object {} does not exist or is not accessible".format(ref))
+    return infos[0]
 
 
 def get_object_name(ref, ws_url):
@@ -12,8 +41,7 @@ def get_object_name(ref, ws_url):
     """
     if not check_reference(ref):
         raise ValueError("This must be a valid object reference to find the object's name.")
-    ws = Workspace(ws_url)
-    info = ws.get_object_info3({"objects": [{"ref": ref}]}).get("infos")[0]
+    info = _get_object_info(ref, ws_url)
     return info[1]
 
 
@@ -37,8 +65,7 @@ def check_reference_type(ref, allowed_types, ws_url):
     of the ref object's name.
     E.g. if ".Genome" is an allowed type, it'll pass if the object is a "KBaseGenomes.Genome"
     """
-    ws = Workspace(ws_url)
-    info = ws.get_object_info3({"objects": [{"ref": ref}]}).get("infos")[0]
+    info = _get_object_info(ref, ws_url)
     passes = False
     for t in allowed_types:
         if t in info[2]:
@@ -52,18 +79,19 @@ def check_workspace_name(ws_name, ws_url):
     and is an appropriately formatted name.
     Really, it just pokes the Workspace with the name and returns True if it can.
     """
-    ws = Workspace(ws_url)
+    ws = get_workspace_client(ws_url)
     try:
         # let the Workspace do the work - if this is NOT a real name, it will raise an exception.
-        ws.get_workspace_info({"workspace": ws_name})
+        object_info_cache.get_workspace_info(ws, ws_name)
         return True
-    except:
+    except Exception:
         return False
 
 
-def package_directory(callback_url, dir_path, zip_file_name, zip_file_description):
-    ''' Simple utility for packaging a folder and saving to shock '''
-    dfu = DataFileUtil(callback_url)
+def package_directory(callback_url, dir_path, zip_file_name, zip_file_description, dfu=None):
+    ''' Simple utility for packaging a folder and saving to shock. Uses dfu if given. '''
+    if dfu is None:
+        dfu = DataFileUtil(callback_url)
     output = dfu.file_to_shock({'file_path': dir_path,
                                 'make_handle': 0,
                                 'pack': 'zip'})
@@ -0,0 +1,188 @@
+"""
+In-process caching of Workspace lookups.
+
+A single module-level ObjectInfoCache is shared by everything in this process, so a
+long-running server doesn't repeat the same metadata lookups across jobs. Objects are cached
+by their resolved, versioned reference path (UPA) - those never change. A versioned ref's
+mapping to its UPA is cached until it gets evicted, while an unversioned ref (which could
+point to a newer version later) maps to its UPA only for a limited time. Workspace info is
+also cached for a limited time.
+
+Entries are namespaced by Workspace URL and auth token, so one user's lookups never answer
+another's.
+"""
+import collections
+import hashlib
+import re
+import threading
+import time
+
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_TTL_SEC = 5 * 60  # 5 min
+
+_VERSIONED_STEP = re.compile('^[^/]+/[^/]+/\d+$')
+
+
+def is_versioned_ref(ref):
+    """
+    Returns True if every step of the reference path has a version, so it always points to
+    the same object.
+    """
+    return all(_VERSIONED_STEP.match(step) for step in ref.split(';'))
+
+
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded LRU cache. Each entry can optionally expire after a given
+    number of seconds. Keeps hit, miss, and eviction counts.
+    """
+    def __init__(self, maxsize=DEFAULT_MAX_SIZE):
+        self._maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it's missing or expired.
+        """
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                self.misses += 1
+                return None
+            # re-insert to mark as most recently used
+            self._cache[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        """
+        Caches value under key. If ttl is not None, the entry expires after ttl seconds.
+        """
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = (value, expires)
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class ObjectInfoCache(object):
+    """
+    Caches Workspace object info, object refs, and workspace info lookups.
+    """
+    def __init__(self, maxsize=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL_SEC):
+        self.ttl = ttl
+        self._upas = LRUCache(maxsize)
+        self._infos = LRUCache(maxsize)
+        self._obj_refs = LRUCache(maxsize)
+        self._ws_infos = LRUCache(maxsize)
+
+    def _namespace(self, ws_client):
+        client = ws_client._client
+        token = client._headers.get('AUTHORIZATION') or ''
+        return client.url, hashlib.sha256(token).hexdigest()
+
+    def get_object_infos(self, ws_client, refs):
+        """
+        Works like get_object_info3 with ignoreErrors set. Returns a list of object infos and
+        a list of resolved reference paths for refs, with None for objects that are missing
+        or inaccessible. Only the refs that aren't cached are looked up, all in one call.
+        Missing objects aren't cached.
+        """
+        ns = self._namespace(ws_client)
+        results = [None] * len(refs)
+        uncached = list()
+        for idx, ref in enumerate(refs):
+            upa = self._upas.get((ns, ref))
+            cached = self._infos.get((ns, upa)) if upa is not None else None
+            if cached is not None:
+                results[idx] = cached
+            else:
+                uncached.append(idx)
+
+        if uncached:
+            ret = ws_client.get_object_info3({
+                'objects': [{'ref': refs[idx]} for idx in uncached],
+                'ignoreErrors': 1
+            })
+            for idx, info, path in zip(uncached, ret.get('infos'), ret.get('paths')):
+                if info is None:
+                    continue
+                upa = ';'.join(path)
+                ttl = None if is_versioned_ref(refs[idx]) else self.ttl
+                self._upas.put((ns, refs[idx]), upa, ttl=ttl)
+                self._infos.put((ns, upa), (info, path))
+                results[idx] = (info, path)
+
+        infos = [r[0] if r is not None else None for r in results]
+        paths = [r[1] if r is not None else None for r in results]
+        return infos, paths
+
+    def get_object_refs(self, ws_client, ref):
+        """
+        Returns the list of references (the 'refs' field from get_objects2) held by the object
+        at ref. These can't change for a given object version, so they're cached by UPA.
+        """
+        ns = self._namespace(ws_client)
+        infos, paths = self.get_object_infos(ws_client, [ref])
+        upa = ';'.join(paths[0]) if paths[0] is not None else None
+        obj_refs = self._obj_refs.get((ns, upa)) if upa is not None else None
+        if obj_refs is None:
+            obj_info = ws_client.get_objects2({
+                'objects': [{'ref': upa or ref}],
+                'no_data': 1
+            })
+            # if there are no refs (or something funky with the return), this will be an
+            # empty list.
+            obj_refs = obj_info.get('data', [{}])[0].get('refs', [])
+            if upa is not None:
+                self._obj_refs.put((ns, upa), obj_refs)
+        return obj_refs
+
+    def get_workspace_info(self, ws_client, ws_name):
+        """
+        Returns the workspace info for ws_name. Raises whatever the Workspace does if it
+        doesn't exist or isn't accessible - those aren't cached.
+        """
+        key = (self._namespace(ws_client), ws_name)
+        ws_info = self._ws_infos.get(key)
+        if ws_info is None:
+            ws_info = ws_client.get_workspace_info({'workspace': ws_name})
+            self._ws_infos.put(key, ws_info, ttl=self.ttl)
+        return ws_info
+
+    def clear(self):
+        for cache in (self._upas, self._infos, self._obj_refs, self._ws_infos):
+            cache.clear()
+
+    def stats(self):
+        """
+        Returns the size, hit, miss, and eviction counts for each of the caches.
+        """
+        return {
+            'object_upas': self._upas.stats(),
+            'object_infos': self._infos.stats(),
+            'object_refs': self._obj_refs.stats(),
+            'workspace_infos': self._ws_infos.stats()
+        }
+
+
+object_info_cache = ObjectInfoCache()
@@ -0,0 +1,115 @@
+"""
+A concurrent WSGI server for running the service without uwsgi.
+
+Each connection gets its own thread, and is kept open between requests (HTTP/1.1
+keep-alive) until it's idle for KEEPALIVE_TIMEOUT seconds. At most a set number of requests
+are handled at once (the workers), and the rest wait for one to free up. So a long build
+doesn't hold up other requests (like status checks) while there are workers to spare, and
+an idle connection never holds on to a worker. For more than one process, serve() forks
+copies of the server that all accept connections on the same socket.
+"""
+import BaseHTTPServer
+import SocketServer
+import signal
+import socket
+import sys
+import threading
+from multiprocessing import Process
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+
+KEEPALIVE_TIMEOUT = 15
+MAX_REQUEST_LINE = 65536
+
+
+class _KeepAliveServerHandler(ServerHandler):
+    http_version = '1.1'
+
+    def close(self):
+        # the connection can only be reused if the client can tell where the response ends
+        if self.headers is None or self.headers.get('Content-Length') is None:
+            self.request_handler.close_connection = 1
+        ServerHandler.close(self)
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Handles any number of HTTP/1.1 requests on a connection, until the client closes it or
+    it's idle for KEEPALIVE_TIMEOUT seconds.
+    """
+    protocol_version = 'HTTP/1.1'
+    # wsgiref writes the headers and body separately, which Nagle's algorithm would hold up
+    disable_nagle_algorithm = True
+    timeout = KEEPALIVE_TIMEOUT
+
+    def handle(self):
+        # BaseHTTPRequestHandler.handle calls handle_one_request until the connection closes
+        BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(MAX_REQUEST_LINE + 1)
+        except socket.timeout:
+            self.close_connection = 1
+            return
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if len(self.raw_requestline) > MAX_REQUEST_LINE:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = 1
+            return
+        if not self.parse_request():
+            return
+        handler = _KeepAliveServerHandler(self.rfile, self.wfile, self.get_stderr(),
+                                          self.get_environ())
+        handler.request_handler = self
+        with self.server.workers:
+            handler.run(self.server.get_app())
+
+
+class ThreadedWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
+    """
+    A WSGI server that handles each connection on its own thread, and at most threads
+    requests at once.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, threads, handler_class=KeepAliveRequestHandler):
+        if threads < 1:
+            raise ValueError('threads must be at least 1')
+        WSGIServer.__init__(self, server_address, handler_class)
+        self.threads = threads
+        self.workers = threading.BoundedSemaphore(threads)
+
+
+def make_threaded_server(host, port, app, threads):
+    """
+    Returns a ThreadedWSGIServer for app, listening on host and port (0 for any free port),
+    that handles up to threads requests at once.
+    """
+    server = ThreadedWSGIServer((host, port), threads)
+    server.set_app(app)
+    return server
+
+
+def serve(server, processes=1):
+    """
+    Serves forever on server in this process, and in processes - 1 forked copies of it that
+    share its socket. The copies are stopped when this process is stopped.
+    """
+    if processes < 1:
+        raise ValueError('processes must be at least 1')
+    if processes > 1:
+        # every process is woken for a new connection, but only one gets it, so the others
+        # mustn't wait in accept()
+        server.socket.setblocking(False)
+        for _ in range(processes - 1):
+            worker = Process(target=server.serve_forever)
+            worker.daemon = True
+            worker.start()
+        # exit normally on SIGTERM, so multiprocessing stops the copies
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server.serve_forever()
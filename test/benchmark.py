@@ -0,0 +1,207 @@
+"""
+Offline benchmarks for building and packaging genome browsers from synthetic data.
+
+Each scale builds a browser with create_browser_data_from_files and packages it with
+package_jbrowse_data, then times a few of the utility functions. The build telemetry is
+kept for every stage. Each run is appended to a JSON history file, and compared against the
+run before it (or a chosen one), flagging any timing that got slower by more than the
+threshold.
+
+This needs no KBase services, just JBrowse and samtools, and the lib directory on the
+PYTHONPATH. For example:
+    python benchmark.py --scales small,medium --history /kb/module/work/benchmarks.json
+    python benchmark.py --compare-only --history /kb/module/work/benchmarks.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from ConfigParser import ConfigParser
+from synthetic_data import make_inputs, SCALES
+from kb_GenomeBrowser.browse_genome import GenomeBrowserMaker
+from kb_GenomeBrowser.util import check_reference, check_build_genome_browser_parameters
+
+DEFAULT_THRESHOLD = 0.1
+# the builds never call the Workspace, but the client needs a URL
+OFFLINE_WORKSPACE_URL = 'http://localhost:1/services/ws'
+UTIL_ITERATIONS = 100000
+
+
+def _time_util_functions():
+    """
+    Returns the seconds taken by UTIL_ITERATIONS calls of each pure utility function.
+    """
+    params = {
+        'genome_input': {'genome_ref': '1/2/3'},
+        'alignment_inputs': [{'alignment_ref': '1/3/1'}, {'alignment_ref': '1/4/1'}],
+        'result_workspace_id': 1
+    }
+    timings = dict()
+    for name, func, args in [('check_reference', check_reference, ('12/34/5',)),
+                             ('check_build_genome_browser_parameters',
+                              check_build_genome_browser_parameters, (params,))]:
+        start = time.time()
+        for _ in range(UTIL_ITERATIONS):
+            func(*args)
+        timings[name] = time.time() - start
+    return timings
+
+
+def run_scale(scale, data_dir, work_dir, config):
+    """
+    Builds and packages a browser at the given scale, and returns its results.
+    """
+    genome_size, num_genes, depths = SCALES[scale]
+    start = time.time()
+    inputs = make_inputs(data_dir, genome_size, num_genes, depths=depths)
+    input_seconds = time.time() - start
+
+    scale_dir = os.path.join(work_dir, scale)
+    if os.path.exists(scale_dir):
+        shutil.rmtree(scale_dir)
+    os.makedirs(scale_dir)
+    timings = dict()
+    with GenomeBrowserMaker(None, OFFLINE_WORKSPACE_URL, scale_dir, config=config) as browser:
+        start = time.time()
+        browser_data = browser.create_browser_data_from_files(
+            inputs['fasta'], inputs['gff'], dict(inputs['alignments']))
+        timings['create_browser_data_from_files'] = time.time() - start
+        start = time.time()
+        browser.package_jbrowse_data(browser_data['data_dir'],
+                                     os.path.join(scale_dir, 'packaged'))
+        timings['package_jbrowse_data'] = time.time() - start
+        stages = browser.telemetry.to_dict()['stages']
+    for name, seconds in _time_util_functions().items():
+        timings['util.' + name] = seconds
+    for s in stages:
+        timings['stage.' + s['stage']] = s.get('wall_seconds')
+    shutil.rmtree(scale_dir)
+    return {
+        'genome_size': genome_size,
+        'genes': num_genes,
+        'depths': list(depths),
+        'input_seconds': input_seconds,
+        'timings': timings,
+        'stages': stages
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return list()
+    with open(history_file) as f:
+        return json.load(f)
+
+
+def save_history(history_file, history):
+    tmp_file = history_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(history, f, indent=1)
+    os.rename(tmp_file, history_file)
+
+
+def compare_runs(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the timings of two runs from the history, scale by scale. Returns the report
+    lines, and the list of (scale, timing name, change) that got slower by more than the
+    threshold (a fraction).
+    """
+    lines = ['Comparing run {} ({}) to run {} ({})'.format(
+        current['run'], current['commit'], baseline['run'], baseline['commit'])]
+    lines.append('{:<10}{:<48}{:>12}{:>12}{:>10}'.format(
+        'scale', 'timing', 'before (s)', 'after (s)', 'change'))
+    regressions = list()
+    for scale in sorted(current['scales']):
+        if scale not in baseline['scales']:
+            continue
+        before = baseline['scales'][scale]['timings']
+        after = current['scales'][scale]['timings']
+        for name in sorted(after):
+            if before.get(name) is None or after[name] is None:
+                continue
+            change = (after[name] - before[name]) / before[name] if before[name] > 0 else 0.0
+            flag = ''
+            if change > threshold:
+                flag = ' SLOWER'
+                regressions.append((scale, name, change))
+            lines.append('{:<10}{:<48}{:>12.3f}{:>12.3f}{:>+9.1%}{}'.format(
+                scale, name[:47], before[name], after[name], change, flag))
+    return lines, regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Offline Genome Browser benchmarks')
+    parser.add_argument('--scales', default='tiny,small',
+                        help='comma separated list of scales: ' + ', '.join(sorted(SCALES)))
+    parser.add_argument('--data-dir', default='/kb/module/work/benchmark_data',
+                        help='where the synthetic inputs are made and kept between runs')
+    parser.add_argument('--work-dir', default='/kb/module/work/tmp/benchmark',
+                        help='scratch space for the builds')
+    parser.add_argument('--history', default='/kb/module/work/benchmark_history.json',
+                        help='JSON file of past runs to add to and compare with')
+    parser.add_argument('--config', default=os.environ.get('KB_DEPLOYMENT_CONFIG'),
+                        help='deploy.cfg to take the build settings from')
+    parser.add_argument('--baseline', type=int, default=None,
+                        help='run number to compare with (default: the previous run)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fraction a timing can grow before it counts as slower')
+    parser.add_argument('--compare-only', action='store_true',
+                        help="don't run anything, just compare the last run in the history")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='exit with status 1 if anything got slower')
+    args = parser.parse_args(argv)
+
+    history = load_history(args.history)
+    if not args.compare_only:
+        config = dict()
+        if args.config:
+            cfg_parser = ConfigParser()
+            cfg_parser.read(args.config)
+            config = dict(cfg_parser.items('kb_GenomeBrowser'))
+        run = {
+            'run': len(history) + 1,
+            'started': time.time(),
+            'commit': _git_commit(),
+            'host': platform.node(),
+            'config': config,
+            'scales': dict()
+        }
+        for scale in args.scales.split(','):
+            if scale not in SCALES:
+                parser.error('Unknown scale {}'.format(scale))
+            print('Running {} benchmark...'.format(scale))
+            run['scales'][scale] = run_scale(scale, args.data_dir, args.work_dir, config)
+        history.append(run)
+        save_history(args.history, history)
+        print('Saved run {} to {}'.format(run['run'], args.history))
+
+    if len(history) < 2:
+        print('Nothing to compare with yet.')
+        return 0
+    baseline = history[-2]
+    if args.baseline is not None:
+        baseline = [r for r in history if r['run'] == args.baseline][0]
+    lines, regressions = compare_runs(baseline, history[-1], threshold=args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print('{} timings got slower by more than {:.0%}'.format(len(regressions),
+                                                                 args.threshold))
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,142 @@
+"""
+Round trip benchmark for the KBase service clients, against the local stand-in services.
+
+Times the same Workspace metadata calls two ways:
+    new connection - a new client and connection for every call, like the clients used to do
+    pooled - one client for every call, reusing a kept-alive connection from the shared
+        session
+    async - the pooled client, with all the calls started at once with call_method_async,
+        up to --max-async-calls at a time
+    batched - the pooled client, sending --batch-size calls at a time with call_batch
+and prints the time per call for each, and the speedup over a new connection per call. Latency can be added to every
+request, to stand in for a real network. For example:
+    PYTHONPATH=../lib python client_benchmark.py --calls 500 --latency-ms 2
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+import requests
+from local_services import LocalServices
+from kb_GenomeBrowser.baseclient import BaseClient, _get_session
+
+FIXTURES = {
+    'workspaces': {'bench_ws': 1},
+    'objects': {
+        '1/1/1': {'name': 'genome', 'type': 'KBaseGenomes.Genome-8.2', 'refs': ['1/2/1']},
+        '1/2/1': {'name': 'assembly', 'type': 'KBaseGenomeAnnotations.Assembly-5.0'}
+    }
+}
+CALLS = [
+    ('Workspace.get_object_info3', [{'objects': [{'ref': '1/1/1'}, {'ref': '1/1/1;1/2/1'}],
+                                     'ignoreErrors': 1}]),
+    ('Workspace.get_workspace_info', [{'workspace': 'bench_ws'}])
+]
+
+
+def _new_connection_call(url, method, params):
+    session = requests.Session()
+    try:
+        client = BaseClient(url, token='benchmark', session=session)
+        return client.call_method(method, params)
+    finally:
+        session.close()
+
+
+def time_async_calls(url, num_calls, max_async_calls):
+    """
+    Starts num_calls calls (cycling through CALLS) at once, and returns the seconds taken for
+    all of them to finish, spread evenly over the calls.
+    """
+    client = BaseClient(url, token='benchmark', max_async_calls=max_async_calls)
+    try:
+        start = time.time()
+        results = [client.call_method_async(*CALLS[i % len(CALLS)]) for i in range(num_calls)]
+        for r in results:
+            r.get()
+        elapsed = time.time() - start
+    finally:
+        client.close()
+    return [elapsed / num_calls] * num_calls
+
+
+def time_batched_calls(url, num_calls, batch_size):
+    """
+    Makes num_calls calls (cycling through CALLS) in batches of batch_size, and returns the
+    seconds each batch took, spread evenly over its calls.
+    """
+    client = BaseClient(url, token='benchmark')
+    times = list()
+    for start_call in range(0, num_calls, batch_size):
+        calls = [CALLS[i % len(CALLS)]
+                 for i in range(start_call, min(start_call + batch_size, num_calls))]
+        start = time.time()
+        client.call_batch(calls)
+        times.extend([(time.time() - start) / len(calls)] * len(calls))
+    return times
+
+
+def time_calls(url, num_calls, pooled):
+    """
+    Makes num_calls calls (cycling through CALLS), and returns the seconds each one took.
+    """
+    client = BaseClient(url, token='benchmark')
+    times = list()
+    for i in range(num_calls):
+        method, params = CALLS[i % len(CALLS)]
+        start = time.time()
+        if pooled:
+            client.call_method(method, params)
+        else:
+            _new_connection_call(url, method, params)
+        times.append(time.time() - start)
+    return times
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Service client round trip benchmark')
+    parser.add_argument('--calls', type=int, default=500, help='calls to time for each mode')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='delay the stand-in server adds to every request')
+    parser.add_argument('--max-async-calls', type=int, default=10,
+                        help='the most calls at once in async mode')
+    parser.add_argument('--batch-size', type=int, default=20,
+                        help='calls per request in batched mode')
+    args = parser.parse_args(argv)
+
+    scratch_dir = tempfile.mkdtemp(prefix='client_benchmark_')
+    services = LocalServices(FIXTURES, scratch_dir, latency=args.latency_ms / 1000.0)
+    url = services.start()
+    try:
+        # warm up the server and the shared session
+        time_calls(url, 10, True)
+        results = dict()
+        for name, pooled in [('new connection', False), ('pooled', True)]:
+            results[name] = time_calls(url, args.calls, pooled)
+        results['async'] = time_async_calls(url, args.calls, args.max_async_calls)
+        results['batched'] = time_batched_calls(url, args.calls, args.batch_size)
+    finally:
+        # close the kept-alive connections first, so the server's threads finish
+        _get_session().close()
+        services.stop()
+        shutil.rmtree(scratch_dir)
+
+    print('{} calls each, {} ms added latency'.format(args.calls, args.latency_ms))
+    print('{:<16}{:>12}{:>12}{:>12}{:>10}'.format(
+        'mode', 'mean (ms)', 'p50 (ms)', 'p95 (ms)', 'speedup'))
+    for name in ['new connection', 'pooled', 'async', 'batched']:
+        times = results[name]
+        print('{:<16}{:>12.3f}{:>12.3f}{:>12.3f}{:>9.2f}x'.format(
+            name, 1000 * sum(times) / len(times), 1000 * _percentile(times, 0.5),
+            1000 * _percentile(times, 0.95), sum(results['new connection']) / sum(times)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
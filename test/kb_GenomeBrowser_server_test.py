@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 import unittest
 import os  # noqa: F401
+import hashlib
 import json  # noqa: F401
+import logging
 import shutil
+import subprocess
+import threading
 import time
 import requests
 
+from multiprocessing import Process
 from os import environ
 try:
     from ConfigParser import ConfigParser  # py2
@@ -16,8 +21,10 @@ from pprint import pprint  # noqa: F401
 
 from biokbase.workspace.client import Workspace as workspaceService
 from kb_GenomeBrowser.kb_GenomeBrowserImpl import kb_GenomeBrowser
-from kb_GenomeBrowser.kb_GenomeBrowserServer import MethodContext
-from kb_GenomeBrowser.authclient import KBaseAuth as _KBaseAuth
+from kb_GenomeBrowser.kb_GenomeBrowserServer import (MethodContext, JSONRPCServiceCustom,
+                                                     application)
+from kb_GenomeBrowser.authclient import KBaseAuth as _KBaseAuth, TokenCache
+from Workspace.baseclient import BaseClient, ServerError
 
 from AssemblyUtil.AssemblyUtilClient import AssemblyUtil
 from GenomeFileUtil.GenomeFileUtilClient import GenomeFileUtil
@@ -26,9 +33,30 @@ from kb_GenomeBrowser.util import (
     check_reference,
     check_reference_type,
     check_workspace_name,
+    get_workspace_client,
     package_directory
 )
+from kb_GenomeBrowser.refseq_writer import write_refseqs, refseq_dirpath
+from kb_GenomeBrowser.feature_track import write_feature_track
+from kb_GenomeBrowser.object_resolver import ObjectResolver
+from kb_GenomeBrowser.ws_cache import object_info_cache, is_versioned_ref
+from kb_GenomeBrowser.disk_cache import DiskCache
+from kb_GenomeBrowser.browse_genome import GenomeBrowserMaker
+from kb_GenomeBrowser.telemetry import BuildTelemetry
+from kb_GenomeBrowser.stages import StageScheduler
+from kb_GenomeBrowser.metrics import Metrics, stage_kind
+from kb_GenomeBrowser.file_staging import stage_file
+from kb_GenomeBrowser.jbrowse_shell import (
+    prepare_shell,
+    materialize_shell,
+    read_manifest,
+    mode_dir
+)
+from kb_GenomeBrowser.token_cache import SharedTokenCache
+from kb_GenomeBrowser.shared_viewer import ViewerRegistry, make_index_page, viewer_key
+from kb_GenomeBrowser.wsgi_server import make_threaded_server
 from file_util import FileUtil
+from local_services import LocalServices
 
 
 class GenomeBrowserTest(unittest.TestCase):
@@ -291,6 +319,631 @@ agcttttcatgg"""
         for ref in bad_refs:
             self.assertFalse(check_reference(ref))
 
+    def test_write_refseqs(self):
+        fasta_file = os.path.join(self.scratch, 'refseq_test.fasta')
+        with open(fasta_file, 'w') as f:
+            f.write(">seq1 some description\nACGTACGTAC\nGTACG\n>seq2\nAAAA\n")
+        out_dir = os.path.join(self.scratch, 'refseq_test_out')
+        refseqs = write_refseqs(fasta_file, out_dir, chunk_size=4)
+        self.assertEqual([r['name'] for r in refseqs], ['seq1', 'seq2'])
+        self.assertEqual(refseqs[0]['length'], 15)
+        self.assertEqual(refseqs[0]['seqChunkSize'], 4)
+        chunk_dir = os.path.join(out_dir, 'seq', refseq_dirpath('seq1'))
+        self.assertEqual(len(os.listdir(chunk_dir)), 4)
+        with open(os.path.join(chunk_dir, 'seq1-3.txt')) as f:
+            self.assertEqual(f.read(), 'ACG')
+        with open(os.path.join(out_dir, 'trackList.json')) as f:
+            self.assertEqual(json.load(f)['tracks'][0]['label'], 'DNA')
+
+    def test_write_feature_track(self):
+        out_dir = os.path.join(self.scratch, 'feature_track_test_out')
+        counts = write_feature_track(self.gff_file, out_dir, 'TestFeatures')
+        self.assertTrue(len(counts) > 0)
+        for seq_id in counts:
+            track_data_file = os.path.join(out_dir, 'tracks', 'TestFeatures', seq_id,
+                                           'trackData.json')
+            with open(track_data_file) as f:
+                track_data = json.load(f)
+            self.assertEqual(track_data['featureCount'], counts[seq_id])
+            for lazy_feature in track_data['intervals']['nclist']:
+                chunk_file = os.path.join(os.path.dirname(track_data_file),
+                                          'lf-{}.json'.format(lazy_feature[3]))
+                self.assertTrue(os.path.exists(chunk_file))
+        with open(os.path.join(out_dir, 'trackList.json')) as f:
+            self.assertEqual(json.load(f)['tracks'][0]['label'], 'TestFeatures')
+
+        # subfeatures are linked by ID in any order, to each of their parents
+        gff_file = os.path.join(self.scratch, 'feature_track_hierarchy.gff')
+        rows = [('exon', 10, 20, 'Parent=t1,t2'),
+                ('mRNA', 1, 50, 'ID=t1;Parent=g1'),
+                ('gene', 1, 100, 'ID=g1'),
+                ('mRNA', 5, 60, 'ID=t2;Parent=g1'),
+                ('thing', 1, 5, 'Parent=nowhere')]
+        with open(gff_file, 'w') as f:
+            f.write(''.join('chrA\t.\t{}\t{}\t{}\t.\t+\t.\t{}\n'.format(*row) for row in rows))
+        self.assertEqual(write_feature_track(gff_file, out_dir, 'Hierarchy'), {'chrA': 2})
+        track_dir = os.path.join(out_dir, 'tracks', 'Hierarchy', 'chrA')
+        with open(os.path.join(track_dir, 'trackData.json')) as f:
+            classes = json.load(f)['intervals']['classes']
+
+        def to_dict(feature):
+            values = dict(zip(classes[feature[0]]['attributes'], feature[1:]))
+            values['Subfeatures'] = [to_dict(s) for s in values.get('Subfeatures', [])]
+            return values
+        with open(os.path.join(track_dir, 'lf-1.json')) as f:
+            gene = to_dict(json.load(f)[0])
+        self.assertEqual(gene['Id'], 'g1')
+        self.assertEqual([(t['Id'], [e['Type'] for e in t['Subfeatures']])
+                          for t in gene['Subfeatures']], [('t1', ['exon']), ('t2', ['exon'])])
+
+    def test_resolve_objects(self):
+        resolver = ObjectResolver(self.wsURL)
+        resolved = resolver.resolve(genome_ref=self.genome_ref,
+                                    alignment_refs=[self.alignment_ref])
+        self.assertEqual(resolved['genome']['ref'], self.genome_ref)
+        self.assertEqual(resolved['genome']['name'], 'my_test_genome')
+        self.assertTrue(resolved['assembly']['ref'].startswith(self.genome_ref + ';'))
+        self.assertEqual(resolved['alignments'][0]['name'], 'my_hisat2_alignment')
+
+    def test_resolve_objects_reports_all_errors(self):
+        resolver = ObjectResolver(self.wsURL)
+        # a real workspace, but no such object in it
+        missing_ref = '{}/12345'.format(self.genome_ref.split('/')[0])
+        bad_refs = ['not_a_ref', missing_ref, self.genome_ref]
+        with self.assertRaises(ValueError) as error:
+            resolver.resolve(genome_ref=self.alignment_ref, alignment_refs=bad_refs)
+        message = str(error.exception)
+        self.assertIn('not_a_ref', message)
+        self.assertIn('Object {} does not exist or is not accessible'.format(missing_ref),
+                      message)
+        self.assertIn('genome_ref must reference a KBaseGenomes.Genome', message)
+        self.assertIn('alignment_refs must reference', message)
+
+    def test_object_info_cache(self):
+        resolver = ObjectResolver(self.wsURL)
+        resolver.resolve(genome_ref=self.genome_ref)
+        hits = object_info_cache.stats()['object_infos']['hits']
+        resolved = resolver.resolve(genome_ref=self.genome_ref)
+        self.assertEqual(resolved['genome']['name'], 'my_test_genome')
+        self.assertTrue(object_info_cache.stats()['object_infos']['hits'] > hits)
+        self.assertTrue(is_versioned_ref('1/2/3;4/5/6'))
+        self.assertFalse(is_versioned_ref('1/2/3;4/5'))
+
+    def test_disk_cache(self):
+        cache_dir = os.path.join(self.scratch, 'artifact_cache_test')
+        src_dir = os.path.join(self.scratch, 'artifact_cache_src')
+        for d in (cache_dir, src_dir):
+            if os.path.exists(d):
+                shutil.rmtree(d)
+        os.makedirs(os.path.join(src_dir, 'seq'))
+        with open(os.path.join(src_dir, 'seq', 'chr1-0.txt'), 'w') as f:
+            f.write('A' * 100)
+        cache = DiskCache(cache_dir, 150)
+        self.assertIsNone(cache.get('refseq/1/2/3', os.path.join(self.scratch, 'nope')))
+        cache.put('refseq/1/2/3', src_dir, info=[{'label': 'DNA'}])
+        dest_dir = os.path.join(self.scratch, 'artifact_cache_dest')
+        self.assertEqual(cache.get('refseq/1/2/3', dest_dir), [{'label': 'DNA'}])
+        self.assertTrue(os.path.exists(os.path.join(dest_dir, 'seq', 'chr1-0.txt')))
+        # a second entry puts the cache over its limit, so the older one goes
+        cache.put('refseq/1/3/1', src_dir)
+        self.assertIsNone(cache.get('refseq/1/2/3', dest_dir))
+        self.assertEqual(cache.get('refseq/1/3/1', dest_dir), dict())
+        # a genome with no features has an empty list of tracks
+        cache.put('features/1/3/1', src_dir, info=[])
+        self.assertEqual(cache.get('features/1/3/1', dest_dir), [])
+
+    def test_disk_cache_verify(self):
+        cache_dir = os.path.join(self.scratch, 'download_cache_test')
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        src_file = os.path.join(self.scratch, 'download_cache_src.fa')
+        with open(src_file, 'w') as f:
+            f.write('>chr1\nACGT\n')
+        cache = DiskCache(cache_dir, 1024)
+        cache.put('assembly/1/2/3', src_file)
+        dest_dir = os.path.join(self.scratch, 'download_cache_dest')
+        self.assertEqual(cache.get('assembly/1/2/3', dest_dir, verify=True), dict())
+        # damage the cached copy (it's a hard link, so write a new file over it)
+        cached_file = os.path.join(dest_dir, 'download_cache_src.fa')
+        os.remove(cached_file)
+        entry_dir = [d for d in os.listdir(cache_dir) if not d.startswith('.')][0]
+        cached_file = os.path.join(cache_dir, entry_dir, 'data', 'download_cache_src.fa')
+        os.remove(cached_file)
+        with open(cached_file, 'w') as f:
+            f.write('>chr1\nAAAA\n')
+        self.assertIsNone(cache.get('assembly/1/2/3', dest_dir, verify=True))
+        self.assertIsNone(cache.get('assembly/1/2/3', dest_dir))
+        # a file changed in place, with the same size, is caught by its modification time
+        cache.put('assembly/1/2/4', src_file)
+        entry_dir = os.path.join(cache_dir, hashlib.sha256('assembly/1/2/4').hexdigest())
+        cached_file = os.path.join(entry_dir, 'data', 'download_cache_src.fa')
+        os.utime(cached_file, (0, 0))
+        self.assertIsNone(cache.get('assembly/1/2/4', dest_dir, verify=True))
+
+    def test_stage_file(self):
+        src_file = os.path.join(self.scratch, 'stage_file_src.bam')
+        shutil.copy2(self.bam_file, src_file)
+        dest_file = os.path.join(self.scratch, 'stage_file_dest.bam')
+        staging = stage_file(src_file, dest_file)
+        size = os.path.getsize(self.bam_file)
+        # both are in scratch, so no copy should be needed
+        self.assertIn(staging['method'], ['hardlink', 'reflink'])
+        self.assertEqual(staging['size'], size)
+        self.assertEqual(staging['bytes_avoided'], size)
+        self.assertEqual(os.path.getsize(dest_file), size)
+        self.assertTrue(os.path.exists(src_file))
+
+    def test_jbrowse_shell(self):
+        shell_dir = os.path.join(self.scratch, 'jbrowse_shell_test')
+        out_dir = os.path.join(self.scratch, 'jbrowse_shell_out')
+        for d in (shell_dir, out_dir):
+            if os.path.exists(d):
+                shutil.rmtree(d)
+        manifest = prepare_shell(shell_dir=shell_dir)
+        self.assertIn('index.html', manifest['files'])
+        self.assertNotIn(os.path.join('src', 'util'), manifest['dirs'])
+        self.assertEqual(prepare_shell(shell_dir=shell_dir), manifest)
+        self.assertEqual(materialize_shell(shell_dir, out_dir), 'hardlink')
+        for f in manifest['files']:
+            self.assertTrue(os.path.isfile(os.path.join(out_dir, f)))
+        self.assertFalse(os.path.exists(os.path.join(out_dir, 'src', 'util')))
+
+    def test_jbrowse_shell_trimmed(self):
+        shell_dir = os.path.join(self.scratch, 'jbrowse_shell_trimmed_test')
+        if os.path.exists(shell_dir):
+            shutil.rmtree(shell_dir)
+        full = prepare_shell(shell_dir=shell_dir)
+        trimmed = prepare_shell(shell_dir=shell_dir, trim=True)
+        self.assertTrue(trimmed['trimmed'])
+        self.assertIn('index.html', trimmed['files'])
+        self.assertNotIn('compat_121.html', trimmed['files'])
+        self.assertTrue(trimmed['size'] < full['size'])
+        report = trimmed['size_report']
+        self.assertEqual(report['kept_bytes'], trimmed['size'])
+        self.assertTrue(report['trimmed_bytes'] > 0)
+        # each mode is kept, and a shell from another JBrowse isn't used
+        self.assertEqual(read_manifest(shell_dir), full)
+        self.assertEqual(prepare_shell(shell_dir=shell_dir), full)
+        self.assertEqual(full['source'], os.path.abspath('/kb/module/jbrowse'))
+        self.assertIsNone(read_manifest(shell_dir, jbrowse_dir=self.scratch))
+
+    def test_shared_viewer(self):
+        shell_dir = os.path.join(self.scratch, 'jbrowse_shell_viewer_test')
+        if os.path.exists(shell_dir):
+            shutil.rmtree(shell_dir)
+        manifest = prepare_shell(shell_dir=shell_dir)
+        index_file = os.path.join(self.scratch, 'shared_viewer_index.html')
+        make_index_page(os.path.join(mode_dir(shell_dir), 'files', 'index.html'), index_file)
+        with open(index_file) as f:
+            page = f.read()
+        self.assertIn('<base href="../1/">', page)
+        self.assertIn("'../0/data'", page)
+
+        registry = ViewerRegistry(os.path.join(self.scratch, 'viewer_registry', 'viewers.json'))
+        key = viewer_key(manifest, 'some_user')
+        self.assertIsNone(registry.get(key))
+        link = {'shock_id': 'abc', 'name': 'index.html', 'description': 'JBrowse viewer'}
+        registry.put(key, link)
+        self.assertEqual(registry.get(key), link)
+        self.assertIsNone(registry.get(viewer_key(manifest, 'other_user')))
+        # a new JBrowse version or source gets its own viewer
+        upgraded = dict(manifest, jbrowse_version='1.16.0')
+        self.assertIsNone(registry.get(viewer_key(upgraded, 'some_user')))
+        moved = dict(manifest, source=os.path.join(self.scratch, 'jbrowse_release'))
+        self.assertIsNone(registry.get(viewer_key(moved, 'some_user')))
+
+    def test_isolated_build_dirs(self):
+        with GenomeBrowserMaker(self.callback_url, self.wsURL, self.scratch) as browser1:
+            with GenomeBrowserMaker(self.callback_url, self.wsURL, self.scratch) as browser2:
+                self.assertNotEqual(browser1.out_dir, browser2.out_dir)
+                self.assertTrue(browser1.out_dir.startswith(browser1.work_dir))
+                self.assertTrue(os.path.isdir(browser2.work_dir))
+            self.assertFalse(os.path.exists(browser2.work_dir))
+            self.assertTrue(os.path.isdir(browser1.work_dir))
+        self.assertFalse(os.path.exists(browser1.work_dir))
+
+    def test_build_telemetry(self):
+        telemetry = BuildTelemetry()
+        out_file = os.path.join(self.scratch, 'telemetry_test.txt')
+        with telemetry.stage('write', kind='test'):
+            with open(out_file, 'w') as f:
+                f.write('A' * 1024 * 1024)
+                os.fsync(f.fileno())
+        telemetry.add('fetch', {'wall_seconds': 1.0, 'bytes_written': 10})
+        json_file = os.path.join(self.scratch, 'telemetry_test.json')
+        telemetry.write(json_file)
+        with open(json_file) as f:
+            stages = json.load(f)['stages']
+        self.assertEqual([s['stage'] for s in stages], ['write', 'fetch'])
+        self.assertEqual(stages[0]['kind'], 'test')
+        for key in ['wall_seconds', 'cpu_seconds', 'peak_rss_bytes', 'bytes_written']:
+            self.assertIn(key, stages[0])
+        self.assertTrue(stages[0]['peak_rss_bytes'] > 0)
+        self.assertIn('fetch', telemetry.summary())
+
+    def test_stage_scheduler(self):
+        scheduler = StageScheduler(2)
+        scheduler.add_stage('sleep', time.sleep, (0.1,))
+        scheduler.add_stage('abs', abs, (-2,), depends_on=['sleep'])
+        self.assertEqual(scheduler.run(), {'sleep': None, 'abs': 2})
+        # a worker that dies, or a result that can't be sent back, fails the build
+        for func, args, message in [(os._exit, (3,), 'exited with code 3'),
+                                    (threading.Lock, (), 'Unable to send back')]:
+            scheduler = StageScheduler(2)
+            scheduler.add_stage('sleep', time.sleep, (0.2,))
+            scheduler.add_stage('fail', func, args)
+            with self.assertRaisesRegexp(RuntimeError, message):
+                scheduler.run()
+        # when a stage fails, the other workers are stopped along with what they started
+        pid_file = os.path.join(self.scratch, 'stage_child.pid')
+        scheduler = StageScheduler(2)
+        scheduler.add_stage('child', subprocess.call,
+                            (['sh', '-c', 'echo $$ > {}; exec sleep 60'.format(pid_file)],))
+        scheduler.add_stage('fail', subprocess.check_call, (['sh', '-c', 'sleep 1; exit 1'],))
+        with self.assertRaisesRegexp(RuntimeError, 'Build stage fail failed'):
+            scheduler.run()
+        with open(pid_file) as f:
+            stat_file = '/proc/{}/stat'.format(f.read().strip())
+        deadline = time.time() + 5
+        # the child may be left a zombie, if nothing reaps orphans
+        while os.path.exists(stat_file) and ' Z ' not in open(stat_file).read():
+            self.assertLess(time.time(), deadline, 'The stage\'s child is still running')
+            time.sleep(0.1)
+        # workers don't inherit locks held by other threads
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold_logging_lock():
+            logging._acquireLock()
+            held.set()
+            release.wait()
+            logging._releaseLock()
+        holder = threading.Thread(target=hold_logging_lock)
+        holder.start()
+        held.wait()
+        try:
+            scheduler = StageScheduler(2)
+            scheduler.add_stage('level', logging.addLevelName, (60, 'TEST_LEVEL'))
+            scheduler.add_stage('abs', abs, (-2,))
+            self.assertEqual(scheduler.run(), {'level': None, 'abs': 2})
+        finally:
+            release.set()
+            holder.join()
+
+    def test_client_reuse(self):
+        self.assertIs(get_workspace_client(self.wsURL), get_workspace_client(self.wsURL))
+        with GenomeBrowserMaker(self.callback_url, self.wsURL, self.scratch) as browser:
+            self.assertIs(browser.ws, get_workspace_client(self.wsURL))
+            au = browser.client(AssemblyUtil)
+            self.assertIs(browser.client(AssemblyUtil), au)
+            self.assertIsNot(browser.client(GenomeFileUtil), au)
+
+    def test_async_calls(self):
+        client = get_workspace_client(self.wsURL)._client
+        results = [client.call_method_async('Workspace.get_workspace_info',
+                                            [{'workspace': self.wsName}]) for _ in range(5)]
+        bad_result = client.call_method_async('Workspace.get_workspace_info',
+                                              [{'workspace': 'not_a_real_ws_' + self.wsName}])
+        infos = [r.get() for r in results]
+        self.assertEqual(infos[0][1], self.wsName)
+        self.assertTrue(all(info == infos[0] for info in infos))
+        with self.assertRaises(ServerError):
+            bad_result.get()
+
+    def test_job_tracker(self):
+        scratch_dir = os.path.join(self.scratch, 'job_tracker_test')
+        if not os.path.exists(scratch_dir):
+            os.makedirs(scratch_dir)
+        fasta_file = os.path.join(scratch_dir, 'assembly.fa')
+        with open(fasta_file, 'w') as f:
+            f.write('>chr1\nACGT\n')
+        services = LocalServices({'workspaces': {'tracker_ws': 7}, 'objects': {
+            '7/1/1': {'name': 'assembly', 'type': 'KBaseGenomeAnnotations.Assembly-5.0',
+                      'fasta': fasta_file}}}, scratch_dir)
+        url = services.start()
+        client = BaseClient(url, token='test', async_job_check_time_ms=10,
+                            async_job_check_max_time_ms=50, max_job_checks=2)
+        try:
+            tracker = client.job_tracker()
+            jobs = [tracker.submit('Workspace.get_workspace_info', [{'workspace': 'tracker_ws'}])
+                    for _ in range(6)]
+            bad_job = tracker.submit('Workspace.get_workspace_info', [{'workspace': 'nope'}])
+            finished = list(tracker.as_completed(jobs, timeout=60))
+            self.assertEqual(sorted(j.job_id for j in finished),
+                             sorted(j.job_id for j in jobs))
+            self.assertEqual([j.get()[0] for j in jobs], [7] * 6)
+            with self.assertRaises(ServerError):
+                bad_job.get(timeout=60)
+            self.assertEqual(tracker.checks, services.call_counts['Workspace._check_job'])
+            # a malformed job state fails just that job, and polling goes on
+            services._jobs['no_finished'] = {'result': [1]}
+            services._jobs['not_a_dict'] = 'not a dict'
+            with self.assertRaises(KeyError):
+                tracker.track('Workspace.get_workspace_info', 'no_finished').get(timeout=60)
+            with self.assertRaises(TypeError):
+                tracker.track('Workspace.get_workspace_info', 'not_a_dict').get(timeout=60)
+            # run_job goes through the same tracker
+            self.assertEqual(client.run_job('Workspace.get_workspace_info',
+                                            [{'workspace': 'tracker_ws'}])[0], 7)
+            self.assertIs(client.job_tracker(), tracker)
+
+            # so do the generated clients' methods
+            au = AssemblyUtil(url, token='test', async_job_check_time_ms=10,
+                              async_job_check_max_time_ms=50)
+            au_tracker = au._client.job_tracker()
+            names = list()
+            threads = [threading.Thread(target=lambda: names.append(
+                au.get_assembly_as_fasta({'ref': '7/1/1'})['assembly_name'])) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            au._client.close()
+            self.assertEqual(names, ['assembly'] * 4)
+            self.assertEqual(au_tracker.checks, services.call_counts['AssemblyUtil._check_job'])
+        finally:
+            client.close()
+            services.stop()
+
+    def test_fetch_order(self):
+        scratch_dir = os.path.join(self.scratch, 'fetch_order_test')
+        if os.path.exists(scratch_dir):
+            shutil.rmtree(scratch_dir)
+        os.makedirs(scratch_dir)
+        files = dict()
+        for name, size in [('genome.gff', 10), ('assembly.fa', 1000), ('reads.bam', 500)]:
+            files[name] = os.path.join(scratch_dir, name)
+            with open(files[name], 'w') as f:
+                f.write('A' * size)
+        services = LocalServices({'workspaces': {'fetch_ws': 1}, 'objects': {
+            '1/1/1': {'name': 'genome', 'type': 'KBaseGenomes.Genome-8.2', 'refs': ['1/2/1'],
+                      'gff': files['genome.gff']},
+            '1/2/1': {'name': 'assembly', 'type': 'KBaseGenomeAnnotations.Assembly-5.0',
+                      'fasta': files['assembly.fa']},
+            '1/3/1': {'name': 'reads', 'type': 'KBaseRNASeq.RNASeqAlignment-4.0',
+                      'bam': files['reads.bam']}}}, scratch_dir)
+        url = services.start()
+        try:
+            with GenomeBrowserMaker(url, url, scratch_dir) as browser:
+                timings = browser.get_browser_data_files(
+                    genome_ref='1/1/1', alignment_refs=['1/3/1'])['fetch_timings']
+                stages = browser.telemetry.to_dict()['stages']
+        finally:
+            services.stop()
+        # the alignments are fetched first, and the file sizes are what was downloaded
+        self.assertEqual([(t['type'], t['size']) for t in timings],
+                         [('alignment', 500), ('assembly', 1000), ('gff', 10)])
+        self.assertEqual([(s['stage'].split(' ')[1], s['bytes_written']) for s in stages
+                          if s['stage'].startswith('fetch ')],
+                         [('alignment', 500), ('assembly', 1000), ('gff', 10)])
+
+    def test_fetch_failure(self):
+        scratch_dir = os.path.join(self.scratch, 'fetch_failure_test')
+        if os.path.exists(scratch_dir):
+            shutil.rmtree(scratch_dir)
+        os.makedirs(scratch_dir)
+        fixture_dir = os.path.join(scratch_dir, 'fixtures')
+        os.makedirs(fixture_dir)
+        files = dict()
+        for name, size in [('genome.gff', 10), ('assembly.fa', 1000)]:
+            files[name] = os.path.join(fixture_dir, name)
+            with open(files[name], 'w') as f:
+                f.write('A' * size)
+        # the alignment has no file, so its fetch fails while the assembly's is still running
+        services = LocalServices({'workspaces': {'fetch_ws': 1}, 'objects': {
+            '1/1/1': {'name': 'genome', 'type': 'KBaseGenomes.Genome-8.2', 'refs': ['1/2/1'],
+                      'gff': files['genome.gff']},
+            '1/2/1': {'name': 'assembly', 'type': 'KBaseGenomeAnnotations.Assembly-5.0',
+                      'fasta': files['assembly.fa']},
+            '1/3/1': {'name': 'reads', 'type': 'KBaseRNASeq.RNASeqAlignment-4.0'}}},
+            scratch_dir, bandwidth=1000)
+        cache_dir = os.path.join(scratch_dir, 'download_cache')
+        url = services.start()
+        try:
+            with GenomeBrowserMaker(url, url, scratch_dir, {'fetch-workers': 3,
+                                                            'download-cache-dir': cache_dir}
+                                    ) as browser:
+                with self.assertRaisesRegexp(Exception, 'Object 1/3/1 has no bam file'):
+                    browser.get_browser_data_files(genome_ref='1/1/1', alignment_refs=['1/3/1'])
+        finally:
+            services.stop()
+        # the assembly download was finished and removed, and not cached
+        left = [name for root, _, names in os.walk(scratch_dir) for name in names
+                if name.endswith('assembly.fa') and root != fixture_dir]
+        self.assertEqual(left, [])
+
+    def test_call_batch(self):
+        scratch_dir = os.path.join(self.scratch, 'call_batch_test')
+        calls = [('Workspace.get_workspace_info', [{'workspace': 'batch_ws'}])] * 4
+        calls.append(('Workspace.get_workspace_info', [{'workspace': 'nope'}]))
+        for batch in [True, False]:
+            services = LocalServices({'workspaces': {'batch_ws': 3}}, scratch_dir, batch=batch)
+            url = services.start()
+            client = BaseClient(url, token='test')
+            try:
+                results = client.call_batch(calls, max_batch_size=3)
+                self.assertEqual([r.get()[0] for r in results[:4]], [3] * 4)
+                with self.assertRaises(ServerError):
+                    results[4].get()
+                # 2 batches, or 1 rejected batch and then each call
+                self.assertEqual(services.http_requests, 2 if batch else 6)
+            finally:
+                services.stop()
+        # a batch that fails some other way is made one call at a time, and batches are
+        # tried again next time
+        auth_error = {'version': '1.1', 'error': {
+            'name': 'JSONRPCError', 'code': -32400, 'message': 'Token validation failed'}}
+        for batch in [(500, auth_error), (415, 'Unsupported Media Type')]:
+            services = LocalServices({'workspaces': {'batch_ws': 3}}, scratch_dir, batch=batch)
+            url = services.start()
+            client = BaseClient(url, token='test')
+            try:
+                for _ in range(2):
+                    results = client.call_batch(calls[:2])
+                    self.assertEqual([r.get()[0] for r in results], [3, 3])
+                self.assertEqual(services.http_requests, 6)
+            finally:
+                services.stop()
+
+    def test_threaded_server(self):
+        fast_threads = set()
+
+        def app(environ, start_response):
+            if environ['PATH_INFO'] == '/slow':
+                time.sleep(2)
+            else:
+                # each connection is handled on its own thread
+                fast_threads.add(threading.current_thread().ident)
+            start_response('200 OK', [('Content-Length', '2')])
+            return ['ok']
+        server = make_threaded_server('localhost', 0, app, 2)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://localhost:{}'.format(server.server_address[1])
+        try:
+            slow = threading.Thread(target=requests.get, args=(url + '/slow',))
+            slow.start()
+            time.sleep(0.2)
+            session = requests.Session()
+            start = time.time()
+            for _ in range(10):
+                self.assertEqual(session.get(url + '/fast').text, 'ok')
+            # not held up by the slow request, and all over one kept-alive connection
+            self.assertTrue(time.time() - start < 1)
+            self.assertEqual(len(fast_threads), 1)
+            slow.join()
+            session.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_parallel_batch(self):
+        def nap(ctx, seconds):
+            time.sleep(seconds)
+            return [ctx['call_id']]
+
+        def fail(ctx):
+            raise ValueError('failed on purpose')
+        service = JSONRPCServiceCustom(batch_workers=4)
+        service.add(nap, name='kb_GenomeBrowser.nap', types=[float])
+        service.add(fail, name='kb_GenomeBrowser.fail')
+        batch = [{'method': 'kb_GenomeBrowser.nap', 'params': [0.5], 'version': '1.1',
+                  'id': str(i)} for i in range(4)]
+        batch.append({'method': 'kb_GenomeBrowser.fail', 'params': [], 'version': '1.1',
+                      'id': 'fail'})
+        start = time.time()
+        responses = service.call_py(MethodContext(None), batch)
+        self.assertTrue(time.time() - start < 1.5)
+        self.assertEqual([r['id'] for r in responses], ['0', '1', '2', '3', 'fail'])
+        self.assertEqual([r['result'] for r in responses[:4]], [['0'], ['1'], ['2'], ['3']])
+        self.assertNotIn('result', responses[4])
+        self.assertIn('failed on purpose', responses[4]['error']['message'])
+
+    def test_token_cache(self):
+        cache = TokenCache(maxsize=2, invalid_ttl=0.2)
+        cache.add_valid_token('token1', 'user1')
+        cache.add_valid_token('token2', 'user2')
+        self.assertEqual(cache.get_user('token1'), 'user1')
+        # token2 is now the least recently used
+        cache.add_valid_token('token3', 'user3')
+        self.assertIsNone(cache.get_user('token2'))
+        cache.add_invalid_token('bad', 'Invalid token')
+        self.assertEqual(cache.get('bad'), (None, 'Invalid token'))
+        time.sleep(0.3)
+        self.assertIsNone(cache.get('bad'))
+        self.assertEqual(cache.stats(), {'size': 1, 'hits': 2, 'misses': 2, 'evictions': 2})
+
+        # concurrent lookups of one token make one call to the auth service
+        auth = _KBaseAuth('http://localhost:1/auth', cache=TokenCache())
+        fetches = list()
+
+        def fetch_user(token):
+            fetches.append(token)
+            time.sleep(0.3)
+            auth._cache.add_valid_token(token, 'user1')
+            return 'user1'
+        auth._fetch_user = fetch_user
+        users = list()
+        threads = [threading.Thread(target=lambda: users.append(auth.get_user('token1')))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(users, ['user1'] * 5)
+        self.assertEqual(fetches, ['token1'])
+        self.assertEqual(auth.get_user('token1'), 'user1')
+        self.assertEqual(auth.cache_stats()['shared_lookups'], 4)
+
+    def test_shared_token_cache(self):
+        cache_file = os.path.join(self.scratch, 'token_cache', 'tokens.db')
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        worker1 = SharedTokenCache(cache_file, maxsize=2, invalid_ttl=0.2)
+        worker2 = SharedTokenCache(cache_file, maxsize=2, invalid_ttl=0.2)
+        worker1.add_valid_token('token1', 'user1')
+        self.assertEqual(worker2.get_user('token1'), 'user1')
+        worker2.add_invalid_token('bad', 'Invalid token')
+        self.assertEqual(worker1.get('bad'), (None, 'Invalid token'))
+        time.sleep(0.3)
+        self.assertIsNone(worker1.get('bad'))
+
+        # a token added by another process
+        child = Process(target=worker1.add_valid_token, args=('token2', 'user2'))
+        child.start()
+        child.join()
+        self.assertEqual(worker2.get_user('token2'), 'user2')
+        worker2.add_valid_token('token3', 'user3')
+        self.assertIsNone(worker1.get_user('token1'))
+        self.assertEqual(worker1.stats(), {'size': 2, 'hits': 1, 'misses': 2,
+                                           'evictions': 0, 'errors': 0})
+        self.assertEqual(worker2.stats()['evictions'], 1)
+
+    def test_metrics(self):
+        def fail(ctx):
+            raise ValueError('failed on purpose')
+        metrics = Metrics()
+        service = JSONRPCServiceCustom(metrics=metrics)
+        service.add(lambda ctx: [ctx['call_id']], name='kb_GenomeBrowser.echo')
+        service.add(fail, name='kb_GenomeBrowser.fail')
+        service.call_py(MethodContext(None), [
+            {'method': 'kb_GenomeBrowser.echo', 'params': [], 'version': '1.1', 'id': '1'},
+            {'method': 'kb_GenomeBrowser.echo', 'params': [], 'version': '1.1', 'id': '2'},
+            {'method': 'kb_GenomeBrowser.fail', 'params': [], 'version': '1.1', 'id': '3'}])
+        telemetry = BuildTelemetry()
+        telemetry.add('alignment_0', {'wall_seconds': 0.2})
+        telemetry.add('alignment_1', {'wall_seconds': 3})
+        telemetry.add('refseq', {'cached': True})
+        metrics.observe_build(telemetry)
+        self.assertEqual(stage_kind('fetch alignment reads_1.bam'), 'fetch alignment')
+
+        text = metrics.render({'hits': 5, 'misses': 1, 'evictions': 0, 'size': 1})
+        lines = set(text.splitlines())
+        for line in ['kb_genomebrowser_requests_total{method="kb_GenomeBrowser.echo"} 2',
+                     'kb_genomebrowser_request_errors_total{method="kb_GenomeBrowser.echo"} 0',
+                     'kb_genomebrowser_request_errors_total{method="kb_GenomeBrowser.fail"} 1',
+                     'kb_genomebrowser_requests_in_flight{method="kb_GenomeBrowser.fail"} 0',
+                     'kb_genomebrowser_request_duration_seconds_count'
+                     '{method="kb_GenomeBrowser.echo"} 2',
+                     'kb_genomebrowser_build_stage_duration_seconds_bucket'
+                     '{stage="alignment",le="0.25"} 1',
+                     'kb_genomebrowser_build_stage_duration_seconds_bucket'
+                     '{stage="alignment",le="+Inf"} 2',
+                     'kb_genomebrowser_auth_cache_hits_total 5',
+                     'kb_genomebrowser_auth_cache_size 1']:
+            self.assertIn(line, lines)
+        self.assertNotIn('stage="refseq"', text)
+
+        # the server's own metrics are served on their own path
+        responses = list()
+        body = application({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/metrics'},
+                           lambda status, headers: responses.append((status, dict(headers))))
+        self.assertEqual(responses[0][0], '200 OK')
+        self.assertTrue(responses[0][1]['content-type'].startswith('text/plain'))
+        self.assertIn('# TYPE kb_genomebrowser_requests_total counter', body[0])
+        self.assertIn('kb_genomebrowser_auth_cache_hits_total', body[0])
+
     def test_check_ref_type(self):
         pass
 
@@ -0,0 +1,369 @@
+"""
+A local stand-in for the KBase services the Genome Browser talks to, so the whole pipeline
+can be run and profiled without a KBase deployment.
+
+One JSON-RPC 1.1 server plays both the SDK callback server and the Workspace:
+    Workspace - get_object_info3, get_objects2, get_workspace_info
+    AssemblyUtil - get_assembly_as_fasta
+    GenomeFileUtil - genome_to_gff
+    ReadsAlignmentUtils - download_alignment
+    DataFileUtil - file_to_shock
+    KBaseReport - create_extended_report
+SDK methods work both as direct calls and as submitted jobs (how the generated clients call
+them through the callback server). JSON-RPC batch requests are answered too, unless turned
+off. Downloads are copies of fixture files into the scratch
+directory, and uploads are stored in a local "shock" directory.
+
+Every request waits the given latency, and every file moved in or out is slowed down to the
+given bandwidth, to stand in for a real network.
+
+Objects come from a fixtures file, like this:
+    {
+        "workspaces": {"my_ws": 1},
+        "objects": {
+            "1/1/1": {"name": "genome", "type": "KBaseGenomes.Genome-8.2",
+                      "refs": ["1/2/1"], "gff": "/path/to/genome.gff"},
+            "1/2/1": {"name": "assembly", "type": "KBaseGenomeAnnotations.Assembly-5.0",
+                      "fasta": "/path/to/assembly.fa"},
+            "1/3/1": {"name": "alignment", "type": "KBaseRNASeq.RNASeqAlignment-4.0",
+                      "bam": "/path/to/reads.bam"}
+        }
+    }
+or made from synthetic data with --synthetic. To run it:
+    python local_services.py --synthetic tiny --scratch /kb/module/work/tmp --port 5000 \\
+        --latency-ms 20 --bandwidth-mbps 200
+then point SDK_CALLBACK_URL and the workspace-url setting at http://localhost:5000.
+"""
+import BaseHTTPServer
+import SocketServer
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import traceback
+import uuid
+from synthetic_data import make_inputs, SCALES
+
+
+class ServiceError(Exception):
+    pass
+
+
+def synthetic_fixtures(data_dir, scale):
+    """
+    Makes synthetic inputs at the given scale, and returns fixtures for them: a genome 1/1/1,
+    its assembly 1/2/1, and an alignment for each depth from 1/3/1 on, in workspace my_ws.
+    """
+    genome_size, num_genes, depths = SCALES[scale]
+    inputs = make_inputs(data_dir, genome_size, num_genes, depths=depths)
+    objects = {
+        '1/1/1': {'name': 'synthetic_genome', 'type': 'KBaseGenomes.Genome-8.2',
+                  'refs': ['1/2/1'], 'gff': inputs['gff']},
+        '1/2/1': {'name': 'synthetic_assembly', 'type': 'KBaseGenomeAnnotations.Assembly-5.0',
+                  'fasta': inputs['fasta']}
+    }
+    for idx, name in enumerate(sorted(inputs['alignments'])):
+        objects['1/{}/1'.format(idx + 3)] = {
+            'name': 'synthetic_{}'.format(name), 'type': 'KBaseRNASeq.RNASeqAlignment-4.0',
+            'bam': inputs['alignments'][name]
+        }
+    return {'workspaces': {'my_ws': 1}, 'objects': objects}
+
+
+class LocalServices(object):
+    def __init__(self, fixtures, scratch_dir, latency=0.0, bandwidth=None, batch=True):
+        """
+        fixtures = dict of workspaces and objects, as described above
+        scratch_dir = where downloaded files go (the module's scratch directory)
+        latency = seconds to wait before answering each request
+        bandwidth = bytes per second for moving files, or None for no limit
+        batch = if False, JSON-RPC batch requests get an error, like from a server that
+            doesn't take them. Or an (HTTP status, response) pair to answer every batch
+            request with.
+        """
+        self.workspaces = fixtures.get('workspaces', dict())
+        self.ws_names = dict((v, k) for k, v in self.workspaces.items())
+        self.objects = fixtures.get('objects', dict())
+        self.scratch_dir = scratch_dir
+        self.shock_dir = os.path.join(scratch_dir, 'local_shock')
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.batch = batch
+        self.reports = dict()
+        self.call_counts = dict()
+        self.http_requests = 0
+        self._jobs = dict()
+        self._lock = threading.Lock()
+        self._server = None
+        self.methods = {
+            'Workspace.get_object_info3': self.get_object_info3,
+            'Workspace.get_objects2': self.get_objects2,
+            'Workspace.get_workspace_info': self.get_workspace_info,
+            'AssemblyUtil.get_assembly_as_fasta': self.get_assembly_as_fasta,
+            'GenomeFileUtil.genome_to_gff': self.genome_to_gff,
+            'ReadsAlignmentUtils.download_alignment': self.download_alignment,
+            'DataFileUtil.file_to_shock': self.file_to_shock,
+            'KBaseReport.create_extended_report': self.create_extended_report
+        }
+
+    # --- workspace ---
+    def _find_object(self, ref):
+        """
+        Returns the UPA and fixture for the last step of ref (ws/obj or ws/obj/ver, where ws
+        and obj are ids or names).
+        """
+        parts = ref.split(';')[-1].split('/')
+        if len(parts) not in (2, 3):
+            raise ServiceError('Invalid object reference {}'.format(ref))
+        ws_id = self.workspaces.get(parts[0], parts[0])
+        for upa in sorted(self.objects, key=lambda u: -int(u.split('/')[2])):
+            wsid, objid, ver = upa.split('/')
+            obj = self.objects[upa]
+            if (str(ws_id) == wsid and parts[1] in (objid, obj['name']) and
+                    (len(parts) == 2 or parts[2] == ver)):
+                return upa, obj
+        raise ServiceError('Object {} cannot be accessed: No object with that reference '
+                           'exists'.format(ref))
+
+    def _object_info(self, upa, obj):
+        wsid, objid, ver = [int(x) for x in upa.split('/')]
+        # like the real objects, these are small records that point at their files
+        size = len(json.dumps(obj))
+        return [objid, obj['name'], obj['type'], '2018-01-01T00:00:00+0000', ver, 'someuser',
+                wsid, self.ws_names.get(wsid, str(wsid)), 'chsum', size, dict()]
+
+    def get_object_info3(self, params):
+        infos = list()
+        paths = list()
+        for spec in params['objects']:
+            try:
+                path = [self._find_object(step)[0] for step in spec['ref'].split(';')]
+                upa, obj = self._find_object(spec['ref'])
+                infos.append(self._object_info(upa, obj))
+                paths.append(path)
+            except ServiceError:
+                if not params.get('ignoreErrors'):
+                    raise
+                infos.append(None)
+                paths.append(None)
+        return {'infos': infos, 'paths': paths}
+
+    def get_objects2(self, params):
+        data = list()
+        for spec in params['objects']:
+            upa, obj = self._find_object(spec['ref'])
+            data.append({'info': self._object_info(upa, obj), 'refs': obj.get('refs', list()),
+                         'path': [upa]})
+        return {'data': data}
+
+    def get_workspace_info(self, params):
+        name = params.get('workspace') or params.get('id')
+        ws_id = self.workspaces.get(name, name)
+        if ws_id not in self.ws_names:
+            raise ServiceError('No workspace with name {} exists'.format(name))
+        return [ws_id, self.ws_names[ws_id], 'someuser', '2018-01-01T00:00:00+0000', 0, 'a',
+                'n', 'unlocked', dict()]
+
+    # --- file transfer ---
+    def _transfer(self, src, dest):
+        """
+        Copies src to dest, no faster than the bandwidth.
+        """
+        start = time.time()
+        shutil.copyfile(src, dest)
+        if self.bandwidth:
+            remaining = os.path.getsize(src) / float(self.bandwidth) - (time.time() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _download(self, ref, kind, dest_dir=None):
+        upa, obj = self._find_object(ref)
+        if kind not in obj:
+            raise ServiceError('Object {} has no {} file'.format(ref, kind))
+        dest_dir = dest_dir or self.scratch_dir
+        dest = os.path.join(dest_dir, '{}_{}'.format(uuid.uuid4().hex[:8],
+                                                    os.path.basename(obj[kind])))
+        self._transfer(obj[kind], dest)
+        return dest, obj
+
+    # --- SDK methods ---
+    def get_assembly_as_fasta(self, params):
+        path, obj = self._download(params['ref'], 'fasta')
+        return {'path': path, 'assembly_name': obj['name']}
+
+    def genome_to_gff(self, params):
+        path, _ = self._download(params['genome_ref'], 'gff')
+        return {'file_path': path}
+
+    def download_alignment(self, params):
+        dest_dir = os.path.join(self.scratch_dir, 'download_alignment_' + uuid.uuid4().hex)
+        os.makedirs(dest_dir)
+        self._download(params['source_ref'], 'bam', dest_dir=dest_dir)
+        return {'destination_dir': dest_dir, 'stats': dict()}
+
+    def file_to_shock(self, params):
+        path = params['file_path']
+        node_id = str(uuid.uuid4())
+        node_dir = os.path.join(self.shock_dir, node_id)
+        os.makedirs(node_dir)
+        if params.get('pack') == 'zip':
+            archive = shutil.make_archive(os.path.join(node_dir, '.pack'), 'zip', path)
+            node_file = os.path.join(node_dir, os.path.basename(path.rstrip('/')) + '.zip')
+            self._transfer(archive, node_file)
+            os.remove(archive)
+        else:
+            node_file = os.path.join(node_dir, os.path.basename(path))
+            self._transfer(path, node_file)
+        return {'shock_id': node_id, 'handle': None,
+                'node_file_name': os.path.basename(node_file),
+                'size': os.path.getsize(node_file)}
+
+    def create_extended_report(self, params):
+        ws_name = params.get('workspace_name')
+        ws_id = self.workspaces.get(ws_name, ws_name)
+        with self._lock:
+            ref = '{}/{}/1'.format(ws_id, 1000 + len(self.reports))
+            self.reports[ref] = params
+        return {'name': params.get('report_object_name', 'report'), 'ref': ref}
+
+    # --- JSON-RPC ---
+    def _run_job(self, job_id, func, params):
+        try:
+            result = {'finished': 1, 'result': [func(*params)]}
+        except Exception as e:
+            result = {'finished': 1, 'error': {'name': 'JSONRPCError', 'code': -32000,
+                                               'message': str(e),
+                                               'error': traceback.format_exc()}}
+        with self._lock:
+            self._jobs[job_id] = result
+
+    def dispatch(self, method, params):
+        """
+        Runs a JSON-RPC method, and returns its result list.
+        """
+        with self._lock:
+            self.call_counts[method] = self.call_counts.get(method, 0) + 1
+        module, name = method.split('.', 1)
+        if name == '_check_job':
+            with self._lock:
+                job = self._jobs.get(params[0], {'finished': 0})
+            if 'error' in job:
+                raise ServiceError(job['error']['message'])
+            return [job]
+        if name.startswith('_') and name.endswith('_submit'):
+            func = self.methods.get(module + '.' + name[1:-len('_submit')])
+            if func is None:
+                raise ServiceError('Unknown method {}'.format(method))
+            job_id = uuid.uuid4().hex
+            threading.Thread(target=self._run_job, args=(job_id, func, params)).start()
+            return [job_id]
+        if method not in self.methods:
+            raise ServiceError('Unknown method {}'.format(method))
+        return [self.methods[method](*params)]
+
+    def respond(self, body):
+        """
+        Returns the HTTP status and JSON-RPC response for a request body, which is a single
+        call or a batch (list) of them.
+        """
+        if isinstance(body, list):
+            if not self.batch:
+                return 500, {'version': '1.1', 'error': {
+                    'name': 'JSONRPCError', 'code': -32600, 'message': 'Batches not supported'}}
+            if self.batch is not True:
+                return self.batch
+            return 200, [self.respond(b)[1] for b in body]
+        try:
+            return 200, {'version': '1.1', 'id': body.get('id'),
+                         'result': self.dispatch(body['method'], body.get('params', []))}
+        except Exception as e:
+            return 500, {'version': '1.1', 'id': body.get('id'),
+                         'error': {'name': 'JSONRPCError', 'code': -32000, 'message': str(e),
+                                   'error': traceback.format_exc()}}
+
+    def start(self, port=0):
+        """
+        Starts serving on localhost in a background thread, and returns the URL.
+        """
+        services = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            # HTTP/1.1, so clients can keep their connections open between calls. The
+            # headers and body are written separately, so Nagle's algorithm would hold up
+            # every reply on a kept-alive connection.
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                if services.latency:
+                    time.sleep(services.latency)
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with services._lock:
+                    services.http_requests += 1
+                status, resp = services.respond(body)
+                out = json.dumps(resp)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self._server = Server(('localhost', port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://localhost:{}'.format(self._server.server_address[1])
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Local stand-in KBase services')
+    parser.add_argument('--fixtures', help='JSON file of workspaces and objects to serve')
+    parser.add_argument('--synthetic', choices=sorted(SCALES),
+                        help='serve synthetic data at this scale instead of a fixtures file')
+    parser.add_argument('--data-dir', default='/kb/module/work/benchmark_data',
+                        help='where synthetic data is made')
+    parser.add_argument('--scratch', default='/kb/module/work/tmp',
+                        help="the module's scratch directory, where downloads go")
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='delay before answering each request')
+    parser.add_argument('--bandwidth-mbps', type=float, default=None,
+                        help='file transfer speed limit in megabits per second')
+    args = parser.parse_args(argv)
+    if args.synthetic:
+        fixtures = synthetic_fixtures(args.data_dir, args.synthetic)
+    elif args.fixtures:
+        with open(args.fixtures) as f:
+            fixtures = json.load(f)
+    else:
+        parser.error('One of --fixtures or --synthetic is required')
+    bandwidth = args.bandwidth_mbps * 1000 * 1000 / 8 if args.bandwidth_mbps else None
+    services = LocalServices(fixtures, args.scratch, latency=args.latency_ms / 1000.0,
+                             bandwidth=bandwidth)
+    url = services.start(port=args.port)
+    print('Serving {} objects at {}'.format(len(services.objects), url))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        services.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
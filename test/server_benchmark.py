@@ -0,0 +1,121 @@
+"""
+Throughput benchmark for the module's built-in server: how long status calls take while
+builds are running.
+
+For each server mode (threads x processes), this starts the server, times status calls while
+it's idle, then starts some build_genome_browser calls and times status calls until the
+builds finish. The builds use synthetic FASTA, GFF, and BAM files, so no KBase services are
+needed, and authentication is turned off. With enough threads, status latency should stay
+about the same while the builds run.
+
+This needs the module's deploy config (KB_DEPLOYMENT_CONFIG), JBrowse, and samtools, as in
+the module's container. For example:
+    PYTHONPATH=../lib python server_benchmark.py --scale tiny --builds 2 --modes 1x1,8x1,4x2
+"""
+import argparse
+import shutil
+import sys
+import time
+from synthetic_data import make_inputs, SCALES
+from kb_GenomeBrowser import kb_GenomeBrowserServer
+from kb_GenomeBrowser.baseclient import BaseClient
+
+IDLE_STATUS_CALLS = 50
+STATUS_INTERVAL = 0.05
+
+
+def _time_status(client):
+    start = time.time()
+    client.call_method('kb_GenomeBrowser.status', [])
+    return time.time() - start
+
+
+def _summary(times):
+    times = sorted(times)
+    if not times:
+        return {'calls': 0, 'p50': None, 'p95': None, 'max': None}
+    return {
+        'calls': len(times),
+        'p50': times[len(times) // 2],
+        'p95': times[min(int(len(times) * 0.95), len(times) - 1)],
+        'max': times[-1]
+    }
+
+
+def run_mode(threads, processes, build_params, num_builds):
+    """
+    Runs the server with the given threads and processes, and returns the status call
+    latencies while idle and while num_builds builds run, and how long the builds took.
+    """
+    port = kb_GenomeBrowserServer.start_server(newprocess=True, threads=threads,
+                                               processes=processes)
+    url = 'http://localhost:{}'.format(port)
+    client = BaseClient(url, ignore_authrc=True, max_async_calls=num_builds)
+    try:
+        # wait for the server to come up
+        for _ in range(100):
+            try:
+                _time_status(client)
+                break
+            except Exception:
+                time.sleep(0.1)
+        idle = [_time_status(client) for _ in range(IDLE_STATUS_CALLS)]
+
+        start = time.time()
+        builds = [client.call_method_async('kb_GenomeBrowser.build_genome_browser',
+                                           [build_params]) for _ in range(num_builds)]
+        busy = list()
+        while not all(b.ready() for b in builds):
+            busy.append(_time_status(client))
+            time.sleep(STATUS_INTERVAL)
+        build_seconds = time.time() - start
+        for b in builds:
+            shutil.rmtree(b.get()['browser_dir'], ignore_errors=True)
+    finally:
+        client.close()
+        kb_GenomeBrowserServer.stop_server()
+    return {'idle': _summary(idle), 'busy': _summary(busy), 'build_seconds': build_seconds}
+
+
+def _ms(seconds):
+    return '-' if seconds is None else '{:.1f}'.format(seconds * 1000)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Built-in server throughput benchmark')
+    parser.add_argument('--scale', default='tiny', choices=sorted(SCALES),
+                        help='size of the synthetic genome to build')
+    parser.add_argument('--builds', type=int, default=2, help='builds to run at once')
+    parser.add_argument('--modes', default='1x1,8x1,4x2',
+                        help='comma separated server modes, as threads x processes')
+    parser.add_argument('--data-dir', default='/kb/module/work/benchmark_data',
+                        help='where the synthetic inputs are made and kept between runs')
+    args = parser.parse_args(argv)
+
+    # the benchmark runs offline, so there's no token to check
+    kb_GenomeBrowserServer.application.method_authentication[
+        'kb_GenomeBrowser.build_genome_browser'] = 'none'
+    genome_size, num_genes, depths = SCALES[args.scale]
+    inputs = make_inputs(args.data_dir, genome_size, num_genes, depths=depths)
+    build_params = {
+        'genome_input': {'fasta_file': inputs['fasta'], 'gff_file': inputs['gff']},
+        'alignment_inputs': [{'bam_file': f} for f in sorted(inputs['alignments'].values())]
+    }
+
+    lines = ['{:<8}{:>12}{:>12}{:>12}{:>12}{:>12}{:>12}'.format(
+        'mode', 'idle p50', 'idle p95', 'busy p50', 'busy p95', 'busy max', 'builds (s)')]
+    for mode in args.modes.split(','):
+        threads, processes = [int(x) for x in mode.split('x')]
+        print('Running {} builds with {} threads in {} processes...'.format(
+            args.builds, threads, processes))
+        r = run_mode(threads, processes, build_params, args.builds)
+        lines.append('{:<8}{:>12}{:>12}{:>12}{:>12}{:>12}{:>12.1f}'.format(
+            mode, _ms(r['idle']['p50']), _ms(r['idle']['p95']), _ms(r['busy']['p50']),
+            _ms(r['busy']['p95']), _ms(r['busy']['max']), r['build_seconds']))
+    print('status call latency (ms), {} {} builds at once'.format(args.builds, args.scale))
+    print('\n'.join(lines))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,160 @@
+"""
+Deterministic synthetic inputs for benchmarking the Genome Browser builds.
+
+Everything is made from a seeded random generator, so the same parameters always make the
+same files. Genomes are split into contigs of at most CONTIG_SIZE bases. Annotations are
+genes spread evenly over the contigs, each with an mRNA, two exons, and two CDS parts.
+Alignments are evenly spaced, fixed-length reads at a given depth, written as SAM and
+compressed to a sorted BAM with samtools.
+"""
+import os
+import random
+import subprocess
+
+CONTIG_SIZE = 50 * 1000 * 1000
+LINE_WIDTH = 60
+READ_LENGTH = 100
+# random bases are made once, then lines are taken from it at varying offsets, which is
+# plenty random for the builders and much faster than making every base.
+_BLOCK_SIZE = 1024 * 1024
+_BASES = 'ACGT'
+# benchmark scales: genome size (bp), number of genes, alignment depths
+SCALES = {
+    'tiny': (1000 * 1000, 10 * 1000, (5,)),
+    'small': (10 * 1000 * 1000, 50 * 1000, (5,)),
+    'medium': (100 * 1000 * 1000, 200 * 1000, (2,)),
+    'large': (1000 * 1000 * 1000, 2000 * 1000, (1,))
+}
+
+
+def contig_sizes(genome_size):
+    """
+    Returns a list of (contig name, length) for a genome of the given total size.
+    """
+    sizes = list()
+    remaining = genome_size
+    while remaining > 0:
+        size = min(CONTIG_SIZE, remaining)
+        sizes.append(('chr{}'.format(len(sizes) + 1), size))
+        remaining -= size
+    return sizes
+
+
+def write_fasta(path, genome_size, seed=1):
+    """
+    Writes a FASTA file with genome_size bases.
+    """
+    rng = random.Random(seed)
+    block = ''.join(rng.choice(_BASES) for _ in range(_BLOCK_SIZE))
+    max_offset = _BLOCK_SIZE - LINE_WIDTH
+    with open(path, 'w') as f:
+        for name, size in contig_sizes(genome_size):
+            f.write('>{}\n'.format(name))
+            lines = list()
+            for start in range(0, size, LINE_WIDTH):
+                offset = rng.randint(0, max_offset)
+                lines.append(block[offset:offset + min(LINE_WIDTH, size - start)])
+                if len(lines) == 10000:
+                    f.write('\n'.join(lines) + '\n')
+                    lines = list()
+            if lines:
+                f.write('\n'.join(lines) + '\n')
+
+
+def write_gff(path, genome_size, num_genes, seed=1):
+    """
+    Writes a GFF3 file with num_genes genes (each with an mRNA, 2 exons and 2 CDS) spread
+    over the contigs of a genome_size genome.
+    """
+    rng = random.Random(seed)
+    contigs = contig_sizes(genome_size)
+    spacing = max(genome_size // max(num_genes, 1), 10)
+    gene_num = 0
+    with open(path, 'w') as f:
+        f.write('##gff-version 3\n')
+        for name, size in contigs:
+            contig_genes = min(num_genes - gene_num, size // spacing)
+            for idx in range(contig_genes):
+                gene_num += 1
+                start = idx * spacing + 1
+                length = rng.randint(max(spacing // 4, 4), max(spacing - 1, 4))
+                end = min(start + length - 1, size)
+                mid = (start + end) // 2
+                strand = rng.choice('+-')
+                gene_id = 'gene{}'.format(gene_num)
+                mrna_id = 'mRNA{}'.format(gene_num)
+                rows = [
+                    ('gene', start, end, 'ID={0};Name={0}'.format(gene_id)),
+                    ('mRNA', start, end, 'ID={};Parent={}'.format(mrna_id, gene_id)),
+                    ('exon', start, mid, 'ID={}.exon1;Parent={}'.format(mrna_id, mrna_id)),
+                    ('exon', mid + 1, end, 'ID={}.exon2;Parent={}'.format(mrna_id, mrna_id)),
+                    ('CDS', start, mid, 'ID={}.cds;Parent={}'.format(mrna_id, mrna_id)),
+                    ('CDS', mid + 1, end, 'ID={}.cds;Parent={}'.format(mrna_id, mrna_id))
+                ]
+                f.write(''.join('{}\tsynthetic\t{}\t{}\t{}\t.\t{}\t.\t{}\n'.format(
+                    name, ftype, fstart, fend, strand, attrs)
+                    for ftype, fstart, fend, attrs in rows if fstart <= fend))
+    return gene_num
+
+
+def write_bam(path, genome_size, depth, seed=1):
+    """
+    Writes a sorted BAM file of READ_LENGTH reads covering a genome_size genome at about the
+    given depth. Needs samtools on the PATH. Returns the number of reads.
+    """
+    rng = random.Random(seed)
+    contigs = contig_sizes(genome_size)
+    read_seq = ''.join(rng.choice(_BASES) for _ in range(READ_LENGTH))
+    read_qual = 'I' * READ_LENGTH
+    step = max(int(READ_LENGTH / float(depth)), 1)
+    proc = subprocess.Popen(['samtools', 'view', '-b', '-o', path, '-'], stdin=subprocess.PIPE)
+    num_reads = 0
+    try:
+        header = ['@HD\tVN:1.4\tSO:coordinate']
+        header.extend('@SQ\tSN:{}\tLN:{}'.format(name, size) for name, size in contigs)
+        proc.stdin.write('\n'.join(header) + '\n')
+        for name, size in contigs:
+            lines = list()
+            for pos in range(1, size - READ_LENGTH + 2, step):
+                num_reads += 1
+                lines.append('r{}\t{}\t{}\t{}\t60\t{}M\t*\t0\t0\t{}\t{}'.format(
+                    num_reads, rng.choice((0, 16)), name, pos, READ_LENGTH, read_seq, read_qual))
+                if len(lines) == 10000:
+                    proc.stdin.write('\n'.join(lines) + '\n')
+                    lines = list()
+            if lines:
+                proc.stdin.write('\n'.join(lines) + '\n')
+    finally:
+        proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError('samtools failed to write {}'.format(path))
+    return num_reads
+
+
+def make_inputs(data_dir, genome_size, num_genes, depths=(), seed=1):
+    """
+    Makes (or reuses, if they're already there) the FASTA, GFF, and a BAM for each depth in
+    data_dir. Returns a dict with the fasta and gff paths, and a dict of alignments with
+    name -> BAM path.
+    """
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    prefix = os.path.join(data_dir, 'synthetic_{}bp_seed{}'.format(genome_size, seed))
+    files = {
+        'fasta': prefix + '.fa',
+        'gff': '{}_{}genes.gff'.format(prefix, num_genes),
+        'alignments': dict()
+    }
+    if not os.path.exists(files['fasta']):
+        write_fasta(files['fasta'] + '.tmp', genome_size, seed=seed)
+        os.rename(files['fasta'] + '.tmp', files['fasta'])
+    if not os.path.exists(files['gff']):
+        write_gff(files['gff'] + '.tmp', genome_size, num_genes, seed=seed)
+        os.rename(files['gff'] + '.tmp', files['gff'])
+    for depth in depths:
+        bam_file = '{}_depth{}.bam'.format(prefix, depth)
+        if not os.path.exists(bam_file):
+            write_bam(bam_file + '.tmp', genome_size, depth, seed=seed)
+            os.rename(bam_file + '.tmp', bam_file)
+        files['alignments']['depth_{}'.format(depth)] = bam_file
+    return files